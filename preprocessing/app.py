@@ -1,52 +1,177 @@
 import streamlit as st
-import os
+import time
 
 # from boto_testing import titan_multimodal_embedding
 from upsert_vectors import titan_text_embedding
-from claude_utils import ask_claude_vqa_response
-from config import index_name
-
-# Initialize Pinecone
-from pinecone import Pinecone
+from claude_utils import stream_claude_vqa_response
+from config import (
+    CONTEXT_TOP_K,
+    FIRST_STAGE_DIMENSION,
+    HYBRID_CANDIDATES,
+    HYBRID_SPARSE_WEIGHT,
+    RETRIEVAL_MODE,
+    index_name,
+)
+from context_expansion import VideoFrameIndex, expand_context
+from query_cache import QueryCache
+from prompt_images import get_prompt_image_cache
+from sparse_index import SparseIndex, fuse_matches, sparse_index_path
+from tracing import capture, span
+from clients import (
+    get_anthropic_client,
+    get_bedrock_runtime,
+    get_vector_index,
+    vector_index_key,
+)
 from dotenv import load_dotenv
 
 load_dotenv()
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-# Define the Pinecone index name
-index_name = "test-vqa"
-index = pc.Index(index_name)
+
+@st.cache_resource
+def get_clients():
+    # built once per server and shared by every session and rerun, so connections stay open between queries
+    # the index is Pinecone's, or the local one when VECTOR_STORE=local; with RETRIEVAL_MODE=titan256, int8 or
+    # binary it is a compact first stage reranked with the full vectors (upserted with the same --mode)
+    return get_vector_index(index_name), get_anthropic_client(), get_bedrock_runtime()
+
+
+index, claude_client, bedrock_client = get_clients()
+
+
+def load_local_indexes():
+    # the keyword index, and the frames of each video from the same records, for adding neighbouring frames
+    sparse = SparseIndex.load(sparse_index_path(vector_index_key(index_name)))
+    return {
+        "index": sparse,
+        "frames": VideoFrameIndex(
+            {"id": i, "metadata": m} for i, m in zip(sparse.ids, sparse.metadata)
+        ),
+    }
+
+
+@st.cache_resource
+def get_sparse_index():
+    # a mutable holder, so an upsert can swap in the rebuilt indexes for every session at once
+    return load_local_indexes()
+
+
+sparse_holder = get_sparse_index()
+
+
+def on_index_change():
+    # frames may have been re-extracted, so their prompt images are reloaded, and a local index and the
+    # keyword index are read back from disk to pick up what the upsert wrote
+    get_prompt_image_cache().clear_memory()
+    if hasattr(index, "reload"):
+        index.reload()
+    sparse_holder.update(load_local_indexes())
+
+
+@st.cache_resource
+def get_query_cache():
+    # one cache for the whole server, so every session benefits from the questions others asked
+    return QueryCache(vector_index_key(index_name), on_change=on_index_change)
+
+
+query_cache = get_query_cache()
 
 # Streamlit app
 st.title("Visual QA over Videos with Pinecone, Claude and AWS")
 
 # Input text for query
 query_text = st.text_input("Enter text to query the Pinecone index:")
+# share of the keyword (BM25) scores in the ranking; exact names and codes match better with a higher weight
+sparse_weight = st.sidebar.slider(
+    "Keyword weight", min_value=0.0, max_value=1.0, value=HYBRID_SPARSE_WEIGHT, step=0.05
+)
 
 if st.button("Query"):
     if query_text:
-        # Embed the query
-        query_embedding = titan_text_embedding(text=query_text)
-
-        response = index.query(
-            vector=query_embedding["embedding"], top_k=5, include_metadata=True
-        )
-
-        # st.write(response)
-        for r in response["matches"]:
-            with st.expander(f"Match with Score: {r['score']}"):
-                st.markdown(f"**Score:** {r['score']}")
-                st.image(r["metadata"]["filepath"], caption="Matched Image")
-                st.markdown(f"**Transcript:** {r['metadata']['transcript']}")
-                st.markdown(
-                    f"**Contextual Frame Description:** {r['metadata']['contextual_frame_description']}"
+        # every span of this query, for the latency breakdown under the answer
+        with capture() as spans, span("query"):
+            started = time.perf_counter()
+            # Embed the query
+            query_embedding, embedding_cached = query_cache.embed(
+                query_text,
+                lambda text: titan_text_embedding(text=text, client=bedrock_client)["embedding"],
+            )
+            # the 256-dimensional first stage is searched with a 256-dimensional embedding of the query
+            first_stage_embedding = None
+            if RETRIEVAL_MODE == "titan256":
+                first_stage_embedding, _ = query_cache.embed(
+                    query_text,
+                    lambda text: titan_text_embedding(
+                        text=text, dimension=FIRST_STAGE_DIMENSION, client=bedrock_client
+                    )["embedding"],
+                    variant=FIRST_STAGE_DIMENSION,
                 )
-                st.markdown(f"**Timestamp Start:** {r['metadata']['timestamp_start']}")
-                st.markdown(f"**Timestamp End:** {r['metadata']['timestamp_end']}")
 
-        # ask claude for an explanation of the returned results.
+            # dense and keyword candidates, fused into the best CONTEXT_TOP_K matches
+            dense_matches, results_cached = query_cache.query(
+                index,
+                query_embedding,
+                top_k=HYBRID_CANDIDATES if sparse_weight else CONTEXT_TOP_K,
+                first_stage_vector=first_stage_embedding,
+            )
+            sparse_matches = (
+                sparse_holder["index"].query(query_text, top_k=HYBRID_CANDIDATES)["matches"]
+                if sparse_weight
+                else []
+            )
+            matches = fuse_matches(
+                dense_matches, sparse_matches, top_k=CONTEXT_TOP_K, sparse_weight=sparse_weight
+            )
+            # consecutive frames of a video become one segment with one image, within the prompt budget
+            matches = expand_context(matches, sparse_holder["frames"])
+            st.caption(
+                f"Retrieved in {(time.perf_counter() - started) * 1000:.0f} ms "
+                f"(embedding {'cached' if embedding_cached else 'computed'}, "
+                f"matches {'cached' if results_cached else 'queried'})"
+            )
+
+            # st.write(response)
+            for r in matches:
+                with st.expander(f"Match with Score: {r['score']} ({len(r['hit_ids'])} matched frames)"):
+                    st.markdown(f"**Score:** {r['score']}")
+                    st.markdown(
+                        f"**Dense score:** {r['dense_score']} | **Keyword score:** {r['sparse_score']}"
+                    )
+                    st.image(r["metadata"]["filepath"], caption="Matched Image")
+                    st.markdown(f"**Transcript:** {r['metadata']['transcript']}")
+                    st.markdown(
+                        f"**Contextual Frame Description:** {r['metadata']['contextual_frame_description']}"
+                    )
+                    st.markdown(f"**Timestamp Start:** {r['metadata']['timestamp_start']}")
+                    st.markdown(f"**Timestamp End:** {r['metadata']['timestamp_end']}")
+
+            # ask claude for an explanation of the returned results.
+
+            # the answer is streamed into the page as it is written rather than shown once complete
+            st.markdown("**Claude Explanation:**")
+            answer_timings = {}
+            st.write_stream(
+                stream_claude_vqa_response(
+                    query_text, matches, client=claude_client, timings=answer_timings
+                )
+            )
+            st.caption(
+                f"First token after {answer_timings['ttft_s'] * 1000:.0f} ms, "
+                f"answer complete after {answer_timings['total_s'] * 1000:.0f} ms"
+                + (" (cached)" if answer_timings["cached"] else "")
+            )
 
-        claude_explanation = ask_claude_vqa_response(query_text, response["matches"])
-        st.markdown(f"**Claude Explanation:** {claude_explanation}")
+        with st.expander("Latency breakdown"):
+            st.table(
+                [
+                    {
+                        "stage": s.name,
+                        "ms": round(s.duration_s * 1000, 1),
+                        **s.attrs,
+                        **s.counters,
+                    }
+                    for s in spans
+                ]
+            )
     else:
         st.write("Please enter text or image path to query.")
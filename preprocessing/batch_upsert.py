@@ -0,0 +1,121 @@
+# Streaming upsert into a vector index. Records are pulled lazily from a generator, grouped into fixed-size
+# batches and sent by a bounded pool of workers, so memory stays flat no matter how large the corpus is.
+# A failed batch is retried on its own without holding up or redoing the others.
+
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from config import UPSERT_BATCH_SIZE, UPSERT_MAX_RETRIES, UPSERT_MAX_WORKERS
+from tracing import get_tracer, span
+
+logger = logging.getLogger(__name__)
+
+
+def batched(records, batch_size):
+    iterator = iter(records)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def _with_retries(fn, what, max_retries, name):
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as exc:
+            if attempt == max_retries:
+                raise
+            delay = random.uniform(0, min(30.0, 2**attempt))
+            logger.warning("%s failed (%s), retrying in %.2fs", what, exc, delay)
+            get_tracer().count(name, retries=1)
+            time.sleep(delay)
+
+
+def upsert_batches(
+    index,
+    tagged_records,
+    batch_size=UPSERT_BATCH_SIZE,
+    max_workers=UPSERT_MAX_WORKERS,
+    max_retries=UPSERT_MAX_RETRIES,
+):
+    """
+    Upserts a stream of records in parallel batches.
+
+    Records are tagged (e.g. with the video they belong to) and a batch never mixes tags, so the caller can
+    tell exactly which groups of records made it into the index.
+
+    Args:
+        index: Anything with an `upsert(vectors=...)` method, such as a Pinecone index.
+        tagged_records (iterable): (tag, record) pairs, where each record is a dict with id, values and metadata.
+            Records of the same tag must be consecutive.
+        batch_size (int): Number of vectors per upsert request.
+        max_workers (int): Maximum number of batches in flight at once.
+        max_retries (int): Retries for a failed batch before it is given up on.
+
+    Returns:
+        tuple: The set of tags that were fully upserted, and the set of tags with at least one failed batch.
+    """
+    seen, failed = set(), set()
+    # bound the number of batches held in memory: the ones in flight plus one queued per worker
+    slots = threading.BoundedSemaphore(max_workers * 2)
+    lock = threading.Lock()
+    upserted = 0
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(
+        unit="vector", desc="upserting"
+    ) as progress:
+
+        def send(tag, batch):
+            nonlocal upserted
+            try:
+                with span("upsert.batch", tag=str(tag)) as s:
+                    s.add(vectors=len(batch))
+                    _with_retries(
+                        lambda: index.upsert(vectors=batch),
+                        f"Upsert of {len(batch)} vectors",
+                        max_retries,
+                        "upsert.batch",
+                    )
+                with lock:
+                    upserted += len(batch)
+                    progress.update(len(batch))
+                    progress.set_postfix(
+                        vectors_per_s=f"{upserted / (time.monotonic() - started):.0f}"
+                    )
+            except Exception:
+                logger.exception("Giving up on a batch of %d vectors for %s", len(batch), tag)
+                with lock:
+                    failed.add(tag)
+            finally:
+                slots.release()
+
+        for tag, group in itertools.groupby(tagged_records, key=lambda pair: pair[0]):
+            seen.add(tag)
+            for batch in batched((record for _, record in group), batch_size):
+                slots.acquire()
+                executor.submit(send, tag, batch)
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Upserted {upserted} vectors in {elapsed:.1f}s ({upserted / max(elapsed, 1e-9):.0f} vectors/s)"
+    )
+    return seen - failed, failed
+
+
+def delete_ids(index, ids, batch_size=1000, max_retries=UPSERT_MAX_RETRIES):
+    """Deletes vectors by id, in batches no larger than Pinecone accepts per request."""
+    for batch in batched(ids, batch_size):
+        with span("delete.batch") as s:
+            s.add(vectors=len(batch))
+            _with_retries(
+                lambda: index.delete(ids=batch),
+                f"Delete of {len(batch)} vectors",
+                max_retries,
+                "delete.batch",
+            )
@@ -0,0 +1,118 @@
+# Measures the per-call overhead of building service clients on every call, as the Claude helpers used to,
+# against reusing the pooled clients from clients.py. By default Claude calls go to a local stand-in for the
+# Bedrock endpoint, so the numbers isolate client construction, credential resolution and connection setup;
+# pass --live to send minimal requests to the real Bedrock endpoint, which adds TLS handshakes to the
+# difference. Run with `python preprocessing/benchmark_clients.py`.
+
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from anthropic import AnthropicBedrock
+
+from claude_utils import MODEL
+from clients import make_anthropic_client, make_bedrock_runtime
+
+CANNED_MESSAGE = {
+    "id": "msg_benchmark",
+    "type": "message",
+    "role": "assistant",
+    "model": MODEL,
+    "content": [{"type": "text", "text": "ok"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 1, "output_tokens": 1},
+}
+
+
+class _BedrockStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; without this, delayed ACKs add ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(CANNED_MESSAGE).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BedrockStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def time_calls(fn, calls):
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:<40} mean {statistics.mean(timings):8.2f} ms   "
+        f"p50 {statistics.median(timings):8.2f} ms   max {max(timings):8.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="call the real Bedrock endpoint with the default AWS credentials (each call costs a few tokens)",
+    )
+    args = parser.parse_args()
+
+    client_kwargs = {}
+    if not args.live:
+        server, base_url = start_stand_in()
+        client_kwargs = {"base_url": base_url}
+        # credentials are still resolved on every call, as they would be against Bedrock
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+    request = {
+        "model": MODEL,
+        "max_tokens": 1,
+        "messages": [{"role": "user", "content": "Say ok"}],
+    }
+
+    def fresh_client_call():
+        AnthropicBedrock(aws_region="us-east-1", **client_kwargs).messages.create(**request)
+
+    shared = make_anthropic_client(**client_kwargs)
+
+    def shared_client_call():
+        shared.messages.create(**request)
+
+    # warm up imports and the shared pool so neither side pays one-off costs
+    fresh_client_call()
+    shared_client_call()
+
+    print(f"{args.calls} calls each, {'live Bedrock' if args.live else 'local Bedrock stand-in'}")
+    fresh = time_calls(fresh_client_call, args.calls)
+    pooled = time_calls(shared_client_call, args.calls)
+    report("Claude, new AnthropicBedrock per call", fresh)
+    report("Claude, shared pooled client", pooled)
+    print(
+        f"{'':<40} overhead saved {statistics.mean(fresh) - statistics.mean(pooled):.2f} ms per call"
+    )
+
+    bedrock_runtime = time_calls(make_bedrock_runtime, max(1, args.calls // 5))
+    report("boto3 bedrock-runtime client creation", bedrock_runtime)
@@ -0,0 +1,200 @@
+# Benchmark of the on-disk format of the enriched frames, as read by the embedding and upsert stages. The old
+# format is one finalized_data.json holding every enriched frame plus a .npy embedding matrix per video; the new
+# one is a Parquet frame table per video with an embedding column. Each read runs in a fresh process so its
+# wall time and peak memory are measured on their own. Run with
+# `python preprocessing/benchmark_frame_table.py --frames 200000`; the JSON side of a 200k-frame corpus needs
+# about 4 GB of memory. Linux only, as memory is read from /proc.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from config import data_dir
+from frame_table import ENRICHED_COLUMNS, FrameTableWriter, iter_frames, read_column, schema
+from upsert_vectors import RECORD_COLUMNS
+
+FRAMES_PER_VIDEO = 1000
+
+
+def synthetic_videos(n, dimension, seed=0):
+    """Yields (video, frames, embeddings) of n enriched frames with text about as long as real ones."""
+    rng = np.random.default_rng(seed)
+    for first in range(0, n, FRAMES_PER_VIDEO):
+        video = f"video_{first // FRAMES_PER_VIDEO:06d}"
+        count = min(FRAMES_PER_VIDEO, n - first)
+        summary = f"summary of {video} " * 40
+        frames = [
+            {
+                "video_id": video,
+                "index": i,
+                "frame_path": f"data/frames/{video}/frame_{i + 1:04d}.png",
+                "timestamp": (i * 45.0, i * 45.0 + 45.0),
+                "words": f"words spoken in frame {i} of {video} " * 20,
+                "transcript_summary": summary,
+                "contextual_frame_description": f"description of frame {i} of {video} " * 30,
+            }
+            for i in range(count)
+        ]
+        yield video, frames, rng.standard_normal((count, dimension)).astype(np.float32)
+
+
+def write_corpus(n, dimension, workdir):
+    json_dir, table_dir = os.path.join(workdir, "json"), os.path.join(workdir, "tables")
+    os.makedirs(json_dir)
+    os.makedirs(table_dir)
+    # the JSON file is written record by record, so generating it does not need the memory reading it does
+    with open(os.path.join(json_dir, "finalized_data.json"), "w") as f:
+        f.write("[")
+        for number, (video, frames, embeddings) in enumerate(synthetic_videos(n, dimension)):
+            for i, frame in enumerate(frames):
+                f.write(("," if number or i else "") + json.dumps(frame))
+            np.save(os.path.join(json_dir, f"{video}_embeddings.npy"), embeddings)
+            with FrameTableWriter(
+                os.path.join(table_dir, f"{video}_embedded.parquet"), schema(ENRICHED_COLUMNS, dimension)
+            ) as writer:
+                writer.write(frames, embeddings)
+        f.write("]")
+    return json_dir, table_dir
+
+
+def size_on_disk(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+def _record(frame, embedding):
+    # the per-frame work of iter_video_records, so both formats produce the same records
+    return {
+        "values": embedding.tolist(),
+        "metadata": {
+            "transcript": frame["words"],
+            "filepath": frame["frame_path"],
+            "timestamp_start": frame["timestamp"][0],
+            "timestamp_end": frame["timestamp"][1],
+            "contextual_frame_description": frame["contextual_frame_description"],
+        },
+    }
+
+
+def json_texts(folder):
+    with open(os.path.join(folder, "finalized_data.json"), "r") as f:
+        return len([frame["contextual_frame_description"] for frame in json.load(f)])
+
+
+def table_texts(folder):
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    return len(read_column(paths, "contextual_frame_description"))
+
+
+def json_records(folder):
+    with open(os.path.join(folder, "finalized_data.json"), "r") as f:
+        frames = json.load(f)
+    count, embeddings, video = 0, None, None
+    for frame in frames:
+        if frame["video_id"] != video:
+            video = frame["video_id"]
+            embeddings = np.load(os.path.join(folder, f"{video}_embeddings.npy"))
+        _record(frame, embeddings[frame["index"]])
+        count += 1
+    return count
+
+
+def table_records(folder):
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    count = 0
+    for frame, embedding in iter_frames(paths, RECORD_COLUMNS):
+        _record(frame, embedding)
+        count += 1
+    return count
+
+
+TASKS = {
+    "texts_json": (json_texts, "json"),
+    "texts_table": (table_texts, "tables"),
+    "records_json": (json_records, "json"),
+    "records_table": (table_records, "tables"),
+}
+
+
+def _rss_kib():
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _measure(task, folder, results):
+    # ru_maxrss is in KiB on Linux; the memory held after the imports is subtracted so only the read is counted
+    before = _rss_kib()
+    started = time.perf_counter()
+    rows = TASKS[task][0](folder)
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({"rows": rows, "seconds": seconds, "peak_mib": (peak - before) / 1024})
+
+
+def measure(task, folder):
+    results = multiprocessing.get_context("spawn").Queue()
+    process = multiprocessing.get_context("spawn").Process(target=_measure, args=(task, folder, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return {
+        "seconds": round(result["seconds"], 3),
+        "peak_mib": round(result["peak_mib"], 1),
+        "rows": result["rows"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200_000)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="JSON file for the results (default: data/benchmarks/frame_table_<timestamp>.json)",
+    )
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(
+        data_dir, "benchmarks", f"frame_table_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    workdir = tempfile.mkdtemp(prefix="frame-table-benchmark-")
+    try:
+        folders = dict(zip(("json", "tables"), write_corpus(args.frames, args.dimension, workdir)))
+        results = {
+            "bytes_on_disk": {name: size_on_disk(folder) for name, folder in folders.items()},
+        }
+        for task, (_, fmt) in TASKS.items():
+            results[task] = measure(task, folders[fmt])
+            print(
+                f"{task:>14}: {results[task]['seconds']:.2f} s, peak {results[task]['peak_mib']:.0f} MiB "
+                f"over {results[task]['rows']} frames"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "machine": {
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "cpus": os.cpu_count(),
+                },
+                "settings": vars(args),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {output}")
@@ -0,0 +1,309 @@
+# Retrieval benchmark on synthetic corpora. For each corpus size it generates frame records shaped like the ones
+# upsert_vectors.py builds, ingests them through the streaming batch upsert into a local index, then times queries
+# through the app's retrieval path (QueryCache in front of index.query) and measures recall@k against exact
+# search. Results are written as JSON so they can be compared between releases. Run with
+# `python preprocessing/benchmark_retrieval.py --sizes 10000 100000 1000000`; the 1M corpus at 1024 dimensions
+# needs about 10 GB of memory.
+#
+# Besides the exact and IVF local indexes, the two-stage variants index int8 or binary quantized vectors, or
+# 256-dimensional ones, and rerank their candidates with the full vectors. Synthetic records have no Titan
+# 256-dimensional embedding, so "dim256" stands it in with a random projection of the full vector; it shows the
+# cost of the smaller first stage, not the quality of Titan's own 256-dimensional embeddings.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from batch_upsert import upsert_batches
+from config import FIRST_STAGE_DIMENSION, RERANK_CANDIDATES, data_dir
+from index_state import make_vector_id
+from query_cache import QueryCache
+from two_stage import TwoStageIndex
+from vector_store import QUERY_BLOCK_ROWS, LocalVectorStore
+
+VARIANTS = ("exact", "ivf", "int8", "binary", "dim256")
+
+# frames per synthetic video; frames of one video sit close together, as frames of one talk do
+FRAMES_PER_VIDEO = 200
+
+
+def synthetic_records(n, dimension, seed=0):
+    """
+    Yields (video, record) pairs of n frames, with embeddings that drift slowly around a per-video direction.
+    """
+    rng = np.random.default_rng(seed)
+    for first in range(0, n, FRAMES_PER_VIDEO):
+        video = f"video_{first // FRAMES_PER_VIDEO:06d}"
+        count = min(FRAMES_PER_VIDEO, n - first)
+        centre = rng.standard_normal(dimension).astype(np.float32)
+        drift = np.cumsum(rng.standard_normal((count, dimension)).astype(np.float32) * 0.15, axis=0)
+        vectors = centre + drift + rng.standard_normal((count, dimension)).astype(np.float32) * 0.5
+        for i in range(count):
+            start = i * 45.0
+            yield video, {
+                "id": make_vector_id(video, start),
+                "values": vectors[i],
+                "metadata": {
+                    "video_id": video,
+                    "transcript": f"words spoken in frame {i} of {video}",
+                    "filepath": f"data/frames/{video}/frame_{i + 1:04d}.png",
+                    "timestamp_start": start,
+                    "timestamp_end": start + 45.0,
+                    "contextual_frame_description": f"description of frame {i} of {video}",
+                },
+            }
+
+
+def labelled_queries(index_path, n_queries, noise, seed=1):
+    """
+    Queries made by perturbing stored vectors, labelled with the id they came from.
+
+    Returns:
+        tuple: The (n_queries, dimension) query matrix and the source ids.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+    with open(os.path.join(index_path, "records.json"), "r") as f:
+        ids = [r["id"] for r in json.load(f)]
+    rows = np.sort(rng.choice(len(ids), n_queries, replace=False))
+    queries = np.asarray(vectors[rows]) + rng.standard_normal(
+        (n_queries, vectors.shape[1])
+    ).astype(np.float32) * noise / np.sqrt(vectors.shape[1])
+    return queries, [ids[row] for row in rows]
+
+
+def exact_top_k(index_path, queries, k):
+    # ground truth straight from the saved matrix, independently of the store's query code
+    vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+    with open(os.path.join(index_path, "records.json"), "r") as f:
+        ids = [r["id"] for r in json.load(f)]
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = np.concatenate(
+        [
+            np.asarray(vectors[start : start + QUERY_BLOCK_ROWS]) @ queries.T
+            for start in range(0, len(vectors), QUERY_BLOCK_ROWS)
+        ]
+    )
+    top = np.argpartition(-scores, k - 1, axis=0)[:k].T
+    return [{ids[row] for row in rows} for rows in top]
+
+
+def percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(np.mean(samples_ms)), 3),
+    }
+
+
+def open_index(variant, index_path, dimension):
+    """
+    The local index of a benchmark variant, or for a two-stage variant a TwoStageIndex over a first stage in
+    `index_path`/first_stage and the full vectors in `index_path`/rerank.
+    """
+    if variant in ("exact", "ivf"):
+        return LocalVectorStore(index_path, dimension, ann=None if variant == "exact" else variant)
+    if variant == "dim256":
+        first_stage = LocalVectorStore(os.path.join(index_path, "first_stage"), FIRST_STAGE_DIMENSION, ann=None)
+    else:
+        first_stage = LocalVectorStore(
+            os.path.join(index_path, "first_stage"), dimension, ann=None, quantization=variant
+        )
+    return TwoStageIndex(first_stage, LocalVectorStore(os.path.join(index_path, "rerank"), dimension, ann=None))
+
+
+def size_on_disk(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names)
+
+
+def run(size, dimension, variant, n_queries, k, noise, workdir, candidates=RERANK_CANDIDATES):
+    index_path = os.path.join(workdir, f"{size}_{variant}")
+    two_stage = variant not in ("exact", "ivf")
+    # stand-in for the 256-dimensional embeddings: a random projection, which roughly preserves angles
+    projection = None
+    if variant == "dim256":
+        rng = np.random.default_rng(2)
+        projection = rng.standard_normal((dimension, FIRST_STAGE_DIMENSION)).astype(np.float32)
+
+    def records():
+        for video, record in synthetic_records(size, dimension):
+            if projection is not None:
+                record["first_stage_values"] = record["values"] @ projection
+            yield video, record
+
+    store = open_index(variant, index_path, dimension)
+    started = time.perf_counter()
+    upserted, failed = upsert_batches(store, records())
+    upsert_s = time.perf_counter() - started
+    started = time.perf_counter()
+    store.save()
+    save_s = time.perf_counter() - started
+    if failed:
+        raise RuntimeError(f"Upsert failed for {len(failed)} videos")
+
+    started = time.perf_counter()
+    store = open_index(variant, index_path, dimension)
+    load_s = time.perf_counter() - started
+    if two_stage:
+        store.candidates = candidates
+
+    # queries and ground truth come from the full float vectors, wherever they are kept
+    full_path = os.path.join(index_path, "rerank") if two_stage else index_path
+    queries, labels = labelled_queries(full_path, n_queries, noise)
+    truth = exact_top_k(full_path, queries, k)
+    first_stage_queries = queries @ projection if projection is not None else [None] * len(queries)
+
+    # every query misses the cache, so this measures the index; a second pass measures cache hits
+    cache = QueryCache(f"benchmark-{size}-{variant}", root=workdir)
+    miss_ms, hit_ms, recalls, first_stage_recalls, label_hits = [], [], [], [], 0
+    for query, first_stage_query, label, expected in zip(queries, first_stage_queries, labels, truth):
+        started = time.perf_counter()
+        matches, _ = cache.query(store, query, top_k=k, first_stage_vector=first_stage_query)
+        miss_ms.append((time.perf_counter() - started) * 1000)
+        found = {m["id"] for m in matches}
+        recalls.append(len(found & expected) / k)
+        label_hits += label in found
+        if two_stage:
+            # what the compact index alone would have returned, without the rerank
+            first_stage = store.first_stage.query(
+                vector=query if first_stage_query is None else first_stage_query, top_k=k
+            )["matches"]
+            first_stage_recalls.append(len({m["id"] for m in first_stage} & expected) / k)
+    for query, first_stage_query in zip(queries, first_stage_queries):
+        started = time.perf_counter()
+        cache.query(store, query, top_k=k, first_stage_vector=first_stage_query)
+        hit_ms.append((time.perf_counter() - started) * 1000)
+
+    filtered_ms = []
+    for query, first_stage_query in list(zip(queries, first_stage_queries))[: min(100, n_queries)]:
+        extra = {"first_stage_vector": first_stage_query} if first_stage_query is not None else {}
+        started = time.perf_counter()
+        store.query(
+            vector=query, top_k=k, filter={"video_id": {"$in": ["video_000000", "video_000001"]}}, **extra
+        )
+        filtered_ms.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        "size": size,
+        "dimension": dimension,
+        "index": variant,
+        "ingest": {
+            "upsert_s": round(upsert_s, 3),
+            "save_s": round(save_s, 3),
+            "vectors_per_s": round(size / (upsert_s + save_s), 1),
+            "load_s": round(load_s, 3),
+            "bytes_on_disk": size_on_disk(index_path),
+            # the vector matrix alone (of the first stage for two-stage variants), without the metadata
+            "vector_bytes": os.path.getsize(
+                os.path.join(index_path, "first_stage" if two_stage else "", "vectors.npy")
+            ),
+        },
+        "query": percentiles(miss_ms),
+        "query_cached": percentiles(hit_ms),
+        "query_filtered": percentiles(filtered_ms),
+        f"recall_at_{k}": round(float(np.mean(recalls)), 4),
+        "source_hit_rate": round(label_hits / n_queries, 4),
+    }
+    if two_stage:
+        # the first stage is what has to stay hot; the full vectors are only read for the candidates
+        result["ingest"]["first_stage_bytes"] = size_on_disk(os.path.join(index_path, "first_stage"))
+        result["ingest"]["rerank_bytes"] = size_on_disk(os.path.join(index_path, "rerank"))
+        result["rerank_candidates"] = candidates
+        result[f"first_stage_recall_at_{k}"] = round(float(np.mean(first_stage_recalls)), 4)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument(
+        "--indexes",
+        nargs="+",
+        choices=VARIANTS,
+        default=list(VARIANTS),
+        help="local index variants to benchmark; int8, binary and dim256 are two-stage, reranked with full vectors",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=RERANK_CANDIDATES,
+        help="first-stage candidates reranked per query by the two-stage variants",
+    )
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument(
+        "--noise", type=float, default=0.5, help="norm of the noise added to stored vectors to make queries"
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="JSON file for the results (default: data/benchmarks/retrieval_<timestamp>.json)",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the generated indexes instead of deleting them"
+    )
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(
+        data_dir, "benchmarks", f"retrieval_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    workdir = tempfile.mkdtemp(prefix="retrieval-benchmark-")
+    results = []
+    try:
+        for size in args.sizes:
+            for variant in args.indexes:
+                result = run(
+                    size,
+                    args.dimension,
+                    variant,
+                    min(args.queries, size),
+                    args.top_k,
+                    args.noise,
+                    workdir,
+                    args.candidates,
+                )
+                results.append(result)
+                ingest = result["ingest"]
+                print(
+                    f"{size:>9} {result['index']:>6}: ingest {ingest['vectors_per_s']:.0f} vectors/s, "
+                    f"{ingest['vector_bytes'] / 2**20:.1f} MiB of vectors, "
+                    f"query p50 {result['query']['p50_ms']:.2f} ms p95 {result['query']['p95_ms']:.2f} ms "
+                    f"p99 {result['query']['p99_ms']:.2f} ms, cached p50 {result['query_cached']['p50_ms']:.3f} ms, "
+                    f"recall@{args.top_k} {result[f'recall_at_{args.top_k}']:.3f}"
+                    + (
+                        f" ({result[f'first_stage_recall_at_{args.top_k}']:.3f} before rerank)"
+                        if f"first_stage_recall_at_{args.top_k}" in result
+                        else ""
+                    )
+                )
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "machine": {
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "cpus": os.cpu_count(),
+                },
+                "settings": vars(args),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {output}")
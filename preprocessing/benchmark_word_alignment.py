@@ -0,0 +1,91 @@
+# Micro-benchmark of word-to-frame assignment on synthetic transcripts, comparing the binary-search assignment
+# with the original per-frame scan over every word. Run with `python preprocessing/benchmark_word_alignment.py`.
+
+import argparse
+import time
+
+import numpy as np
+
+from word_alignment import assign_words_to_frames
+
+
+def scan_assign_words_to_frames(transcription, frames):
+    # the original assignment: filter every word for every frame, keeping only words strictly inside the window
+    frames_and_words = []
+    for f in frames:
+        frame_start, frame_end = f["timestamp"][0], f["timestamp"][1]
+        words_in_frame = list(
+            filter(
+                lambda w: w["timestamp"][0] > frame_start and w["timestamp"][1] < frame_end,
+                transcription["chunks"],
+            )
+        )
+        frames_and_words.append(
+            {
+                "frame_path": f["frame_path"],
+                "words": "".join(w["text"] for w in words_in_frame),
+                "timestamp": f["timestamp"],
+            }
+        )
+    return frames_and_words
+
+
+def synthetic_transcript(hours, words_per_minute=150, seed=0):
+    """Words with random durations and pauses, at roughly the pace of a talk."""
+    rng = np.random.default_rng(seed)
+    n = int(hours * 60 * words_per_minute)
+    durations = rng.uniform(0.1, 0.5, n)
+    gaps = rng.exponential(60 / words_per_minute - 0.3, n)
+    starts = np.cumsum(gaps + durations) - durations
+    return {
+        "chunks": [
+            {"text": f" w{i}", "timestamp": (round(s, 2), round(s + d, 2))}
+            for i, (s, d) in enumerate(zip(starts, durations))
+        ]
+    }
+
+
+def synthetic_frames(duration, interval):
+    return [
+        {"frame_path": f"frame_{i:05d}.png", "timestamp": (start, min(start + interval, duration))}
+        for i, start in enumerate(np.arange(0, duration, interval).tolist())
+    ]
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=10)
+    parser.add_argument("--intervals", type=float, nargs="+", default=[45, 5])
+    parser.add_argument(
+        "--max-scan-comparisons",
+        type=float,
+        default=2e8,
+        help="skip the original scan when frames x words exceeds this, as it would take minutes",
+    )
+    args = parser.parse_args()
+
+    transcription = synthetic_transcript(args.hours)
+    duration = transcription["chunks"][-1]["timestamp"][1] + 1
+    n_words = len(transcription["chunks"])
+    print(f"{args.hours:g} hours, {n_words} words")
+
+    for interval in args.intervals:
+        frames = synthetic_frames(duration, interval)
+        line = f"interval {interval:g}s, {len(frames)} frames:"
+        for boundary in ("midpoint", "duplicate"):
+            assigned, seconds = timed(assign_words_to_frames, transcription, frames, boundary)
+            kept = sum(len(f["words"].split()) for f in assigned)
+            line += f" {boundary} {seconds * 1000:.0f} ms ({kept} words placed),"
+        if len(frames) * n_words <= args.max_scan_comparisons:
+            assigned, seconds = timed(scan_assign_words_to_frames, transcription, frames)
+            kept = sum(len(f["words"].split()) for f in assigned)
+            line += f" scan {seconds * 1000:.0f} ms ({n_words - kept} straddling words dropped)"
+        else:
+            line += f" scan skipped ({len(frames) * n_words:.1e} comparisons)"
+        print(line.rstrip(","))
@@ -1,6 +1,7 @@
 import json
 import logging
 import base64
+import time
 from botocore.exceptions import ClientError
 
 
@@ -19,7 +20,10 @@ where that information came from.
 
 """
 
-from anthropic import AnthropicBedrock
+from clients import get_anthropic_client
+from prompt_images import get_prompt_image_cache
+from response_cache import get_response_cache
+from tracing import get_tracer, span
 
 # Logger setup
 logger = logging.getLogger(__name__)
@@ -34,13 +38,128 @@ def convert_image_to_base64(image_path):
     return base64_string
 
 
+def estimate_request_tokens(messages, max_tokens, system=None):
+    # rough cost of a request before it is sent: ~4 characters per text token, a flat cost per image
+    # (about what a full-size screenshot costs), plus the completion budget
+    tokens = len(system or "") // 4 + max_tokens
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for block in content:
+            if block["type"] == "image":
+                tokens += 1600
+            else:
+                tokens += len(block.get("text", "")) // 4
+    return tokens
+
+
+def request_bytes(request):
+    # approximate request size: the text and base64 images it carries
+    total = len(request.get("system") or "")
+    for message in request["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            total += len(content)
+            continue
+        for block in content:
+            total += len(block.get("text", "")) + len(block.get("source", {}).get("data", ""))
+    return total
+
+
+def usage_counters(message):
+    usage = getattr(message, "usage", None)
+    if usage is None:
+        return {}
+    return {"input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens}
+
+
+def create_message(client, **request):
+    """
+    Sends a request to Claude through the on-disk response cache.
+
+    Args:
+        client (AnthropicBedrock): Client used on a cache miss.
+        **request: Keyword arguments for `client.messages.create` (model, max_tokens, messages, system).
+
+    Returns:
+        str: The text of Claude's response.
+    """
+    with span("claude", model=request.get("model")) as s:
+        cache = get_response_cache()
+        key = cache.make_key(**request)
+        text = cache.get(key)
+        s.set(cached=text is not None)
+        if text is None:
+            s.add(request_bytes=request_bytes(request))
+            message = client.messages.create(**request)
+            text = message.content[0].text
+            s.add(**usage_counters(message))
+            cache.put(key, text)
+    return text
+
+
+def stream_message(client, timings=None, **request):
+    """
+    Streams a response from Claude, going through the same on-disk response cache as `create_message`.
+
+    A cached response is yielded whole. A fresh one is yielded as text deltas and cached once complete, so a
+    stream abandoned part way is neither cached nor traced.
+
+    Args:
+        client (AnthropicBedrock): Client used on a cache miss.
+        timings (dict, optional): Filled with "ttft_s" (seconds until the first text arrived), "total_s" and
+            "cached" once the stream is exhausted.
+        **request: Keyword arguments for `client.messages.stream` (model, max_tokens, messages, system).
+
+    Yields:
+        str: Pieces of Claude's response.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    cache = get_response_cache()
+    key = cache.make_key(**request)
+    text = cache.get(key)
+    counters = {}
+    if text is not None:
+        timings.update(ttft_s=time.perf_counter() - started, cached=True)
+        yield text
+    else:
+        timings["cached"] = False
+        counters["request_bytes"] = request_bytes(request)
+        pieces = []
+        with client.messages.stream(**request) as stream:
+            for delta in stream.text_stream:
+                if not pieces:
+                    timings["ttft_s"] = time.perf_counter() - started
+                pieces.append(delta)
+                yield delta
+            if hasattr(stream, "get_final_message"):
+                counters.update(usage_counters(stream.get_final_message()))
+        timings.setdefault("ttft_s", time.perf_counter() - started)
+        cache.put(key, "".join(pieces))
+    timings["total_s"] = time.perf_counter() - started
+    # recorded once the stream is exhausted rather than held open as a span across the yields, which would put
+    # whatever the caller traces between chunks under it
+    get_tracer().record(
+        "claude.stream",
+        timings["total_s"],
+        counters=counters,
+        model=request.get("model"),
+        cached=timings["cached"],
+        ttft_ms=round(timings["ttft_s"] * 1000, 1),
+    )
+
+
 def format_messages_for_claude(user_query, vdb_response):
     """
     Formats the user's query and the vector database response into a structured message for Claude.
 
     Args:
         user_query (str): The user's query.
-        vdb_response (list): The response from the vector database, containing images and text.
+        vdb_response (list): The response from the vector database, containing images and text, or the segments
+            merged from it by `context_expansion.expand_context`.
 
     Returns:
         list: A list of messages formatted for Claude.
@@ -52,21 +171,19 @@ def format_messages_for_claude(user_query, vdb_response):
     # we append three messages at a time, one for the image, one for the text, and one for the next image.
 
     for item in vdb_response:
-        img_b64 = convert_image_to_base64(item["metadata"]["filepath"])
         new_content.extend(
             [
                 {
                     "type": "text",
-                    "text": "Image: " + item["metadata"]["filepath"],
+                    "text": f"Video: {item['metadata']['video_id']}, from {item['metadata']['timestamp_start']} s "
+                    f"to {item['metadata']['timestamp_end']} s",
                 },
                 {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": img_b64,
-                    },
+                    "type": "text",
+                    "text": "Image: " + item["metadata"]["filepath"],
                 },
+                # the downscaled variant prepared during preprocessing, usually already in memory
+                get_prompt_image_cache().image_block(item["metadata"]["filepath"]),
                 {
                     "type": "text",
                     "text": "Contextual description: "
@@ -83,87 +200,136 @@ def format_messages_for_claude(user_query, vdb_response):
     return messages
 
 
-def ask_claude_vqa_response(user_query, vdb_response):
+def vqa_request(user_query, vdb_response):
+    """Builds the Claude request that answers the user's query from the vector database matches."""
+    with span("claude.prompt", images=len(vdb_response)):
+        messages = format_messages_for_claude(user_query, vdb_response)
+    system_prompt = """
+
+You are a friendly assistant helping people interpret their videos at their company.
+
+You will recieve frames of these videos, with descriptions of what has happened in the frames, as well as a user query
+
+Your job is to ingest the images and text, and respond to the user's query or question based on the context provided.
+
+Refer back to the images and text provided to guide the user to the appropriate slide, section, webinar, or talk
+where the information they are looking for is located.
+    """
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS * 10,
+        "system": system_prompt,
+        "messages": messages,
+    }
+
+
+def ask_claude_vqa_response(user_query, vdb_response, client=None):
     """
     Sends the user's query and the vector database response to Claude and gets a response.
 
     Args:
         user_query (str): The user's query.
         vdb_response (list): The response from the vector database, containing images and text.
+        client (AnthropicBedrock, optional): Client to send the request with. The shared pooled client if omitted.
 
     Returns:
         str: The response from Claude.
     """
-    client = AnthropicBedrock()
-    messages = format_messages_for_claude(user_query, vdb_response)
-    system_prompt = """
+    client = client or get_anthropic_client()
+    return create_message(client, **vqa_request(user_query, vdb_response))
 
-You are a friendly assistant helping people interpret their videos at their company.
 
-You will recieve frames of these videos, with descriptions of what has happened in the frames, as well as a user query
+def stream_claude_vqa_response(user_query, vdb_response, client=None, timings=None):
+    """
+    Streaming variant of `ask_claude_vqa_response`, for showing the answer while it is being written.
 
-Your job is to ingest the images and text, and respond to the user's query or question based on the context provided.
+    Args:
+        user_query (str): The user's query.
+        vdb_response (list): The response from the vector database, containing images and text.
+        client (AnthropicBedrock, optional): Client to send the request with. The shared pooled client if omitted.
+        timings (dict, optional): Filled with the time to first token and total time, see `stream_message`.
 
-Refer back to the images and text provided to guide the user to the appropriate slide, section, webinar, or talk
-where the information they are looking for is located.
+    Yields:
+        str: Pieces of Claude's response as they arrive.
     """
-    response = client.messages.create(
-        model=MODEL, max_tokens=MAX_TOKENS * 10, system=system_prompt, messages=messages
+    client = client or get_anthropic_client()
+    yield from stream_message(
+        client, timings=timings, **vqa_request(user_query, vdb_response)
     )
-    return response.content[0].text
 
 
-def ask_claude(img, text):
+def ask_claude(img, text, client=None):
     # best for one off queries
-    client = AnthropicBedrock(aws_region="us-east-1")
+    client = client or get_anthropic_client()
     if img:
-        img_b64 = convert_image_to_base64(img)
-        message = client.messages.create(
+        return create_message(
+            client,
             model=MODEL,
             max_tokens=MAX_TOKENS,
             messages=[
                 {
                     "role": "user",
                     "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": img_b64,
-                            },
-                        },
+                        get_prompt_image_cache().image_block(img),
                         {"type": "text", "text": text},
                     ],
                 }
             ],
         )
-    else:
-        message = client.messages.create(
-            model=MODEL,
-            max_tokens=MAX_TOKENS,
-            messages=[{"role": "user", "content": text}],
-        )
-    return message.content[0].text
+    return create_message(
+        client,
+        model=MODEL,
+        max_tokens=MAX_TOKENS,
+        messages=[{"role": "user", "content": text}],
+    )
 
 
-def make_claude_transcript_summary(transcript):
-    client = AnthropicBedrock(aws_region="us-east-1")
+def make_claude_transcript_summary(transcript, client=None):
+    client = client or get_anthropic_client()
 
     prompt = "Summarize the following transcript, being as concise as possible:"
-    message = client.messages.create(
+    return create_message(
+        client,
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt + ": " + transcript}],
+        max_tokens=MAX_TOKENS,
+    )
+
+
+def make_claude_section_summary(transcript, client=None):
+    # one part of a long recording; the prompt does not say which part, so the cached summary of a section
+    # stays valid when other sections of the video change
+    client = client or get_anthropic_client()
+
+    prompt = "Summarize the following excerpt of a longer video transcript, being as concise as possible"
+    return create_message(
+        client,
         model=MODEL,
         messages=[{"role": "user", "content": prompt + ": " + transcript}],
         max_tokens=MAX_TOKENS,
     )
-    return message.content[0].text
+
+
+def make_claude_summary_of_summaries(summaries, client=None):
+    client = client or get_anthropic_client()
+
+    prompt = (
+        "The following are summaries of consecutive parts of one video, in order. Combine them into a single "
+        "summary of the whole video, being as concise as possible"
+    )
+    parts = "\n\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(summaries))
+    return create_message(
+        client,
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt + ":\n\n" + parts}],
+        max_tokens=MAX_TOKENS,
+    )
 
 
 def create_contextual_frame_description(
-    frame_caption_index, frame_caption_pairs, transcript_summary
+    frame_caption_index, frame_caption_pairs, transcript_summary, client=None
 ):
     # frame caption pair will have an image, and a transcript. Window is in seconds
-    client = AnthropicBedrock(aws_region="us-east-1")
 
     # gather context, look 4 frame widths before and after. Make sure not to go out of bounds if near beginning or end of video.
 
@@ -176,9 +342,9 @@ def create_contextual_frame_description(
     # past_frames_summary = make_claude_transcript_summary(" ".join([f["words"] for f in surrounding_frames]))
     meta_prompt = f"""
 
-    You are watching a video and trying to explain what has happened in the video using a global summary, some recent context, and the transcript of the current frame.
+    You are watching a video and trying to explain what has happened in the video using a summary of the section around the current frame, and the transcript of the current frame.
 
-    The video has been summarized as follows:
+    The section of the video surrounding the current frame (the whole video, if it is short) has been summarized as follows:
     {transcript_summary}
 
     The current frame's transcript is as follows:
@@ -193,5 +359,7 @@ def create_contextual_frame_description(
     Description:
     """
 
-    rich_summary = ask_claude(img=current_frame["frame_path"], text=meta_prompt)
+    rich_summary = ask_claude(
+        img=current_frame["frame_path"], text=meta_prompt, client=client
+    )
     return rich_summary
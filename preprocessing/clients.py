@@ -0,0 +1,144 @@
+# Registry of the service clients and vector indexes. Each client is built lazily on first use and then shared by every call and
+# thread in the process, so credentials are resolved and TLS connections are opened once and then kept alive
+# in a connection pool, instead of on every frame or query. Pool sizes and timeouts are set in config.py.
+
+import os
+import threading
+
+import boto3
+import httpx
+from anthropic import AnthropicBedrock, DefaultHttpxClient, Timeout
+from botocore.config import Config
+from pinecone import Pinecone
+
+from config import (
+    AWS_REGION,
+    BEDROCK_MAX_ATTEMPTS,
+    BEDROCK_MAX_POOL_CONNECTIONS,
+    CLAUDE_KEEPALIVE_S,
+    CLAUDE_MAX_CONNECTIONS,
+    CLIENT_CONNECT_TIMEOUT_S,
+    CLIENT_READ_TIMEOUT_S,
+    FIRST_STAGE_DIMENSION,
+    PINECONE_POOL_SIZE,
+    RETRIEVAL_MODE,
+    VECTOR_STORE,
+    local_index_dir,
+)
+from two_stage import TwoStageIndex
+from vector_store import LocalVectorStore
+
+_clients = {}
+# reentrant, as a factory may get the client it is built from, e.g. a Pinecone index its Pinecone client
+_lock = threading.RLock()
+
+
+def _get_or_create(key, factory):
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def make_anthropic_client(region=AWS_REGION, max_connections=CLAUDE_MAX_CONNECTIONS, **kwargs):
+    """Builds a Claude on Bedrock client with a pooled, keep-alive HTTP client; kwargs go to AnthropicBedrock."""
+    return AnthropicBedrock(
+        aws_region=region,
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=CLAUDE_KEEPALIVE_S,
+            ),
+        ),
+        timeout=Timeout(CLIENT_READ_TIMEOUT_S, connect=CLIENT_CONNECT_TIMEOUT_S),
+        **kwargs,
+    )
+
+
+def make_bedrock_runtime(region=None, max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS):
+    """Builds a boto3 bedrock-runtime client; adaptive retries back off on throttling."""
+    return boto3.client(
+        "bedrock-runtime",
+        region or boto3.session.Session().region_name or AWS_REGION,
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": BEDROCK_MAX_ATTEMPTS, "mode": "adaptive"},
+            tcp_keepalive=True,
+            connect_timeout=CLIENT_CONNECT_TIMEOUT_S,
+            read_timeout=CLIENT_READ_TIMEOUT_S,
+        ),
+    )
+
+
+def make_pinecone_client():
+    return Pinecone(api_key=os.getenv("PINECONE_API_KEY"), pool_threads=PINECONE_POOL_SIZE)
+
+
+def get_anthropic_client(region=AWS_REGION):
+    return _get_or_create(("anthropic", region), lambda: make_anthropic_client(region))
+
+
+def get_bedrock_runtime(region=None):
+    return _get_or_create(("bedrock-runtime", region), lambda: make_bedrock_runtime(region))
+
+
+def get_pinecone_client():
+    return _get_or_create("pinecone", make_pinecone_client)
+
+
+def get_pinecone_index(name):
+    return _get_or_create(
+        ("pinecone-index", name),
+        lambda: get_pinecone_client().Index(name, pool_threads=PINECONE_POOL_SIZE),
+    )
+
+
+def get_local_index(name, dimension=1024, quantization=None):
+    return _get_or_create(
+        ("local-index", name),
+        lambda: LocalVectorStore(os.path.join(local_index_dir, name), dimension, quantization=quantization),
+    )
+
+
+def get_first_stage_index(name, backend, mode):
+    # the compact index of a two-stage mode, named after the full one
+    if mode == "titan256":
+        if backend == "pinecone":
+            return get_pinecone_index(f"{name}-{FIRST_STAGE_DIMENSION}")
+        return get_local_index(f"{name}-{FIRST_STAGE_DIMENSION}", FIRST_STAGE_DIMENSION)
+    if backend == "pinecone":
+        raise ValueError(f"Retrieval mode {mode} needs the local backend; Pinecone stores float vectors only")
+    return get_local_index(f"{name}-{mode}", quantization=mode)
+
+
+def get_vector_index(name, backend=VECTOR_STORE, mode=RETRIEVAL_MODE):
+    """
+    The index called `name` on the given backend, "pinecone" or "local"; both have the same interface. In a
+    two-stage retrieval mode ("titan256", "int8" or "binary") it is a TwoStageIndex over a compact first stage on
+    that backend and a local store of the full vectors.
+    """
+    if backend not in ("pinecone", "local"):
+        raise ValueError(f"Unknown vector store backend: {backend}")
+    if mode == "full":
+        return get_pinecone_index(name) if backend == "pinecone" else get_local_index(name)
+    if mode not in ("titan256", "int8", "binary"):
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    first_stage = get_first_stage_index(name, backend, mode)
+    rerank = get_local_index(f"{vector_index_key(name, backend, mode)}-rerank")
+    return _get_or_create(("two-stage", name, backend, mode), lambda: TwoStageIndex(first_stage, rerank))
+
+
+def vector_index_key(name, backend=VECTOR_STORE, mode=RETRIEVAL_MODE):
+    # what was upserted, and when, is tracked per backend and mode, as each pair of them is an index of its own
+    key = name if backend == "pinecone" else f"{backend}-{name}"
+    return key if mode == "full" else f"{key}-{mode}"
+
+
+def reset_clients():
+    """Forgets every shared client, e.g. after credentials change; the next call builds fresh ones."""
+    with _lock:
+        _clients.clear()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 package_dir = Path(__file__).parent
@@ -10,3 +11,136 @@ videos_dir = data_dir / "videos"
 # Pinecone variables that are helpful
 
 index_name = "test-vqa"
+
+# Claude enrichment concurrency and rate limits
+ENRICH_MAX_IN_FLIGHT = 8
+CLAUDE_REQUESTS_PER_SECOND = 4
+CLAUDE_TOKENS_PER_MINUTE = 200_000
+CLAUDE_MAX_RETRIES = 6
+
+# On-disk caches, kept by `make clean` so reruns can reuse earlier work
+cache_dir = data_dir / "cache"
+CLAUDE_CACHE_PATH = cache_dir / "claude_responses.sqlite"
+CLAUDE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+CLAUDE_CACHE_BYPASS = os.getenv("CLAUDE_CACHE_BYPASS", "0") == "1"
+
+# Per-video pipeline state, used to skip work that is already done
+manifest_path = data_dir / "manifest.json"
+transcriptions_dir = data_dir / "transcriptions"
+frames_and_words_dir = data_dir / "frames_and_words"
+frames_dir = data_dir / "frames"
+enriched_dir = data_dir / "enriched"
+embeddings_dir = data_dir / "embeddings"
+
+# Titan embedding concurrency and the local embedding store
+EMBED_MAX_WORKERS = 16
+BEDROCK_MAX_POOL_CONNECTIONS = 32
+BEDROCK_MAX_ATTEMPTS = 8
+embedding_cache_dir = cache_dir / "embeddings"
+
+# Pinecone upsert batching
+UPSERT_BATCH_SIZE = 100
+UPSERT_MAX_WORKERS = 4
+UPSERT_MAX_RETRIES = 5
+
+# What was last written to each index, kept by `make clean` because it mirrors remote state
+state_dir = data_dir / "state"
+
+# Whisper transcription
+WHISPER_MODEL = "openai/whisper-tiny"
+WHISPER_CHUNK_LENGTH_S = 30
+WHISPER_BATCH_SIZE = 8
+# worker processes for CPU transcription; each gets an equal share of the cores
+TRANSCRIBE_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+
+# Frame and audio extraction; videos are decoded concurrently, each in its own ffmpeg process
+audio_dir = data_dir / "audio"
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+# Near-duplicate frame merging; frames whose perceptual hashes differ in at most DEDUP_MAX_DISTANCE of their
+# DEDUP_HASH_SIZE**2 bits are treated as the same picture. Set DEDUP_MAX_DISTANCE to -1 to keep every frame
+DEDUP_HASH_SIZE = 8
+DEDUP_MAX_DISTANCE = 4
+
+# Word alignment; a word that straddles two frame windows goes to the window holding the middle of the word
+# ("midpoint"), or to every window it overlaps ("duplicate")
+WORD_BOUNDARY = "midpoint"
+
+# Query-time caches of the Streamlit app, shared by every session: query text to embedding, and
+# (embedding, top_k, filter) to matches. Matches are dropped whenever an upsert changes the index
+QUERY_CACHE_MAX_ENTRIES = 1024
+QUERY_EMBEDDING_TTL_S = 24 * 60 * 60
+QUERY_RESULTS_TTL_S = 10 * 60
+
+# Shared service clients, created once per process on first use and reused by every call and thread
+AWS_REGION = "us-east-1"
+CLAUDE_MAX_CONNECTIONS = 32
+CLAUDE_KEEPALIVE_S = 60
+CLIENT_CONNECT_TIMEOUT_S = 5
+CLIENT_READ_TIMEOUT_S = 120
+PINECONE_POOL_SIZE = 16
+
+# Frames as sent to Claude: downscaled so the longest edge is at most PROMPT_IMAGE_MAX_EDGE pixels and
+# re-encoded ("jpeg", "png" or "webp"), with the variants kept on disk and the hot ones in memory as base64
+prompt_images_dir = cache_dir / "prompt_images"
+PROMPT_IMAGE_MAX_EDGE = 1024
+PROMPT_IMAGE_FORMAT = "jpeg"
+PROMPT_IMAGE_QUALITY = 85
+PROMPT_IMAGE_MEMORY_ENTRIES = 2048
+
+# Vector store backend: "pinecone", or "local" for the on-disk index in local_index_dir, which needs no network.
+# The local index searches exactly by default; with LOCAL_INDEX_ANN = "ivf" it only scans the IVF_NPROBE
+# clusters nearest to the query, out of about sqrt(n) clusters
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+local_index_dir = data_dir / "local_index"
+LOCAL_INDEX_ANN = None
+IVF_NPROBE = 8
+
+# Two-stage retrieval: "full" indexes the 1024-dimensional float embeddings and ranks by them directly. "titan256"
+# indexes 256-dimensional Titan embeddings of the same descriptions (locally or in Pinecone), "int8" and "binary"
+# a quantized copy of the full ones (local only); the RERANK_CANDIDATES best first-stage matches are then reranked
+# with the full vectors, kept in a local memory-mapped store next to the local index
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "full")
+RETRIEVAL_MODES = ("full", "titan256", "int8", "binary")
+FIRST_STAGE_DIMENSION = 256
+RERANK_CANDIDATES = 100
+
+# Tracing: every script run writes its spans to a JSON-lines file here and prints a per-stage summary at the end
+traces_dir = data_dir / "traces"
+
+# Keyword (BM25) index over the transcript and description of every frame, rebuilt on each upsert. The app fuses
+# its scores with the dense ones: HYBRID_SPARSE_WEIGHT is the keyword share, from 0 (dense only) to 1, and each
+# side contributes its HYBRID_CANDIDATES best matches to the fusion
+sparse_index_dir = data_dir / "sparse_index"
+BM25_K1 = 1.2
+BM25_B = 0.75
+HYBRID_SPARSE_WEIGHT = 0.3
+HYBRID_CANDIDATES = 50
+
+# Context sent to Claude with each question: the CONTEXT_TOP_K best matches, each widened by CONTEXT_NEIGHBOURS
+# frames on either side, merged per video where windows are at most CONTEXT_MERGE_GAP_S seconds apart, and cut to
+# CONTEXT_MAX_IMAGES segments (one image each) and CONTEXT_MAX_TEXT_TOKENS tokens of transcripts and descriptions
+CONTEXT_TOP_K = 10
+CONTEXT_NEIGHBOURS = 1
+CONTEXT_MERGE_GAP_S = 1.0
+CONTEXT_MAX_IMAGES = 5
+CONTEXT_MAX_TEXT_TOKENS = 6000
+
+# Transcript summaries: a transcript longer than SUMMARY_CHUNK_TOKENS is split into sections of whole frame
+# windows, each summarized on its own (and cached on its own), then the section summaries are combined, in groups
+# of at most SUMMARY_CHUNK_TOKENS, until one summary is left. Frames are described as soon as their section is
+# summarized, with the section summary as context
+SUMMARY_CHUNK_TOKENS = 4000
+
+# Frame tables: the per-frame intermediates between stages are Parquet files, read back FRAME_TABLE_ROW_GROUP_ROWS
+# rows at a time
+FRAME_TABLE_ROW_GROUP_ROWS = 4096
+
+# Pipelined orchestrator (pipeline.py): videos stream through decoding, transcription, pairing, enrichment and
+# indexing one by one, with at most PIPELINE_QUEUE_SIZE videos waiting between two stages, so a stage that falls
+# behind blocks the ones before it instead of letting them run ahead. PIPELINE_ENRICH_VIDEOS videos are enriched
+# at once, sharing the ENRICH_MAX_IN_FLIGHT requests and the Claude rate limits. The keyword index is rebuilt with
+# the videos indexed so far at most every PIPELINE_SPARSE_INTERVAL_S seconds, as each rebuild covers the whole corpus
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_ENRICH_VIDEOS = 2
+PIPELINE_SPARSE_INTERVAL_S = 60
@@ -0,0 +1,138 @@
+# Post-retrieval stage between the index and Claude. Matches often are consecutive frames of one video, each of
+# which would otherwise go to Claude as its own image. Here matches are grouped by video, optionally widened by
+# their neighbouring frames (looked up locally, without another vector query), and overlapping or touching
+# windows are merged into one segment: one image, the transcript of the whole span and the descriptions of the
+# matched frames. Segments are then added best first until the image or text budget of the prompt is used up.
+
+from config import (
+    CONTEXT_MAX_IMAGES,
+    CONTEXT_MAX_TEXT_TOKENS,
+    CONTEXT_MERGE_GAP_S,
+    CONTEXT_NEIGHBOURS,
+)
+from tracing import span
+
+
+def text_tokens(text):
+    # the same rough ~4 characters per token as estimate_request_tokens
+    return len(text) // 4
+
+
+class VideoFrameIndex:
+    """
+    Every frame of every video, in time order, for looking up the neighbours of a match.
+
+    Args:
+        records (iterable): Index records (dicts with an "id" and "metadata"), e.g. those of the keyword index.
+    """
+
+    def __init__(self, records):
+        self.frames = {}
+        for record in records:
+            self.frames.setdefault(record["metadata"]["video_id"], []).append(record)
+        self.position = {}
+        for video, frames in self.frames.items():
+            frames.sort(key=lambda r: r["metadata"]["timestamp_start"])
+            for position, record in enumerate(frames):
+                self.position[record["id"]] = (video, position)
+
+    def neighbours(self, record_id, count):
+        """The frames up to `count` positions before and after the record, itself included, in time order."""
+        if record_id not in self.position:
+            return []
+        video, position = self.position[record_id]
+        frames = self.frames[video]
+        return frames[max(0, position - count) : position + count + 1]
+
+
+def _segment(frames, hits):
+    # the best hit's frame stands for the whole segment
+    frames = sorted(frames.values(), key=lambda f: f["metadata"]["timestamp_start"])
+    best = max(hits, key=lambda m: m["score"])
+    descriptions = []
+    for m in hits:
+        if m["metadata"]["contextual_frame_description"] not in descriptions:
+            descriptions.append(m["metadata"]["contextual_frame_description"])
+    return {
+        "id": best["id"],
+        "score": best["score"],
+        # the scores fuse_matches combined, shown next to the fused one
+        "dense_score": best.get("dense_score"),
+        "sparse_score": best.get("sparse_score"),
+        "metadata": {
+            **best["metadata"],
+            "timestamp_start": frames[0]["metadata"]["timestamp_start"],
+            "timestamp_end": frames[-1]["metadata"]["timestamp_end"],
+            "transcript": " ".join(f["metadata"]["transcript"] for f in frames).strip(),
+            "contextual_frame_description": "\n".join(descriptions),
+        },
+        "hit_ids": [m["id"] for m in hits],
+        "frame_ids": [f["id"] for f in frames],
+    }
+
+
+def merge_matches(matches, frame_index=None, neighbours=CONTEXT_NEIGHBOURS, max_gap=CONTEXT_MERGE_GAP_S):
+    """
+    Groups matches by video and merges those whose windows overlap or are at most `max_gap` seconds apart.
+
+    With a frame index, each match is first widened by `neighbours` frames on either side, so nearby matches
+    join up and isolated ones come with some context. The neighbours only add transcript text.
+
+    Returns:
+        list: Segments in the format of matches, best first: "id", "score", "dense_score" and "sparse_score" of
+            the best hit (the last two None for matches that were not fused), "metadata" with its frame and
+            description, the span's timestamps and transcript, the descriptions of every hit, and the "hit_ids"
+            and "frame_ids" the segment covers.
+    """
+    by_video = {}
+    for match in matches:
+        frames = frame_index.neighbours(match["id"], neighbours) if frame_index and neighbours else []
+        # a match unknown to the frame index stands on its own
+        frames = frames or [match]
+        by_video.setdefault(match["metadata"]["video_id"], []).append((frames, match))
+
+    segments = []
+    for windows in by_video.values():
+        windows.sort(key=lambda w: w[0][0]["metadata"]["timestamp_start"])
+        frames, hits = {}, []
+        end = None
+        for window, hit in windows:
+            if end is not None and window[0]["metadata"]["timestamp_start"] - end > max_gap:
+                segments.append(_segment(frames, hits))
+                frames, hits = {}, []
+            for f in window:
+                frames.setdefault(f["id"], f)
+            hits.append(hit)
+            end = max(end or 0, window[-1]["metadata"]["timestamp_end"])
+        segments.append(_segment(frames, hits))
+    segments.sort(key=lambda s: s["score"], reverse=True)
+    return segments
+
+
+def within_budget(segments, max_images=CONTEXT_MAX_IMAGES, max_text_tokens=CONTEXT_MAX_TEXT_TOKENS):
+    """
+    Keeps the best segments that fit in the prompt budget: at most `max_images` segments (one image each) and
+    `max_text_tokens` of transcript and description text. A segment too long to fit is skipped, so a shorter
+    one further down can still be used.
+    """
+    kept, used = [], 0
+    for segment in segments:
+        if len(kept) == max_images:
+            break
+        tokens = text_tokens(segment["metadata"]["transcript"]) + text_tokens(
+            segment["metadata"]["contextual_frame_description"]
+        )
+        if used + tokens > max_text_tokens:
+            continue
+        kept.append(segment)
+        used += tokens
+    return kept
+
+
+def expand_context(matches, frame_index=None, **budget):
+    """Merges matches into segments (see `merge_matches`) and keeps the ones that fit `within_budget`."""
+    with span("query.context", matches=len(matches)) as s:
+        segments = merge_matches(matches, frame_index)
+        kept = within_budget(segments, **budget)
+        s.set(segments=len(segments), kept=len(kept))
+    return kept
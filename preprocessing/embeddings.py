@@ -0,0 +1,145 @@
+# Batched embedding with a persistent local store. Texts are embedded concurrently, and every embedding is kept
+# on disk keyed by (model_id, dimension, text hash), so reruns and unchanged frames are never embedded twice.
+# Vectors are stored as float32 .npy segments with a key list next to each, rather than as floats inside JSON.
+
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from config import EMBED_MAX_WORKERS, embedding_cache_dir
+
+# new embeddings are written to disk in segments of this many vectors, so a crash loses at most one segment
+FLUSH_EVERY = 1000
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only store of embeddings for one (model_id, dimension) pair.
+
+    Each flush writes a `vectors_XXXXX.npy` float32 matrix and a `keys_XXXXX.json` list of text hashes.
+    Existing segments are memory-mapped, so opening the store does not read the vectors into memory.
+
+    Args:
+        model_id (str): Embedding model the vectors came from.
+        dimension (int): Embedding dimension.
+        root (str or Path): Folder holding one sub-folder per (model_id, dimension).
+    """
+
+    def __init__(self, model_id, dimension, root=embedding_cache_dir):
+        self.model_id = model_id
+        self.dimension = dimension
+        safe_model = re.sub(r"[^A-Za-z0-9._-]", "_", model_id)
+        self.path = os.path.join(root, f"{safe_model}_{dimension}")
+        os.makedirs(self.path, exist_ok=True)
+
+        self._segments = []
+        self._index = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._next_segment = 0
+        for keys_path in sorted(glob.glob(os.path.join(self.path, "keys_*.json"))):
+            vectors_path = keys_path.replace("keys_", "vectors_").replace(".json", ".npy")
+            if not os.path.exists(vectors_path):
+                # a segment whose vectors never made it to disk
+                continue
+            with open(keys_path, "r") as f:
+                keys = json.load(f)
+            self._add_segment(keys, np.load(vectors_path, mmap_mode="r"))
+            self._next_segment = int(keys_path[-10:-5]) + 1
+
+    def _add_segment(self, keys, vectors):
+        segment = len(self._segments)
+        self._segments.append(vectors)
+        for row, key in enumerate(keys):
+            self._index[key] = (segment, row)
+
+    def __len__(self):
+        return len(self._index) + len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._index or key in self._pending
+
+    def get(self, key):
+        with self._lock:
+            if key in self._index:
+                segment, row = self._index[key]
+                return np.asarray(self._segments[segment][row])
+            return self._pending.get(key)
+
+    def add(self, key, vector):
+        with self._lock:
+            self._pending[key] = np.asarray(vector, dtype=np.float32)
+            should_flush = len(self._pending) >= FLUSH_EVERY
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            segment = self._next_segment
+            self._next_segment += 1
+            keys = list(self._pending)
+            vectors = np.stack(list(self._pending.values()))
+            vectors_path = os.path.join(self.path, f"vectors_{segment:05d}.npy")
+            # keys go last, so a segment only counts as written once both files exist
+            np.save(vectors_path, vectors)
+            with open(os.path.join(self.path, f"keys_{segment:05d}.json"), "w") as f:
+                json.dump(keys, f)
+            self._add_segment(keys, np.load(vectors_path, mmap_mode="r"))
+            self._pending = {}
+
+
+def embed_texts(texts, embed_fn, store, max_workers=EMBED_MAX_WORKERS, desc=None):
+    """
+    Embeds many texts concurrently, only calling the model for texts that are not in the store yet.
+
+    Args:
+        texts (list): Texts to embed. Duplicates are embedded once.
+        embed_fn (callable): Embeds a single text and returns its vector.
+        store (EmbeddingStore): Store to read from and add new embeddings to.
+        max_workers (int): Maximum number of concurrent embedding requests.
+        desc (str, optional): Label for the progress bar.
+
+    Returns:
+        np.ndarray: float32 matrix with one row per text, in the same order as `texts`.
+    """
+    keys = [text_hash(t) for t in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in store and key not in missing:
+            missing[key] = text
+
+    if missing:
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(
+                total=len(missing), desc=desc, unit="text"
+            ) as progress:
+                futures = {
+                    executor.submit(embed_fn, text): key
+                    for key, text in missing.items()
+                }
+                for future in as_completed(futures):
+                    store.add(futures[future], future.result())
+                    progress.update(1)
+        finally:
+            # keep whatever finished, even if a request failed
+            store.flush()
+
+    print(
+        f"Embedded {len(missing)} new texts, reused {len(texts) - len(missing)} from the embedding store"
+    )
+    if not texts:
+        return np.zeros((0, store.dimension), dtype=np.float32)
+    return np.stack([store.get(key) for key in keys])
@@ -1,46 +1,186 @@
 # this script take sthe output from preprocessing the video (transcript summary, frame caption pairs) and creates the high quality
 # contextual frame descriptions for our vector earch
 
-from claude_utils import (
-    create_contextual_frame_description,
-    make_claude_transcript_summary,
+from enrichment import EnrichmentEngine
+from frame_table import ENRICHED_COLUMNS, count_frames, read_frames, write_frames
+from fakes import FakeBedrockClient
+from manifest import Manifest
+from prompt_images import PromptImageCache, use_prompt_image_cache
+from response_cache import ResponseCache, get_response_cache, use_response_cache
+from tracing import finish_trace, start_trace
+from config import (
+    CLAUDE_REQUESTS_PER_SECOND,
+    CLAUDE_TOKENS_PER_MINUTE,
+    ENRICH_MAX_IN_FLIGHT,
+    enriched_dir,
 )
-from tqdm import tqdm
 
+import argparse
+import glob
 import json
+import os
+import tempfile
 
-with open("./data/all_videos_data.json", "r") as f:
-    all_videos_data = json.load(f)
 
+def load_checkpoint(journal_path):
+    # every line of the journal is one finished frame; a line torn by a crash is skipped and redone
+    done = {}
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record["index"]] = record
+    return done
 
-finalized_data = []
 
-for video, data in all_videos_data.items():
-    with open(data["transcription"], "r") as f:
-        transcript = json.load(f)
-    with open(data["frames_and_words"], "r") as f:
-        frame_caption_pairs = json.load(f)
+def enrich_video(video, manifest, engine, output_dir=enriched_dir):
+    """
+    Summarizes a video's transcript and describes every frame, checkpointing each frame to a journal as soon
+    as it is done.
 
-    transcript_summary = make_claude_transcript_summary(transcript=transcript)
+    Each frame is described with the summary of its section of the transcript, which is ready long before
+    the summary of a long video as a whole; that one is stored with every frame of the table as its
+    "transcript_summary". The journal is named after the hash of the video's frames_and_words file, so a
+    journal left over from an older version of the video is never resumed from. On a resume, the summaries
+    come back from the response cache.
+
+    Returns:
+        list: The enriched frames of the video, in frame order.
+    """
+    frames_stage = manifest.stage(video, "frames_extracted")
+    frame_caption_pairs = read_frames(frames_stage["frames_and_words"])
+
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(output_dir, f"{video}_{frames_stage['frames_hash'][:12]}")
+    journal_path = f"{prefix}_enriched.jsonl"
+    table_path = f"{prefix}_enriched.parquet"
+    outputs = (journal_path, table_path)
+    # summaries used to be written next to the journal; those files are cleaned up as well
+    for stale in [
+        path
+        for suffix in ("_enriched.jsonl", "_summary.json", "_enriched.parquet")
+        for path in glob.glob(os.path.join(output_dir, f"{video}_*{suffix}"))
+    ]:
+        if stale not in outputs:
+            os.remove(stale)
+
+    done = load_checkpoint(journal_path)
+    if done:
+        print(
+            f"Resuming {video} from its checkpoint ({len(done)}/{len(frame_caption_pairs)} frames done)"
+        )
+
+    # rewrite the journal from the records that parsed, dropping any torn line, then append to it
+    with open(journal_path, "w") as journal:
+        for record in done.values():
+            journal.write(json.dumps(record) + "\n")
+
+        def checkpoint(index, contextual_frame_description, section_summary):
+            pair = frame_caption_pairs[index]
+            # write out the updated frame caption pairs
+            new_pair = {
+                "index": index,
+                "frame_path": pair["frame_path"],
+                "words": pair["words"],
+                "timestamp": pair["timestamp"],
+                "section_summary": section_summary,
+                "contextual_frame_description": contextual_frame_description,
+            }
+            journal.write(json.dumps(new_pair) + "\n")
+            journal.flush()
+            done[index] = new_pair
+
+        transcript_summary, _, _ = engine.summarize_and_enrich(
+            frame_caption_pairs,
+            desc=video,
+            skip=done,
+            on_result=checkpoint,
+        )
 
     print(transcript_summary)
 
-    for i, pair in tqdm(enumerate(frame_caption_pairs)):
-        contextual_frame_description = create_contextual_frame_description(
-            frame_caption_index=i,
-            frame_caption_pairs=frame_caption_pairs,
-            transcript_summary=transcript_summary,
+    # the journal is the checkpoint; later stages read the finished frames from the columnar table
+    enriched = [
+        dict(done[i], video_id=video, transcript_summary=transcript_summary)
+        for i in range(len(frame_caption_pairs))
+    ]
+    write_frames(table_path, enriched, ENRICHED_COLUMNS)
+    manifest.mark_done(video, "enriched", path=table_path, journal=journal_path)
+    return enriched
+
+
+def load_enriched(video, manifest, columns=None):
+    """Reads back the enriched frames of a video that finished enrichment, in frame order."""
+    return read_frames(manifest.stage(video, "enriched")["path"], columns)
+
+
+def needs_enrichment(video, manifest):
+    # videos enriched before the columnar tables only have a journal; their frames are resumed from it, so only
+    # their summaries are requested again
+    enriched = manifest.stage(video, "enriched")
+    return enriched is None or not enriched["path"].endswith(".parquet")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-in-flight", type=int, default=ENRICH_MAX_IN_FLIGHT)
+    parser.add_argument(
+        "--requests-per-second", type=float, default=CLAUDE_REQUESTS_PER_SECOND
+    )
+    parser.add_argument(
+        "--tokens-per-minute", type=float, default=CLAUDE_TOKENS_PER_MINUTE
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="dry run against a local fake Bedrock client with canned responses; nothing in data/ is modified",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="ignore cached Claude responses and request fresh ones (they are still written to the cache)",
+    )
+    args = parser.parse_args()
+
+    output_dir = enriched_dir
+    if args.fake:
+        # keep fake responses out of the real caches, journals, manifest and traces
+        output_dir = tempfile.mkdtemp(prefix="enrich-dry-run-")
+        use_response_cache(
+            ResponseCache(os.path.join(output_dir, "claude_responses.sqlite"))
         )
-        # write out the updated frame caption pairs
-        new_pair = {
-            "frame_path": pair["frame_path"],
-            "words": pair["words"],
-            "timestamp": pair["timestamp"],
-            "transcript_summary": transcript_summary,
-            "contextual_frame_description": contextual_frame_description,
-        }
-        finalized_data.append(new_pair)
-
-# write out the finalized data
-with open("./data/finalized_data.json", "w") as f:
-    json.dump(finalized_data, f)
+        use_prompt_image_cache(PromptImageCache(os.path.join(output_dir, "prompt_images")))
+        start_trace("enrich-dry-run", root=output_dir)
+    else:
+        start_trace("enrich")
+
+    response_cache = get_response_cache()
+    response_cache.bypass = response_cache.bypass or args.no_cache
+
+    manifest = Manifest(read_only=args.fake)
+
+    engine = EnrichmentEngine(
+        client=FakeBedrockClient(throttle_rate=0.05) if args.fake else None,
+        max_in_flight=args.max_in_flight,
+        requests_per_second=args.requests_per_second,
+        tokens_per_minute=args.tokens_per_minute,
+    )
+
+    frames = 0
+    for video in manifest.videos_at("frames_extracted"):
+        if needs_enrichment(video, manifest):
+            enrich_video(video, manifest, engine, output_dir)
+        frames += count_frames(manifest.stage(video, "enriched")["path"])
+
+    frames_per_second, tokens_per_second = engine.throughput()
+    print(
+        f"Enriched {engine.frames_done} frames at {frames_per_second:.2f} frames/s, "
+        f"{tokens_per_second:.0f} tokens/s ({engine.retries} throttled retries)"
+    )
+    print(f"Claude response cache: {response_cache.stats()}")
+    print(f"{frames} enriched frames in {output_dir}")
+    finish_trace()
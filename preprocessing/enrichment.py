@@ -0,0 +1,378 @@
+# Bounded-concurrency enrichment engine. Frames are described by Claude on a thread pool, with every request
+# gated by a requests-per-second and a tokens-per-minute token bucket, and throttled requests retried with
+# jittered exponential backoff. Descriptions always come back in frame order, whatever order calls finish in.
+# Long transcripts are summarized map-reduce style on the same pool: sections of whole frames are summarized
+# concurrently, each section's frames are described as soon as its summary is in, and the section summaries
+# are combined into the summary of the whole video meanwhile, level by level, with the groups of each level
+# combined concurrently.
+
+import logging
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+from tqdm import tqdm
+
+from claude_utils import (
+    create_contextual_frame_description,
+    estimate_request_tokens,
+    make_claude_section_summary,
+    make_claude_summary_of_summaries,
+    make_claude_transcript_summary,
+)
+from clients import get_anthropic_client
+from tracing import get_tracer, span
+from config import (
+    CLAUDE_MAX_RETRIES,
+    CLAUDE_REQUESTS_PER_SECOND,
+    CLAUDE_TOKENS_PER_MINUTE,
+    ENRICH_MAX_IN_FLIGHT,
+    SUMMARY_CHUNK_TOKENS,
+)
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_STATUS_CODES = {429, 503, 529}
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `acquire` blocks until enough tokens have accumulated.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens the bucket can hold, i.e. the allowed burst.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # a request larger than the bucket could never be served, so it just drains a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_throttling_error(exc):
+    # covers the anthropic SDK errors (status_code), botocore ClientErrors, and the fake client
+    if getattr(exc, "status_code", None) in THROTTLING_STATUS_CODES:
+        return True
+    if isinstance(exc, ClientError):
+        return exc.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return False
+
+
+def call_with_backoff(fn, max_retries=CLAUDE_MAX_RETRIES, base_delay=1.0, max_delay=30.0):
+    """
+    Calls `fn`, retrying throttling errors with full-jitter exponential backoff.
+
+    Args:
+        fn (callable): Zero-argument function to call.
+        max_retries (int): How many times a throttled call is retried before the error is raised.
+        base_delay (float): Backoff ceiling in seconds for the first retry, doubled on every attempt.
+        max_delay (float): Upper bound on the backoff ceiling in seconds.
+
+    Returns:
+        tuple: The result of `fn` and the number of retries it took.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(), attempt
+        except Exception as exc:
+            if attempt == max_retries or not is_throttling_error(exc):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            logger.debug("Throttled (%s), retrying in %.2fs", exc, delay)
+            get_tracer().count("claude", retries=1, backoff_s=delay)
+            time.sleep(delay)
+
+
+def _tokens(text):
+    # the same rough ~4 characters per token as estimate_request_tokens
+    return len(text) // 4
+
+
+def chunk_frames(frame_caption_pairs, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """
+    Splits a video's frames into sections of consecutive frames whose words add up to at most `max_tokens`;
+    a single longer frame is a section on its own.
+
+    Once a section holds half of `max_tokens`, it also ends after any frame whose words hash to a multiple of 4.
+    Boundaries then depend on the words around them rather than on everything before, so an edit to one part
+    of a video only moves the boundaries near it, and the other sections (and their cached summaries) stay.
+
+    Returns:
+        list: (start, end) frame index ranges, covering every frame in order.
+    """
+    sections, start, tokens = [], 0, 0
+    for i, pair in enumerate(frame_caption_pairs):
+        frame_tokens = _tokens(pair["words"])
+        if i > start and tokens + frame_tokens > max_tokens:
+            sections.append((start, i))
+            start, tokens = i, 0
+        tokens += frame_tokens
+        if tokens >= max_tokens // 2 and zlib.crc32(pair["words"].encode("utf-8")) % 4 == 0:
+            sections.append((start, i + 1))
+            start, tokens = i + 1, 0
+    if start < len(frame_caption_pairs) or not sections:
+        sections.append((start, len(frame_caption_pairs)))
+    return sections
+
+
+def group_summaries(summaries, max_tokens=SUMMARY_CHUNK_TOKENS):
+    # consecutive summaries adding up to at most max_tokens, but at least two per group so every level shrinks
+    groups, tokens = [], 0
+    for summary in summaries:
+        if groups and (len(groups[-1]) < 2 or tokens + _tokens(summary) <= max_tokens):
+            groups[-1].append(summary)
+            tokens += _tokens(summary)
+        else:
+            groups.append([summary])
+            tokens = _tokens(summary)
+    return groups
+
+
+class _RateLimitedClient:
+    # wraps a client so every request that actually reaches Bedrock (i.e. misses the response cache)
+    # waits on the engine's rate limits first and reports its token usage afterwards
+    def __init__(self, client, engine):
+        self._client = client
+        self._engine = engine
+        self.messages = self
+
+    def create(self, **kwargs):
+        with span("claude.rate_limit_wait"):
+            self._engine.request_bucket.acquire()
+            self._engine.token_bucket.acquire(
+                estimate_request_tokens(
+                    kwargs["messages"], kwargs["max_tokens"], kwargs.get("system")
+                )
+            )
+        message = self._client.messages.create(**kwargs)
+        usage = getattr(message, "usage", None)
+        if usage is not None:
+            self._engine._record_usage(usage.input_tokens + usage.output_tokens)
+        return message
+
+
+class EnrichmentEngine:
+    """
+    Describes frames concurrently while respecting Bedrock rate limits.
+
+    The rate limits are shared by every `summarize_and_enrich` call on the same engine, so one engine should be used
+    for the whole run rather than one per video.
+
+    Args:
+        client (AnthropicBedrock, optional): Client shared by all worker threads. The shared pooled client if omitted.
+        max_in_flight (int): Maximum number of concurrent Claude requests.
+        requests_per_second (float): Sustained request rate limit.
+        tokens_per_minute (float): Sustained token rate limit, using an estimate of each request's cost.
+        max_retries (int): Retries per frame on throttling errors.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_in_flight=ENRICH_MAX_IN_FLIGHT,
+        requests_per_second=CLAUDE_REQUESTS_PER_SECOND,
+        tokens_per_minute=CLAUDE_TOKENS_PER_MINUTE,
+        max_retries=CLAUDE_MAX_RETRIES,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(
+            rate=requests_per_second, capacity=max(1, requests_per_second)
+        )
+        self.token_bucket = TokenBucket(
+            rate=tokens_per_minute / 60, capacity=tokens_per_minute
+        )
+        self.client = _RateLimitedClient(
+            client or get_anthropic_client(), self
+        )
+
+        self.frames_done = 0
+        self.tokens_used = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _record_usage(self, tokens):
+        with self._stats_lock:
+            self.tokens_used += tokens
+
+    def _call(self, attempt):
+        result, retries = call_with_backoff(attempt, max_retries=self.max_retries)
+        with self._stats_lock:
+            self.retries += retries
+        return result
+
+    def _describe(self, index, frame_caption_pairs, transcript_summary):
+        return self._call(
+            lambda: create_contextual_frame_description(
+                frame_caption_index=index,
+                frame_caption_pairs=frame_caption_pairs,
+                transcript_summary=transcript_summary,
+                client=self.client,
+            )
+        )
+
+    def summarize(self, transcript):
+        """Summarizes a transcript through the same rate limits and retry policy as the frames."""
+        return self._call(
+            lambda: make_claude_transcript_summary(transcript=transcript, client=self.client)
+        )
+
+    def _summarize_section(self, transcript):
+        with span("summary.section", tokens=_tokens(transcript)):
+            return self._call(
+                lambda: make_claude_section_summary(transcript, client=self.client)
+            )
+
+    def _combine(self, summaries, level):
+        with span("summary.reduce", sections=len(summaries), level=level):
+            return self._call(
+                lambda: make_claude_summary_of_summaries(summaries, client=self.client)
+            )
+
+    def _submit_level(self, executor, running, summaries, level, max_tokens):
+        # one level of the reduce: its groups are combined concurrently, and a group of one is carried up as is
+        groups = group_summaries(summaries, max_tokens)
+        for j, group in enumerate(groups):
+            if len(group) > 1:
+                running[executor.submit(self._combine, group, level)] = ("reduce", j)
+        return [group[0] if len(group) == 1 else None for group in groups]
+
+    def throughput(self):
+        """Returns (frames per second, tokens per second) over all `summarize_and_enrich` calls so far."""
+        if not self.elapsed:
+            return 0.0, 0.0
+        return self.frames_done / self.elapsed, self.tokens_used / self.elapsed
+
+    def summarize_and_enrich(
+        self,
+        frame_caption_pairs,
+        desc=None,
+        skip=(),
+        on_result=None,
+        max_chunk_tokens=SUMMARY_CHUNK_TOKENS,
+    ):
+        """
+        Summarizes a video's transcript map-reduce style and describes its frames, overlapping the two.
+
+        The frames are split into sections (see `chunk_frames`) whose summaries are requested concurrently. As
+        soon as a section's summary is in, its frames are described with it as their context, while the other
+        sections and the summary of the whole video are still being worked on. The section summaries are combined
+        in groups, level by level, with every group of a level sent at once. A video that fits in one section is
+        summarized in one request, as a whole.
+
+        Args:
+            frame_caption_pairs (list): Frames of one video, as written by preprocess_videos.py.
+            desc (str, optional): Label for the progress bar.
+            skip (collection, optional): Indices of frames that are already described and should not be sent.
+            on_result (callable, optional): Called as `on_result(index, description, section_summary)` on the
+                calling thread as soon as each frame finishes, e.g. to checkpoint it.
+            max_chunk_tokens (int): Most transcript tokens per section, and per group of summaries combined.
+
+        Returns:
+            tuple: The summary of the whole video, the sections as (start, end, summary), and one description per
+                frame, in frame order (None for skipped frames).
+        """
+        sections = chunk_frames(frame_caption_pairs, max_chunk_tokens)
+        section_of = {i: k for k, (start, end) in enumerate(sections) for i in range(start, end)}
+        section_summaries = [None] * len(sections)
+        descriptions = [None] * len(frame_caption_pairs)
+        summary = None
+        # the summaries being combined at the current level of the reduce, None until their group is combined
+        combined, level = None, 0
+        started = time.monotonic()
+        frames_before, tokens_before = self.frames_done, self.tokens_used
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor, tqdm(
+            total=len(frame_caption_pairs) - len(skip), desc=desc, unit="frame"
+        ) as progress:
+            running = {}
+            for k, (start, end) in enumerate(sections):
+                text = " ".join(pair["words"] for pair in frame_caption_pairs[start:end])
+                summarize = self.summarize if len(sections) == 1 else self._summarize_section
+                running[executor.submit(summarize, text)] = ("section", k)
+
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    kind, key = running.pop(future)
+                    result = future.result()
+                    if kind == "frame":
+                        descriptions[key] = result
+                        if on_result is not None:
+                            on_result(key, result, section_summaries[section_of[key]])
+                        self._frame_done(progress, started, frames_before, tokens_before)
+                    elif kind == "reduce":
+                        # the next level starts once every group of this one is combined
+                        combined[key] = result
+                        if all(s is not None for s in combined):
+                            if len(combined) == 1:
+                                summary = combined[0]
+                            else:
+                                level += 1
+                                combined = self._submit_level(executor, running, combined, level, max_chunk_tokens)
+                    else:
+                        section_summaries[key] = result
+                        start, end = sections[key]
+                        for i in range(start, end):
+                            if i not in skip:
+                                running[
+                                    executor.submit(self._describe, i, frame_caption_pairs, result)
+                                ] = ("frame", i)
+                        if all(s is not None for s in section_summaries):
+                            if len(sections) == 1:
+                                summary = result
+                            else:
+                                level = 1
+                                combined = self._submit_level(
+                                    executor, running, section_summaries, level, max_chunk_tokens
+                                )
+
+        with self._stats_lock:
+            self.elapsed += time.monotonic() - started
+        return (
+            summary,
+            [(start, end, s) for (start, end), s in zip(sections, section_summaries)],
+            descriptions,
+        )
+
+    def _frame_done(self, progress, started, frames_before, tokens_before):
+        progress.update(1)
+        seconds = time.monotonic() - started
+        with self._stats_lock:
+            self.frames_done += 1
+            frames = self.frames_done - frames_before
+            tokens = self.tokens_used - tokens_before
+        progress.set_postfix(
+            frames_per_s=f"{frames / seconds:.2f}",
+            tokens_per_s=f"{tokens / seconds:.0f}",
+            retries=self.retries,
+        )
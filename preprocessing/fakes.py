@@ -0,0 +1,171 @@
+# Local stand-ins for the remote services used by the pipeline. These let the scripts run end to end
+# without AWS credentials or a Pinecone index, and make it possible to exercise concurrency, retries and throttling offline.
+
+import hashlib
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from claude_utils import estimate_request_tokens
+
+
+class FakeThrottlingError(Exception):
+    """Raised by the fake clients to mimic a Bedrock 429 / ThrottlingException."""
+
+    status_code = 429
+
+
+class _FakeMessages:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, max_tokens, messages, system=None, **kwargs):
+        return self._client._respond(model, max_tokens, messages, system)
+
+    def stream(self, model, max_tokens, messages, system=None, **kwargs):
+        # the latency is paid before the first token, then the words trickle in
+        return _FakeStream(self._client._respond(model, max_tokens, messages, system))
+
+
+class _FakeStream:
+    def __init__(self, response):
+        self._text = response.content[0].text
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        for i, word in enumerate(self._text.split(" ")):
+            time.sleep(0.01)
+            yield word if i == 0 else " " + word
+
+
+class FakeBedrockClient:
+    """
+    Drop-in replacement for AnthropicBedrock's `messages.create` and `messages.stream`, returning canned responses.
+
+    Args:
+        latency (float): Base latency in seconds injected into every call.
+        jitter (float): Extra uniformly random latency in seconds added on top of `latency`.
+        throttle_rate (float): Probability that a call raises FakeThrottlingError instead of answering.
+        seed (int, optional): Seed for the latency and throttling randomness.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.1, throttle_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.messages = _FakeMessages(self)
+        self.calls = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            throttle = self._random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        return delay, throttle
+
+    def _respond(self, model, max_tokens, messages, system):
+        delay, throttle = self._roll()
+        time.sleep(delay)
+        if throttle:
+            raise FakeThrottlingError("Too many requests, please wait before trying again.")
+
+        # the canned answer depends only on the request, so reruns are reproducible
+        prompt = repr((model, system, messages))
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        text = f"Fake response {digest} from {model}."
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=text)],
+            usage=SimpleNamespace(
+                input_tokens=estimate_request_tokens(messages, 0, system),
+                output_tokens=min(max_tokens, 64),
+            ),
+        )
+
+
+class _FakeBody:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def read(self):
+        return self._payload
+
+
+def fake_embedding(text, dimension):
+    # deterministic unit vector seeded by the text, so the same text always embeds the same way
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimension)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class FakeBedrockRuntime(FakeBedrockClient):
+    """
+    Drop-in replacement for a boto3 `bedrock-runtime` client's `invoke_model`, returning Titan-shaped
+    text embeddings. Takes the same latency and throttling arguments as FakeBedrockClient.
+    """
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        delay, throttle = self._roll()
+        time.sleep(delay)
+        if throttle:
+            raise FakeThrottlingError("Too many requests, please wait before trying again.")
+        request = json.loads(body)
+        embedding = fake_embedding(request["inputText"], request.get("dimensions", 1024))
+        payload = json.dumps(
+            {"embedding": embedding, "inputTextTokenCount": len(request["inputText"]) // 4}
+        )
+        return {"body": _FakeBody(payload.encode("utf-8"))}
+
+
+class FakeIndex:
+    """
+    In-process stand-in for a Pinecone index, holding vectors in a dict.
+
+    Args:
+        latency (float): Latency in seconds injected into every upsert and delete.
+        failure_rate (float): Probability that an upsert raises instead of storing its vectors.
+        seed (int, optional): Seed for the failure randomness.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.vectors = {}
+        self.upsert_calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, namespace=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.upsert_calls += 1
+            if self._random.random() < self.failure_rate:
+                raise FakeThrottlingError("Fake upsert failure")
+            for vector in vectors:
+                self.vectors[vector["id"]] = vector
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids, namespace=None):
+        time.sleep(self.latency)
+        with self._lock:
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+        return {}
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {"total_vector_count": len(self.vectors)}
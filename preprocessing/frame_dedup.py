@@ -0,0 +1,92 @@
+# Merging of near-duplicate frames. Static slides or a speaker grid give long runs of frames that look the same,
+# and each of them would otherwise cost a Claude description and a Titan embedding. Frames are compared by a
+# difference hash (dHash) computed for all frames of a video at once in NumPy, and each run of consecutive frames
+# near-identical to the run's first frame is collapsed into that frame, spanning the run's time and carrying all
+# its words.
+
+import numpy as np
+from PIL import Image
+
+from config import DEDUP_HASH_SIZE, DEDUP_MAX_DISTANCE
+
+
+def load_thumbnails(frame_paths, hash_size=DEDUP_HASH_SIZE):
+    """Loads frames as (n, hash_size, hash_size + 1) grayscale thumbnails, the input of the difference hash."""
+    thumbnails = np.empty((len(frame_paths), hash_size, hash_size + 1), dtype=np.float32)
+    for i, path in enumerate(frame_paths):
+        with Image.open(path) as image:
+            thumbnails[i] = np.asarray(
+                image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR),
+                dtype=np.float32,
+            )
+    return thumbnails
+
+
+def difference_hashes(thumbnails):
+    """
+    Computes the dHash of every thumbnail at once: one bit per pair of horizontally adjacent pixels, set when
+    the brightness increases.
+
+    Returns:
+        np.ndarray: (n, hash_size * hash_size) boolean bits, one row per frame.
+    """
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    return bits.reshape(len(thumbnails), -1)
+
+
+def run_starts(hashes, max_distance=DEDUP_MAX_DISTANCE):
+    """
+    Splits frames into runs of consecutive frames that are near-duplicates of the run's first frame.
+
+    Each frame is compared with the first frame of the current run, the one that is kept, rather than with the
+    frame before it, so a slow pan or a gradually built-up slide can't chain dissimilar frames into one run.
+
+    Returns:
+        np.ndarray: Index of the first frame of every run, in order.
+    """
+    starts = [0] if len(hashes) else []
+    for i in range(1, len(hashes)):
+        # hamming distance between the frame and the first frame of its run
+        if np.count_nonzero(hashes[i] != hashes[starts[-1]]) > max_distance:
+            starts.append(i)
+    return np.array(starts, dtype=np.int64)
+
+
+def merge_duplicate_frames(
+    frames_and_words, hash_size=DEDUP_HASH_SIZE, max_distance=DEDUP_MAX_DISTANCE
+):
+    """
+    Collapses runs of near-identical consecutive frames into one record each.
+
+    A merged record keeps the first frame's image, spans from the first frame's start to the last frame's end,
+    and concatenates the words of every frame in the run.
+
+    Args:
+        frames_and_words (list): Frames in time order, as returned by assign_words_to_frames.
+        hash_size (int): Side of the hash grid; hashes have hash_size**2 bits.
+        max_distance (int): Most differing hash bits for two frames to count as duplicates; -1 disables merging.
+
+    Returns:
+        list: The merged frames, each with a "merged_frames" count of how many frames it stands for.
+    """
+    if max_distance < 0 or len(frames_and_words) < 2:
+        return [dict(frame, merged_frames=1) for frame in frames_and_words]
+
+    hashes = difference_hashes(
+        load_thumbnails([f["frame_path"] for f in frames_and_words], hash_size)
+    )
+    starts = run_starts(hashes, max_distance)
+    ends = np.append(starts[1:], len(frames_and_words))
+
+    merged = []
+    for start, end in zip(starts, ends):
+        run = frames_and_words[start:end]
+        merged.append(
+            {
+                "frame_path": run[0]["frame_path"],
+                "words": "".join(f["words"] for f in run),
+                "timestamp": (run[0]["timestamp"][0], run[-1]["timestamp"][1]),
+                "merged_frames": len(run),
+            }
+        )
+    return merged
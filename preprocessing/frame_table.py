@@ -0,0 +1,199 @@
+# Columnar storage of the per-frame intermediates passed between the pipeline stages: frames paired with words,
+# enriched frames, and enriched frames with their embeddings. Each video's frames are one Parquet file with typed
+# columns (timestamps as durations, embeddings as a fixed-size float32 list), written in row groups, so a stage
+# can stream a corpus of any size batch by batch and read only the columns it needs. A corpus is simply the set
+# of its videos' files, so adding a video appends a file and leaves the others alone.
+
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import FRAME_TABLE_ROW_GROUP_ROWS
+
+TIMESTAMP_TYPE = pa.duration("us")
+
+# every column a frame table may have, in order; a table holds the ones its stage has produced
+COLUMNS = {
+    "video_id": pa.string(),
+    "index": pa.int32(),
+    "frame_path": pa.string(),
+    "timestamp_start": TIMESTAMP_TYPE,
+    "timestamp_end": TIMESTAMP_TYPE,
+    "words": pa.string(),
+    "merged_frames": pa.int32(),
+    "transcript_summary": pa.string(),
+    "contextual_frame_description": pa.string(),
+}
+
+# the columns each stage writes
+FRAMES_AND_WORDS_COLUMNS = [
+    "video_id",
+    "index",
+    "frame_path",
+    "timestamp_start",
+    "timestamp_end",
+    "words",
+    "merged_frames",
+]
+ENRICHED_COLUMNS = [
+    "video_id",
+    "index",
+    "frame_path",
+    "timestamp_start",
+    "timestamp_end",
+    "words",
+    "transcript_summary",
+    "contextual_frame_description",
+]
+
+
+def schema(columns, dimension=None):
+    """The schema of a table with `columns`, plus a fixed-size float32 "embedding" column if `dimension` is set."""
+    fields = [pa.field(name, COLUMNS[name]) for name in columns]
+    if dimension is not None:
+        fields.append(pa.field("embedding", pa.list_(pa.float32(), dimension)))
+    return pa.schema(fields)
+
+
+def _to_batch(frames, schema, embeddings=None):
+    # frames are dicts as the pipeline passes them around, with a (start, end) "timestamp" in seconds
+    arrays = []
+    for field in schema:
+        if field.name == "embedding":
+            values = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1)
+            arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values), field.type.list_size))
+        elif field.name in ("timestamp_start", "timestamp_end"):
+            position = 0 if field.name == "timestamp_start" else 1
+            micros = np.round(np.array([f["timestamp"][position] for f in frames], dtype=np.float64) * 1e6)
+            arrays.append(pa.array(micros.astype(np.int64), type=field.type))
+        else:
+            arrays.append(pa.array([f[field.name] for f in frames], type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class FrameTableWriter:
+    """
+    Writes a frame table batch by batch, one or more row groups per batch, to a temporary file that replaces
+    `path` on `close`, so readers never see a half-written table.
+
+    Args:
+        path (str or Path): Location of the Parquet file.
+        schema (pa.Schema): Columns of the table, see `schema`.
+        row_group_rows (int): Most rows per row group, the unit that readers load at once.
+    """
+
+    def __init__(self, path, schema, row_group_rows=FRAME_TABLE_ROW_GROUP_ROWS):
+        self.path = str(path)
+        self.schema = schema
+        self.row_group_rows = row_group_rows
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._tmp_path = f"{self.path}.tmp"
+        # embeddings hardly compress, and decoding them is a third faster uncompressed
+        compression = {name: "none" if name == "embedding" else "zstd" for name in schema.names}
+        self._writer = pq.ParquetWriter(self._tmp_path, schema, compression=compression)
+
+    def write(self, frames, embeddings=None):
+        if frames:
+            self._writer.write_batch(
+                _to_batch(frames, self.schema, embeddings), row_group_size=self.row_group_rows
+            )
+
+    def write_batch(self, batch, embeddings=None):
+        """Writes an Arrow batch read from another frame table, adding the embedding column if given."""
+        arrays = [batch.column(name) for name in self.schema.names if name != "embedding"]
+        if embeddings is not None:
+            values = pa.array(np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1))
+            arrays.append(pa.FixedSizeListArray.from_arrays(values, self.schema.field("embedding").type.list_size))
+        self._writer.write_batch(
+            pa.RecordBatch.from_arrays(arrays, schema=self.schema), row_group_size=self.row_group_rows
+        )
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+            os.remove(self._tmp_path)
+
+
+def write_frames(path, frames, columns, embeddings=None):
+    """Writes a whole frame table at once; `embeddings` (one row per frame) adds the embedding column."""
+    dimension = None if embeddings is None else np.shape(embeddings)[1]
+    with FrameTableWriter(path, schema(columns, dimension)) as writer:
+        for start in range(0, len(frames), writer.row_group_rows):
+            end = start + writer.row_group_rows
+            writer.write(frames[start:end], None if embeddings is None else embeddings[start:end])
+
+
+def _to_frames(batch):
+    # back to the dicts the pipeline passes around, timestamps as (start, end) seconds; embeddings stay apart
+    columns = {
+        name: batch.column(name).to_pylist()
+        for name in batch.schema.names
+        if name not in ("timestamp_start", "timestamp_end", "embedding")
+    }
+    if "timestamp_start" in batch.schema.names:
+        starts = batch.column("timestamp_start").cast(pa.int64()).to_numpy() / 1e6
+        ends = batch.column("timestamp_end").cast(pa.int64()).to_numpy() / 1e6
+        columns["timestamp"] = list(zip(starts.tolist(), ends.tolist()))
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def embedding_matrix(batch):
+    """The embedding column of a batch as a (rows, dimension) float32 array, without copying."""
+    column = batch.column("embedding")
+    return column.values.to_numpy(zero_copy_only=False).reshape(len(column), column.type.list_size)
+
+
+def iter_batches(paths, columns=None):
+    """
+    Streams the row groups of one or more frame tables as Arrow record batches, reading only `columns` (all if
+    None; ask for "timestamp_start" and "timestamp_end" together).
+    """
+    for path in [paths] if isinstance(paths, (str, os.PathLike)) else paths:
+        table = pq.ParquetFile(path)
+        for group in range(table.num_row_groups):
+            yield from table.read_row_group(group, columns=columns).to_batches()
+
+
+def iter_frames(paths, columns=None):
+    """
+    Streams frames as dicts, one row group in memory at a time.
+
+    Yields:
+        tuple: (frame, embedding) pairs; the embedding is None unless "embedding" is among the columns read.
+    """
+    for batch in iter_batches(paths, columns):
+        embeddings = embedding_matrix(batch) if "embedding" in batch.schema.names else None
+        for i, frame in enumerate(_to_frames(batch)):
+            yield frame, None if embeddings is None else embeddings[i]
+
+
+def read_frames(path, columns=None):
+    """Reads a whole (single video's) frame table as a list of frame dicts."""
+    return [frame for frame, _ in iter_frames(path, columns)]
+
+
+def read_column(paths, column):
+    """One column of one or more frame tables as a flat Python list, e.g. the texts to embed."""
+    values = []
+    for batch in iter_batches(paths, [column]):
+        values.extend(batch.column(column).to_pylist())
+    return values
+
+
+def count_frames(paths):
+    """Number of frames in one or more frame tables, from their footers alone."""
+    return sum(
+        pq.ParquetFile(path).metadata.num_rows
+        for path in ([paths] if isinstance(paths, (str, os.PathLike)) else paths)
+    )
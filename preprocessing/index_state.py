@@ -0,0 +1,81 @@
+# Stable vector ids and a local record of what was last upserted to an index. Ids are derived from the video
+# and the frame's start time, so a frame keeps its id when videos are added, removed or reordered. Comparing
+# record fingerprints against the last upsert lets a delta run send only added or changed vectors, and delete
+# the vectors of frames that no longer exist.
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from config import state_dir
+
+
+def make_vector_id(video, timestamp_start):
+    """
+    Builds the id of a frame's vector from its video name and start time (in milliseconds).
+
+    Pinecone ids must be ASCII, so the name is reduced to a safe slug, with a short hash of the original name
+    to keep two videos whose names only differ in stripped characters apart.
+    """
+    return f"{vector_id_prefix(video)}{round(float(timestamp_start) * 1000):010d}"
+
+
+def vector_id_prefix(video):
+    """The part shared by the ids of every vector of a video, up to and including the "#"."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", video).strip("_")[:64]
+    name_hash = hashlib.sha1(video.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{name_hash}#"
+
+
+def record_fingerprint(record):
+    digest = hashlib.sha256()
+    digest.update(np.asarray(record["values"], dtype=np.float32).tobytes())
+    digest.update(json.dumps(record["metadata"], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IndexState:
+    """
+    Fingerprints of the records last upserted to an index, keyed by vector id.
+
+    Args:
+        index_name (str): Index the state belongs to; each index has its own file.
+        root (str or Path): Folder holding the state files.
+        read_only (bool): If True, changes are kept in memory only, e.g. for dry runs against a fake index.
+    """
+
+    def __init__(self, index_name, root=state_dir, read_only=False):
+        self.path = os.path.join(root, f"{index_name}_upserted.json")
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.fingerprints = json.load(f)
+        else:
+            self.fingerprints = {}
+
+    def is_current(self, record_id, fingerprint):
+        return self.fingerprints.get(record_id) == fingerprint
+
+    def update(self, fingerprints):
+        with self._lock:
+            self.fingerprints.update(fingerprints)
+
+    def remove(self, record_ids):
+        with self._lock:
+            for record_id in record_ids:
+                self.fingerprints.pop(record_id, None)
+
+    def save(self):
+        if self.read_only:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.fingerprints, f)
+            os.replace(tmp_path, self.path)
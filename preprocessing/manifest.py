@@ -0,0 +1,126 @@
+# Manifest of per-video pipeline state. For every video it records a content hash and which stages are done,
+# along with the files each stage produced, so the scripts only process new or changed videos and pick up where
+# an interrupted run stopped.
+
+import hashlib
+import json
+import os
+import threading
+
+from config import manifest_path
+
+# stages in pipeline order; redoing a stage invalidates every stage after it
+STAGES = (
+    "decoded",
+    "transcribed",
+    "frames_extracted",
+    "enriched",
+    "embedded",
+    "upserted",
+)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    JSON-backed record of which pipeline stages are done for each video.
+
+    Every change is written straight to disk (atomically), so the manifest is always a valid checkpoint.
+
+    Args:
+        path (str or Path): Location of the manifest file.
+        read_only (bool): If True, changes are kept in memory only, e.g. for dry runs against fake services.
+    """
+
+    def __init__(self, path=manifest_path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.videos = json.load(f)["videos"]
+        else:
+            self.videos = {}
+
+    def save(self):
+        if self.read_only:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"videos": self.videos}, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def sync_video(self, video_name, video_path):
+        """
+        Registers a video, resetting all of its stages if the file content changed since the last run.
+
+        Hashing a multi-GB recording is not free, so the hash is only recomputed when the file's size or
+        modification time changed.
+
+        Returns:
+            bool: True if the video is new or changed.
+        """
+        stat = os.stat(video_path)
+        with self._lock:
+            entry = self.videos.get(video_name)
+            if (
+                entry is not None
+                and entry["size"] == stat.st_size
+                and entry["mtime"] == stat.st_mtime
+            ):
+                return False
+
+            content_hash = hash_file(video_path)
+            changed = entry is None or entry["content_hash"] != content_hash
+            if changed:
+                entry = {"video_path": str(video_path), "stages": {}}
+            entry.update(
+                content_hash=content_hash, size=stat.st_size, mtime=stat.st_mtime
+            )
+            self.videos[video_name] = entry
+            self.save()
+            return changed
+
+    def remove_missing(self, video_names):
+        """Drops videos that are no longer in the videos folder. Returns the removed names."""
+        with self._lock:
+            removed = [name for name in self.videos if name not in video_names]
+            for name in removed:
+                del self.videos[name]
+            if removed:
+                self.save()
+            return removed
+
+    def is_done(self, video_name, stage):
+        with self._lock:
+            return stage in self.videos[video_name]["stages"]
+
+    def stage(self, video_name, stage):
+        """Returns what was recorded when `stage` finished for the video, or None if it is not done."""
+        with self._lock:
+            return self.videos[video_name]["stages"].get(stage)
+
+    def mark_done(self, video_name, stage, **outputs):
+        """Marks `stage` done, recording its outputs, and resets every later stage."""
+        with self._lock:
+            stages = self.videos[video_name]["stages"]
+            for later in STAGES[STAGES.index(stage) + 1 :]:
+                stages.pop(later, None)
+            stages[stage] = outputs
+            self.save()
+
+    def videos_at(self, stage):
+        """Names of the videos that have finished `stage`."""
+        with self._lock:
+            return [
+                name for name, entry in self.videos.items() if stage in entry["stages"]
+            ]
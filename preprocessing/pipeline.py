@@ -0,0 +1,331 @@
+# Pipelined orchestrator. `make update` runs preprocess, enrich and upsert one after another, each over the whole
+# corpus, so Whisper, Claude and Titan/Pinecone never work at the same time. Here every video streams through all
+# stages on its own: while one video is being transcribed, the one before it is being enriched and the one before
+# that upserted. Each stage is a pool of workers sized for its kind of work, fed from a bounded queue; a stage
+# that falls behind fills its queue and blocks the stages before it (backpressure), so work never piles up ahead
+# of the slowest stage. A video's vectors are upserted as soon as it is enriched, so the first videos can be
+# queried while later ones are still being transcribed. Every stage checks the manifest first, as the separate
+# scripts do, so an interrupted run resumes where it stopped. Run with `python preprocessing/pipeline.py`.
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from config import (
+    CLAUDE_REQUESTS_PER_SECOND,
+    CLAUDE_TOKENS_PER_MINUTE,
+    ENRICH_MAX_IN_FLIGHT,
+    EXTRACT_WORKERS,
+    PIPELINE_ENRICH_VIDEOS,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_SPARSE_INTERVAL_S,
+    RETRIEVAL_MODE,
+    RETRIEVAL_MODES,
+    TRANSCRIBE_WORKERS,
+    VECTOR_STORE,
+    audio_dir,
+    frames_and_words_dir,
+    frames_dir,
+    index_name,
+    sparse_index_dir,
+    transcriptions_dir,
+    videos_dir,
+)
+from clients import vector_index_key
+from embeddings import EmbeddingStore
+from enrich_and_create_vectors import enrich_video, needs_enrichment
+from enrichment import EnrichmentEngine
+from index_state import IndexState
+from manifest import Manifest
+from preprocess_videos import (
+    SAMPLING,
+    decode_video,
+    finish_transcription,
+    needs_decode,
+    needs_pairing,
+    pair_frames_with_words,
+)
+from query_cache import mark_index_changed
+from sparse_index import SparseIndexUpdates, sparse_index_path
+from tracing import finish_trace, span, start_trace
+from transcription import transcribe, transcription_pool
+from upsert_vectors import (
+    embed_videos,
+    first_stage_for,
+    needs_embedding,
+    open_index,
+    upsert_videos,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# put on a stage's inbox once no more videos will come
+_DONE = object()
+
+
+class Stage:
+    """
+    A pool of worker threads that apply `fn` to every video taken from `inbox` and pass it on to `outbox`.
+
+    Putting a video on a full `outbox` blocks until the next stage takes one, which is what holds back a stage
+    that runs ahead. A video whose `fn` raises is logged, recorded in `failed` and not passed on, so the other
+    videos keep going. The stage ends when `_DONE` comes through its inbox; its last worker then passes `_DONE`
+    on.
+
+    Args:
+        name (str): Name of the stage, for logs and spans.
+        fn (callable): Does the stage's work for one video, given its name.
+        workers (int): Number of videos worked on at once.
+        inbox (queue.Queue): Videos to work on.
+        outbox (queue.Queue, optional): Where finished videos go; None for the last stage.
+        failed (dict): Shared by all stages; maps each failed video to the stage it failed in.
+    """
+
+    def __init__(self, name, fn, workers, inbox, outbox, failed):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.failed = failed
+        self.done = 0
+        self.busy_s = 0.0
+        self._running = workers
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            video = self.inbox.get()
+            if video is _DONE:
+                # left for the stage's other workers, and passed on by the last one
+                self.inbox.put(_DONE)
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                if last and self.outbox is not None:
+                    self.outbox.put(_DONE)
+                return
+
+            started = time.perf_counter()
+            try:
+                with span(f"pipeline.{self.name}", video=video):
+                    self.fn(video)
+            except Exception:
+                logger.exception("%s failed for %s; the other videos go on", self.name, video)
+                with self._lock:
+                    self.failed[video] = self.name
+                continue
+            finally:
+                with self._lock:
+                    self.busy_s += time.perf_counter() - started
+            with self._lock:
+                self.done += 1
+            if self.outbox is not None:
+                self.outbox.put(video)
+
+
+def run_pipeline(video_paths, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Streams videos through `stages`, a list of (name, fn, workers), with a queue of at most `queue_size`
+    videos in front of each stage.
+
+    Returns:
+        tuple: The stages, for their statistics, and a dict of the videos that failed and the stage they failed in.
+    """
+    failed = {}
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    running = [
+        Stage(name, fn, workers, queues[i], queues[i + 1] if i + 1 < len(stages) else None, failed).start()
+        for i, (name, fn, workers) in enumerate(stages)
+    ]
+    for video_path in video_paths:
+        # blocks while the first stage is queue_size videos behind
+        queues[0].put(video_path)
+    queues[0].put(_DONE)
+    for stage in running:
+        stage.join()
+    return running, failed
+
+
+def video_name(video_path):
+    return os.path.splitext(os.path.basename(video_path))[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sampling",
+        choices=("interval", "scene"),
+        default=SAMPLING,
+        help="sample a frame every INTERVAL seconds, or one per scene change (e.g. per slide)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("pinecone", "local"),
+        default=VECTOR_STORE,
+        help="upsert into Pinecone, or into the local on-disk index under data/local_index",
+    )
+    parser.add_argument("--mode", choices=RETRIEVAL_MODES, default=RETRIEVAL_MODE)
+    parser.add_argument(
+        "--enrich-videos",
+        type=int,
+        default=PIPELINE_ENRICH_VIDEOS,
+        help="videos enriched at once; they share --max-in-flight requests and the Claude rate limits",
+    )
+    parser.add_argument("--max-in-flight", type=int, default=ENRICH_MAX_IN_FLIGHT)
+    parser.add_argument("--requests-per-second", type=float, default=CLAUDE_REQUESTS_PER_SECOND)
+    parser.add_argument("--tokens-per-minute", type=float, default=CLAUDE_TOKENS_PER_MINUTE)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=PIPELINE_QUEUE_SIZE,
+        help="most videos waiting in front of each stage",
+    )
+    args = parser.parse_args()
+    if args.mode in ("int8", "binary") and args.backend == "pinecone":
+        parser.error(f"--mode {args.mode} needs --backend local")
+    start_trace("pipeline")
+
+    for folder in (transcriptions_dir, frames_and_words_dir, frames_dir, audio_dir):
+        os.makedirs(folder, exist_ok=True)
+
+    # smallest first, so the first vectors are queryable as early as possible
+    video_paths = sorted(
+        (os.path.join(videos_dir, f) for f in os.listdir(videos_dir) if f.endswith(".mp4")),
+        key=os.path.getsize,
+    )
+    manifest = Manifest()
+    removed = manifest.remove_missing([video_name(path) for path in video_paths])
+    if removed:
+        print(f"Dropped {len(removed)} videos that are no longer present: {removed}")
+
+    # Whisper gets a process per worker; on GPU (no pool) one video is transcribed at a time in this process
+    asr_pool = transcription_pool(TRANSCRIBE_WORKERS)
+    # one engine for every video, so the rate limits hold for the whole run; the videos enriched at once split
+    # the in-flight requests between them
+    engine = EnrichmentEngine(
+        max_in_flight=max(1, args.max_in_flight // args.enrich_videos),
+        requests_per_second=args.requests_per_second,
+        tokens_per_minute=args.tokens_per_minute,
+    )
+    store = EmbeddingStore("amazon.titan-embed-text-v2:0", 1024)
+    index = open_index(args.backend, args.mode)
+    index_key = vector_index_key(index_name, args.backend, args.mode)
+    state = IndexState(index_key)
+    first_stage = first_stage_for(args.mode, manifest)
+    # the local index, or the local rerank store of a two-stage index, is written to disk after each video
+    saves_locally = args.backend == "local" or args.mode != "full"
+    sparse_path = sparse_index_path(index_key, root=sparse_index_dir)
+    sparse_updates = SparseIndexUpdates(sparse_path, PIPELINE_SPARSE_INTERVAL_S)
+
+    def decode(video_path):
+        # ffmpeg runs as a process of its own; the worker thread only waits for it
+        video = video_name(video_path)
+        manifest.sync_video(video, video_path)
+        if needs_decode(video, manifest, args.sampling):
+            decode_video(video_path, manifest, args.sampling)
+
+    def transcribe_audio(video_path):
+        video = video_name(video_path)
+        if manifest.is_done(video, "transcribed"):
+            return
+        audio_path = manifest.stage(video, "decoded")["audio"]
+        if asr_pool is None:
+            transcription, timings = transcribe(audio_path)
+        else:
+            transcription, timings = asr_pool.submit(transcribe, audio_path).result()
+        finish_transcription(video, audio_path, transcription, timings, manifest)
+
+    def pair(video_path):
+        video = video_name(video_path)
+        if needs_pairing(video, manifest):
+            pair_frames_with_words(video, manifest)
+
+    def enrich(video_path):
+        video = video_name(video_path)
+        if needs_enrichment(video, manifest):
+            enrich_video(video, manifest, engine)
+
+    def index_video(video_path):
+        video = video_name(video_path)
+        if needs_embedding(video, manifest):
+            embed_videos([video], manifest, store)
+        sent, deleted = upsert_videos(
+            [video], manifest, index, state, first_stage=first_stage, subset=True, sparse_updates=sparse_updates
+        )
+        # the keyword index is rebuilt with the videos indexed so far every so often, not after every video
+        sparse_saved = sparse_updates.save_if_due()
+        if sent or deleted or sparse_saved:
+            if saves_locally:
+                index.save()
+            # the app drops its cached matches and reloads a local index and the keyword index, so the video can
+            # be queried now
+            mark_index_changed(index_key)
+
+    started = time.perf_counter()
+    try:
+        stages, failed = run_pipeline(
+            video_paths,
+            [
+                ("decode", decode, EXTRACT_WORKERS),
+                ("transcribe", transcribe_audio, TRANSCRIBE_WORKERS if asr_pool is not None else 1),
+                ("pair", pair, 1),
+                ("enrich", enrich, args.enrich_videos),
+                ("index", index_video, 1),
+            ],
+            queue_size=args.queue_size,
+        )
+    finally:
+        if asr_pool is not None:
+            asr_pool.shutdown()
+    pipeline_s = time.perf_counter() - started
+
+    # one pass over every embedded video, as `make upsert` does: nothing is sent again, but vectors of removed
+    # videos are deleted and the keyword index is rebuilt from all records
+    with span("pipeline.finalize"):
+        try:
+            upsert_videos(
+                manifest.videos_at("embedded"),
+                manifest,
+                index,
+                state,
+                first_stage=first_stage,
+                sparse_path=sparse_path,
+            )
+        finally:
+            if saves_locally:
+                index.save()
+            mark_index_changed(index_key)
+
+    for stage in stages:
+        print(
+            f"{stage.name:>10}: {stage.done} videos, busy {stage.busy_s:.1f}s over {stage.workers} "
+            f"worker{'s' if stage.workers > 1 else ''}"
+        )
+    slowest = max(stage.busy_s / stage.workers for stage in stages)
+    print(
+        f"Pipeline finished in {pipeline_s:.1f}s; the slowest stage needed {slowest:.1f}s on its own, "
+        f"and all stages one after another {sum(stage.busy_s / stage.workers for stage in stages):.1f}s"
+    )
+    finish_trace()
+    if failed:
+        raise SystemExit(f"Some videos failed and were skipped, rerun to retry them: {failed}")
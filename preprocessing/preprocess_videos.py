@@ -1,27 +1,126 @@
+import argparse
 import ffmpeg
-from transformers import pipeline
 import os
-import torch
 import json
-from config import videos_dir, data_dir
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import (
+    videos_dir,
+    data_dir,
+    transcriptions_dir,
+    frames_and_words_dir,
+    frames_dir,
+    audio_dir,
+    EXTRACT_WORKERS,
+    DEDUP_HASH_SIZE,
+    DEDUP_MAX_DISTANCE,
+    WORD_BOUNDARY,
+)
+from frame_dedup import merge_duplicate_frames
+from frame_table import FRAMES_AND_WORDS_COLUMNS, write_frames
+from manifest import Manifest, hash_file
+from prompt_images import get_prompt_image_cache
+from tracing import finish_trace, get_tracer, span, start_trace
+from word_alignment import assign_words_to_frames
+from transcription import SAMPLING_RATE, transcribe, transcribe_many
 
 # Important Globals
 ## seconds to walk over the videos for
 INTERVAL = 45
+## how frames are sampled: "interval" takes one every INTERVAL seconds, "scene" takes one whenever the
+## picture changes (e.g. a new slide), but never closer than MIN_INTERVAL or further apart than MAX_INTERVAL
+SAMPLING = "interval"
+SCENE_THRESHOLD = 0.3
+MIN_INTERVAL = 5
+MAX_INTERVAL = 120
 
 
 # Step 1: Transcribe Video
 def transcribe_video(video_path):
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    transcriber = pipeline(
-        "automatic-speech-recognition", model="openai/whisper-tiny", device=device
-    )
-    transcription = transcriber(video_path, return_timestamps="word")
+    # the Whisper model is loaded once per process and reused across videos
+    with span("transcribe", path=str(video_path)) as s:
+        transcription, timings = transcribe(video_path)
+        s.add(audio_s=timings["audio_s"], words=len(transcription.get("chunks", [])))
+    print_timings(video_path, timings)
     return transcription
 
 
+def print_timings(video_path, timings):
+    print(
+        f"Transcribed {os.path.basename(video_path)}: {timings['audio_s']:.0f}s of audio in "
+        f"{timings['decode_s'] + timings['transcribe_s']:.1f}s (decode {timings['decode_s']:.1f}s), "
+        f"real-time factor {timings['rtf']:.3f}"
+    )
+
+
+def save_transcription(video_filename, transcription, manifest):
+    transcription_filename = os.path.join(
+        transcriptions_dir, video_filename + "_transcription.json"
+    )
+    words_filename = os.path.join(transcriptions_dir, video_filename + "_words.json")
+
+    # Write transcription out as json, and keep the word chunks so frames can be re-paired without re-transcribing
+    with open(transcription_filename, "w") as f:
+        json.dump(transcription["text"], f)
+    with open(words_filename, "w") as f:
+        json.dump(transcription, f)
+    manifest.mark_done(
+        video_filename,
+        "transcribed",
+        transcription=transcription_filename,
+        words=words_filename,
+        audio_hash=manifest.stage(video_filename, "decoded").get("audio_hash"),
+    )
+
+
+def finish_transcription(video_filename, audio_path, transcription, timings, manifest):
+    # transcription runs in worker processes, so its span is recorded here from the timings they report
+    get_tracer().record(
+        "transcribe",
+        timings["decode_s"] + timings["transcribe_s"],
+        counters={
+            "audio_s": timings["audio_s"],
+            "words": len(transcription.get("chunks", [])),
+        },
+        path=audio_path,
+    )
+    print_timings(audio_path, timings)
+    save_transcription(video_filename, transcription, manifest)
+
+
 # Step 2: Extract Frames and Pair with Dialogue
-def extract_frames(frames_output_path, video_path, interval):
+def extract_frames(
+    frames_output_path,
+    video_path,
+    interval,
+    audio_output_path=None,
+    sampling=SAMPLING,
+    scene_threshold=SCENE_THRESHOLD,
+    min_interval=MIN_INTERVAL,
+    max_interval=MAX_INTERVAL,
+):
+    """
+    Samples frames from a video, in a single ffmpeg pass over it.
+
+    The same pass can also write the 16 kHz mono audio track Whisper needs, so the video is demuxed and
+    decoded only once, and the duration comes from that pass instead of a separate probe.
+
+    Args:
+        frames_output_path (str): Folder under which a folder named after the video receives the frames.
+        video_path (str): Path to the video file.
+        interval (float): Seconds between sampled frames in "interval" mode.
+        audio_output_path (str, optional): Where to write the audio as a WAV file.
+        sampling (str): "interval" for a frame every `interval` seconds, or "scene" for a frame whenever
+            ffmpeg's scene-change score exceeds `scene_threshold`.
+        scene_threshold (float): Scene-change score (0 to 1) that counts as a new scene.
+        min_interval (float): In "scene" mode, the minimum seconds between two frames.
+        max_interval (float): In "scene" mode, the maximum seconds without a frame, even if nothing changes.
+
+    Returns:
+        list: One entry per frame with its path and (start, end) timestamp window. In "scene" mode a window
+            runs until the next frame, so windows vary in length.
+    """
 
     # output dir will be named after the video file
     # this grabs just the name of the video file without the extension
@@ -35,12 +134,39 @@ def extract_frames(frames_output_path, video_path, interval):
         print("Please delete it to start fresh or ensure it is empty.")
 
     # Use ffmpeg to extract frames
-    (
-        ffmpeg.input(video_path)
-        .filter("fps", fps=1 / interval)
-        # this sets the output to be a frame every Interval seconds
-        .output(f"{frame_output}/frame_%04d.png")
-        .run()
+    stream = ffmpeg.input(video_path)
+    if sampling == "scene":
+        # keep the first frame, then any frame that starts a new scene at least min_interval after the
+        # previously kept one, or any frame max_interval after it; showinfo logs when each kept frame is
+        select = (
+            f"isnan(prev_selected_t)"
+            f"+gte(t-prev_selected_t,{max_interval})"
+            f"+gt(scene,{scene_threshold})*gte(t-prev_selected_t,{min_interval})"
+        )
+        video = (
+            stream.video.filter("select", select)
+            .filter("showinfo")
+            .output(f"{frame_output}/frame_%04d.png", vsync="vfr")
+        )
+    elif sampling == "interval":
+        video = (
+            stream.video.filter("fps", fps=1 / interval)
+            # this sets the output to be a frame every Interval seconds
+            .output(f"{frame_output}/frame_%04d.png")
+        )
+    else:
+        raise ValueError(f"Unknown sampling mode: {sampling}")
+    outputs = [video]
+    if audio_output_path is not None:
+        outputs.append(
+            stream.audio.output(
+                audio_output_path, ac=1, ar=SAMPLING_RATE, acodec="pcm_s16le"
+            )
+        )
+    _, stderr = (
+        ffmpeg.merge_outputs(*outputs)
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
     )
 
     # Collect the frame file paths
@@ -51,20 +177,48 @@ def extract_frames(frames_output_path, video_path, interval):
             if f.endswith(".png")
         ]
     )
-    # create a dictionary of frame file paths and their corresponding timestamps according to interval and video length
+    return frame_windows(frame_files, stderr.decode("utf-8", errors="replace"), sampling, interval, video_path)
+
 
+def frame_windows(frame_files, ffmpeg_log, sampling, interval, video_path=None):
+    """
+    Pairs the frames of an extraction pass with their (start, end) timestamp windows, from the pass's log.
+
+    Args:
+        frame_files (list): Paths of the extracted frames, in order.
+        ffmpeg_log (str): What ffmpeg wrote to stderr, with showinfo's frame times in "scene" mode.
+        sampling (str): "interval" or "scene", as given to extract_frames.
+        interval (float): Seconds between sampled frames in "interval" mode.
+        video_path (str, optional): The video, for error messages.
+
+    Returns:
+        list: One entry per frame with its path and timestamp window; the last window ends at the video's duration.
+    """
+    # create a dictionary of frame file paths and their corresponding timestamps according to interval and video length
     frames_and_intervals = []
-    interval_start = 0
-    for i, frame in enumerate(frame_files):
-        single_frame = {
-            "frame_path": frame,
-            "timestamp": (interval_start, interval_start + (interval)),
-        }
-        frames_and_intervals.append(single_frame)
-        interval_start += interval
+    if sampling == "scene":
+        # each frame covers the time until the next kept frame
+        starts = [float(t) for t in re.findall(r"pts_time:\s*(\d+(?:\.\d+)?)", ffmpeg_log)]
+        if len(starts) != len(frame_files):
+            raise RuntimeError(
+                f"ffmpeg reported {len(starts)} frame times for {len(frame_files)} frames of {video_path}"
+            )
+        for frame, start, end in zip(frame_files, starts, starts[1:] + [None]):
+            frames_and_intervals.append(
+                {"frame_path": frame, "timestamp": (start, end)}
+            )
+    else:
+        interval_start = 0
+        for i, frame in enumerate(frame_files):
+            single_frame = {
+                "frame_path": frame,
+                "timestamp": (interval_start, interval_start + (interval)),
+            }
+            frames_and_intervals.append(single_frame)
+            interval_start += interval
 
-    # get video duration and make the last frame the same as the duration
-    video_duration = ffmpeg.probe(video_path)["format"]["duration"]
+    # make the last frame end at the video's duration, as reported by the extraction pass
+    video_duration = parse_duration(ffmpeg_log)
     final_frame_start_time = frames_and_intervals[-1]["timestamp"][0]
     frames_and_intervals[-1]["timestamp"] = (
         final_frame_start_time,
@@ -73,33 +227,19 @@ def extract_frames(frames_output_path, video_path, interval):
     return frames_and_intervals
 
 
-def assign_words_to_frames(transcription, frames, interval=INTERVAL):
-    # given transcription word chunks and frames that occur w.r.t interval, assign words to frames
-    # Transcription will be on word level, so for each frame, we find the words that occur in the time interval of the frame
-    # and assign them to the frame
-
-    frames_and_words = []
-
-    for f in frames:
-        frame_start, frame_end = f["timestamp"][0], f["timestamp"][1]
-
-        # filter for words that fall in frame
-        words_in_frame = list(
-            filter(
-                lambda w: w["timestamp"][0] > frame_start
-                and w["timestamp"][1] < frame_end,
-                transcription["chunks"],
-            )
-        )
-        words = [w["text"] for w in words_in_frame]
-        words = "".join(words)
-        single_frame = {
-            "frame_path": f["frame_path"],
-            "words": words,
-            "timestamp": f["timestamp"],
-        }
-        frames_and_words.append(single_frame)
-    return frames_and_words
+def parse_duration(ffmpeg_log):
+    # the container duration is printed with the input's description; fall back to the last progress
+    # time for inputs that don't know their duration up front
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", ffmpeg_log)
+    if match is None:
+        times = re.findall(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)", ffmpeg_log)
+        if not times:
+            raise ValueError("Could not find the video duration in the ffmpeg output")
+        match_groups = times[-1]
+    else:
+        match_groups = match.groups()
+    hours, minutes, seconds = match_groups
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
 
 
 def align_frames_with_dialogue(frames, transcription):
@@ -116,54 +256,232 @@ def align_frames_with_dialogue(frames, transcription):
     return dialogue_frames
 
 
+def sampling_settings(sampling=SAMPLING):
+    """The frame sampling parameters in effect, as recorded in the manifest for each decoded video."""
+    if sampling == "scene":
+        return {
+            "sampling": sampling,
+            "scene_threshold": SCENE_THRESHOLD,
+            "min_interval": MIN_INTERVAL,
+            "max_interval": MAX_INTERVAL,
+        }
+    return {"sampling": sampling, "interval": INTERVAL}
+
+
+def needs_decode(video_filename, manifest, sampling=SAMPLING):
+    # a video is decoded again when its frames were sampled with different settings
+    decoded = manifest.stage(video_filename, "decoded")
+    if decoded is None:
+        return True
+    # videos decoded before sampling was recorded were sampled every INTERVAL seconds
+    recorded = decoded.get("sampling", sampling_settings("interval"))
+    return recorded != sampling_settings(sampling)
+
+
+def decode_video(video_path, manifest, sampling=SAMPLING):
+    """Extracts a video's frames and its audio track in a single decode, and records both in the manifest."""
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    audio_path = os.path.join(audio_dir, video_filename + ".wav")
+
+    # decoding again resets the later stages, but a transcription of the very same audio (e.g. when only the frame
+    # sampling changed) is kept rather than paying for Whisper again
+    transcribed = manifest.stage(video_filename, "transcribed")
+
+    # start from an empty folder so frames from an earlier version of the video don't linger
+    shutil.rmtree(os.path.join(frames_dir, video_filename), ignore_errors=True)
+    with span("extract_frames", video=video_filename, sampling=sampling) as s:
+        frames = extract_frames(
+            frames_dir,
+            video_path,
+            INTERVAL,
+            audio_output_path=audio_path,
+            sampling=sampling,
+        )
+        s.add(frames=len(frames), bytes_read=os.path.getsize(video_path))
+    print(f"Sampled {len(frames)} frames from {os.path.basename(video_path)} ({sampling})")
+
+    frames_filename = os.path.join(frames_dir, video_filename, "frames.json")
+    with open(frames_filename, "w") as f:
+        json.dump(frames, f)
+    audio_hash = hash_file(audio_path)
+    manifest.mark_done(
+        video_filename,
+        "decoded",
+        audio=audio_path,
+        frames=frames_filename,
+        sampling=sampling_settings(sampling),
+        audio_hash=audio_hash,
+    )
+    if transcribed is not None and transcribed.get("audio_hash") == audio_hash:
+        manifest.mark_done(video_filename, "transcribed", **transcribed)
+
+
+def dedup_settings():
+    # frames are compared with the first frame of their run; pairings that compared neighbours are redone
+    return {"hash_size": DEDUP_HASH_SIZE, "max_distance": DEDUP_MAX_DISTANCE, "compare_with": "run_start"}
+
+
+def needs_pairing(video_filename, manifest):
+    # frames are paired with words again when words were assigned or near-duplicates merged with different settings
+    paired = manifest.stage(video_filename, "frames_extracted")
+    return (
+        paired is None
+        or not paired["frames_and_words"].endswith(".parquet")
+        or paired.get("dedup") != dedup_settings()
+        or paired.get("word_boundary", "strict") != WORD_BOUNDARY
+    )
+
+
+def pair_frames_with_words(video_filename, manifest):
+    with open(manifest.stage(video_filename, "decoded")["frames"], "r") as f:
+        frames = json.load(f)
+    with open(manifest.stage(video_filename, "transcribed")["words"], "r") as f:
+        transcription = json.load(f)
+    frames_and_words = merge_duplicate_frames(assign_words_to_frames(transcription, frames))
+    # every merged frame is one Claude description and one Titan embedding fewer downstream
+    avoided = len(frames) - len(frames_and_words)
+    if avoided:
+        print(
+            f"Merged {len(frames)} frames of {video_filename} into {len(frames_and_words)}, "
+            f"avoiding {avoided} Claude calls and {avoided} embedding calls"
+        )
+
+    # downscale the remaining frames for Claude now, so enrichment and queries only read the small variants
+    get_prompt_image_cache().prepare_many([f["frame_path"] for f in frames_and_words])
+
+    frames_and_words_filename = os.path.join(
+        frames_and_words_dir, video_filename + "_frames_and_words.parquet"
+    )
+    write_frames(
+        frames_and_words_filename,
+        [dict(f, video_id=video_filename, index=i) for i, f in enumerate(frames_and_words)],
+        FRAMES_AND_WORDS_COLUMNS,
+    )
+    manifest.mark_done(
+        video_filename,
+        "frames_extracted",
+        frames_and_words=frames_and_words_filename,
+        frames_hash=hash_file(frames_and_words_filename),
+        dedup=dedup_settings(),
+        word_boundary=WORD_BOUNDARY,
+        merged_frames=avoided,
+    )
+
+
+def process_video(video_path, manifest, sampling=SAMPLING):
+    """
+    Decodes, transcribes and pairs the frames of one video with words, skipping whatever the manifest says
+    is already done.
+
+    Args:
+        video_path (str): Path to the video file.
+        manifest (Manifest): Pipeline manifest, updated as each stage finishes.
+        sampling (str): Frame sampling mode, "interval" or "scene".
+
+    Returns:
+        dict: Paths to the video's transcription and frames_and_words files.
+    """
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    manifest.sync_video(video_filename, video_path)
+
+    if needs_decode(video_filename, manifest, sampling):
+        decode_video(video_path, manifest, sampling)
+    if not manifest.is_done(video_filename, "transcribed"):
+        audio_path = manifest.stage(video_filename, "decoded")["audio"]
+        save_transcription(video_filename, transcribe_video(audio_path), manifest)
+    if needs_pairing(video_filename, manifest):
+        pair_frames_with_words(video_filename, manifest)
+
+    return {
+        "transcription": manifest.stage(video_filename, "transcribed")["transcription"],
+        "frames_and_words": manifest.stage(video_filename, "frames_extracted")[
+            "frames_and_words"
+        ],
+    }
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sampling",
+        choices=("interval", "scene"),
+        default=SAMPLING,
+        help="sample a frame every INTERVAL seconds, or one per scene change (e.g. per slide)",
+    )
+    args = parser.parse_args()
+    start_trace("preprocess")
+
     # read in video files from data directory
-    video_files = os.listdir(videos_dir)
+    video_files = sorted(f for f in os.listdir(videos_dir) if f.endswith(".mp4"))
     print(video_files)
     # add root dir to video files
     video_files = [os.path.join(videos_dir, f) for f in video_files]
 
-    all_videos_data = {}
-    transcriptions_dir = os.path.join(data_dir, "transcriptions")
-    frames_and_words_dir = os.path.join(data_dir, "frames_and_words")
-    frames_dir = os.path.join(data_dir, "frames")
     # folder setup
-    try:
-        os.mkdir(transcriptions_dir)
-        os.mkdir(frames_and_words_dir)
-        os.mkdir(frames_dir)
-    except FileExistsError:
-        print(
-            "Folders already exist. Please delete them to start fresh or ensure they are empty."
-        )
+    for folder in (transcriptions_dir, frames_and_words_dir, frames_dir, audio_dir):
+        os.makedirs(folder, exist_ok=True)
 
-    for video_path in video_files:
-        transcription = transcribe_video(video_path)
+    manifest = Manifest()
+    removed = manifest.remove_missing(
+        [os.path.splitext(os.path.basename(f))[0] for f in video_files]
+    )
+    if removed:
+        print(f"Dropped {len(removed)} videos that are no longer present: {removed}")
 
+    video_names = {}
+    for video_path in video_files:
         video_filename = os.path.splitext(os.path.basename(video_path))[0]
+        manifest.sync_video(video_filename, video_path)
+        video_names[video_path] = video_filename
 
-        # Write transcription out as json
-        transcription_filename = os.path.join(
-            transcriptions_dir, video_filename + "_transcription.json"
-        )
-        with open(transcription_filename, "w") as f:
-            json.dump(transcription["text"], f)
+    # decode every new or changed video once, several at a time, writing frames and audio in the same pass
+    to_decode = [
+        video_path
+        for video_path, video_filename in video_names.items()
+        if needs_decode(video_filename, manifest, args.sampling)
+    ]
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        futures = {
+            executor.submit(decode_video, video_path, manifest, args.sampling): video_path
+            for video_path in to_decode
+        }
+        for future in as_completed(futures):
+            future.result()
+            print(f"Decoded {os.path.basename(futures[future])}")
 
-        frames = extract_frames(frames_dir, video_path, INTERVAL)
-        frames_and_words = assign_words_to_frames(transcription, frames)
+    # then transcribe the extracted audio, in parallel across cores
+    audio_to_video = {
+        manifest.stage(video_filename, "decoded")["audio"]: video_filename
+        for video_filename in video_names.values()
+        if not manifest.is_done(video_filename, "transcribed")
+    }
+    audio_seconds = processing_seconds = 0.0
+    for audio_path, transcription, timings in transcribe_many(list(audio_to_video)):
+        finish_transcription(audio_to_video[audio_path], audio_path, transcription, timings, manifest)
+        audio_seconds += timings["audio_s"]
+        processing_seconds += timings["decode_s"] + timings["transcribe_s"]
+    if audio_to_video:
+        print(
+            f"Transcribed {len(audio_to_video)} videos, {audio_seconds:.0f}s of audio; "
+            f"overall real-time factor {processing_seconds / max(audio_seconds, 1e-9):.3f}"
+        )
 
-        frames_and_words_filename = os.path.join(
-            frames_and_words_dir, video_filename + "_frames_and_words.json"
+    all_videos_data = {}
+    for video_path in video_files:
+        video_filename = os.path.splitext(os.path.basename(video_path))[0]
+        all_videos_data[video_filename] = process_video(
+            video_path, manifest, args.sampling
         )
-        with open(frames_and_words_filename, "w") as f:
-            json.dump(frames_and_words, f)
 
-        all_videos_data[video_filename] = {
-            "transcription": transcription_filename,
-            "frames_and_words": frames_and_words_filename,
-        }
+    merged = sum(
+        manifest.stage(name, "frames_extracted").get("merged_frames", 0)
+        for name in video_names.values()
+    )
+    print(f"Near-duplicate merging saves {merged} Claude calls and {merged} embedding calls in total")
 
     # Optionally, write all_videos_data to a summary file
     all_videos_data_path = data_dir / "all_videos_data.json"
     with open(all_videos_data_path, "w") as f:
         json.dump(all_videos_data, f)
+
+    finish_trace()
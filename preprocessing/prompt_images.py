@@ -0,0 +1,139 @@
+# Prompt-ready variants of the frames. Full-resolution PNG screenshots are megabytes each, which inflates request
+# size, upload time and image tokens, so each frame is downscaled and re-encoded once, the variant is kept on
+# disk, and its base64 payload is held in memory. Building a prompt then costs a dictionary lookup per image.
+
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config import (
+    PROMPT_IMAGE_FORMAT,
+    PROMPT_IMAGE_MAX_EDGE,
+    PROMPT_IMAGE_MEMORY_ENTRIES,
+    PROMPT_IMAGE_QUALITY,
+    prompt_images_dir,
+)
+from query_cache import TTLCache
+
+MEDIA_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+
+class PromptImageCache:
+    """
+    Downscaled, re-encoded variants of images and their base64 payloads.
+
+    Variants on disk are named after the source path, size and modification time and the encoding settings,
+    so a re-extracted frame or a settings change gets a new variant. The in-memory payloads are keyed by
+    path alone and kept until evicted or cleared.
+
+    Args:
+        root (str or Path): Folder holding the variants.
+        max_edge (int): Longest edge of a variant, in pixels; smaller images are not upscaled.
+        image_format (str): "jpeg", "png" or "webp".
+        quality (int): Encoder quality for jpeg and webp.
+        memory_entries (int): Most base64 payloads kept in memory.
+    """
+
+    def __init__(
+        self,
+        root=prompt_images_dir,
+        max_edge=PROMPT_IMAGE_MAX_EDGE,
+        image_format=PROMPT_IMAGE_FORMAT,
+        quality=PROMPT_IMAGE_QUALITY,
+        memory_entries=PROMPT_IMAGE_MEMORY_ENTRIES,
+    ):
+        if image_format not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported prompt image format: {image_format}")
+        self.root = root
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+        self.media_type = MEDIA_TYPES[image_format]
+        self._payloads = TTLCache(memory_entries, float("inf"))
+
+    def variant_path(self, image_path):
+        stat = os.stat(image_path)
+        key = repr(
+            (
+                os.path.abspath(image_path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                self.max_edge,
+                self.image_format,
+                self.quality,
+            )
+        )
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, f"{name}.{self.image_format}")
+
+    def _write_variant(self, image_path, variant_path):
+        with Image.open(image_path) as image:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            if self.image_format == "jpeg" and image.mode != "RGB":
+                image = image.convert("RGB")
+            os.makedirs(self.root, exist_ok=True)
+            # unique temporary name, as threads may build the same variant at once
+            tmp_path = f"{variant_path}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, format=self.image_format, quality=self.quality, optimize=True)
+        os.replace(tmp_path, variant_path)
+
+    def prepare(self, image_path):
+        """Builds the variant of an image if it does not exist yet. Returns the variant's path."""
+        variant_path = self.variant_path(image_path)
+        if not os.path.exists(variant_path):
+            self._write_variant(image_path, variant_path)
+        return variant_path
+
+    def prepare_many(self, image_paths, max_workers=4):
+        """Builds the variants of many images, e.g. right after frames are extracted."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.prepare, image_paths))
+
+    def get(self, image_path):
+        """
+        Returns the base64 payload of an image's variant, building the variant on first use.
+
+        Returns:
+            tuple: The media type and the base64 string.
+        """
+        payload = self._payloads.get(str(image_path))
+        if payload is None:
+            with open(self.prepare(image_path), "rb") as f:
+                payload = base64.b64encode(f.read()).decode("utf-8")
+            self._payloads.put(str(image_path), payload)
+        return self.media_type, payload
+
+    def image_block(self, image_path):
+        """The Claude message content block for an image."""
+        media_type, data = self.get(image_path)
+        return {
+            "type": "image",
+            "source": {"type": "base64", "media_type": media_type, "data": data},
+        }
+
+    def clear_memory(self):
+        self._payloads.clear()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_prompt_image_cache():
+    """Returns the process-wide prompt image cache, creating it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PromptImageCache()
+    return _default_cache
+
+
+def use_prompt_image_cache(cache):
+    """Replaces the process-wide cache, e.g. with a throwaway one for dry runs."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
@@ -0,0 +1,195 @@
+# Two-level cache for the query path of the app: query text to its embedding, and (embedding, top_k, filter) to
+# the matching vectors. Popular questions are then answered without a Bedrock or Pinecone round trip. Both
+# levels are bounded in size (least recently used entries go first) and in age. An upsert writes a version
+# file for the index; the results level is dropped whenever that file changes, so answers never outlive the
+# data they came from, while embeddings of the same text stay valid.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    QUERY_CACHE_MAX_ENTRIES,
+    QUERY_EMBEDDING_TTL_S,
+    QUERY_RESULTS_TTL_S,
+    state_dir,
+)
+from tracing import span
+
+
+def index_version_path(index_name, root=state_dir):
+    return os.path.join(root, f"{index_name}_version")
+
+
+def mark_index_changed(index_name, root=state_dir):
+    """Invalidation hook for writers: tells every query cache of the index that its cached matches are stale."""
+    path = index_version_path(index_name, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, path)
+
+
+class TTLCache:
+    """
+    Thread-safe mapping bounded by size and age: the least recently used entry is evicted when full, and an
+    entry older than `ttl` seconds is treated as missing.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def normalize_query(text):
+    return " ".join(text.split())
+
+
+def results_key(vector, top_k, filter=None, namespace=None, first_stage_vector=None):
+    digest = hashlib.sha256(np.asarray(vector, dtype=np.float32).tobytes())
+    if first_stage_vector is not None:
+        digest.update(np.asarray(first_stage_vector, dtype=np.float32).tobytes())
+    digest.update(
+        json.dumps([top_k, filter, namespace], sort_keys=True).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+class QueryCache:
+    """
+    Embedding and results caches for one index.
+
+    Args:
+        index_name (str): Index whose version file invalidates the cached results.
+        max_entries (int): Most entries kept by each level.
+        embedding_ttl (float): Seconds an embedding stays valid.
+        results_ttl (float): Seconds a set of matches stays valid, even if the index does not change.
+        root (str or Path): Folder holding the index version file.
+        on_change (callable, optional): Called when the index changes, to drop other data derived from it.
+    """
+
+    def __init__(
+        self,
+        index_name,
+        max_entries=QUERY_CACHE_MAX_ENTRIES,
+        embedding_ttl=QUERY_EMBEDDING_TTL_S,
+        results_ttl=QUERY_RESULTS_TTL_S,
+        root=state_dir,
+        on_change=None,
+    ):
+        self.embeddings = TTLCache(max_entries, embedding_ttl)
+        self.results = TTLCache(max_entries, results_ttl)
+        self._on_change = on_change
+        self._version_path = index_version_path(index_name, root)
+        self._version = self._read_version()
+
+    def _read_version(self):
+        try:
+            return os.stat(self._version_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check_version(self):
+        version = self._read_version()
+        if version != self._version:
+            self._version = version
+            self.results.clear()
+            if self._on_change is not None:
+                self._on_change()
+
+    def embed(self, text, embed_fn, variant=None):
+        """
+        Returns the embedding of `text`, calling `embed_fn(text)` only on a miss. `variant` tells apart
+        embeddings of the same text by different models or dimensions, e.g. the first stage of two-stage retrieval.
+
+        Returns:
+            tuple: The embedding, and whether it came from the cache.
+        """
+        text = normalize_query(text)
+        key = text if variant is None else (variant, text)
+        with span("query.embed", variant=variant) as s:
+            embedding = self.embeddings.get(key)
+            s.set(cached=embedding is not None)
+            if embedding is not None:
+                return embedding, True
+            embedding = embed_fn(text)
+        self.embeddings.put(key, embedding)
+        return embedding, False
+
+    def query(self, index, vector, top_k, filter=None, namespace=None, first_stage_vector=None):
+        """
+        Returns the matches of `index.query` for the vector, top_k and filter, querying only on a miss.
+        `first_stage_vector` is passed on to a TwoStageIndex.
+
+        Returns:
+            tuple: The list of matches, and whether it came from the cache.
+        """
+        self._check_version()
+        key = results_key(vector, top_k, filter, namespace, first_stage_vector)
+        with span("query.index", top_k=top_k) as s:
+            matches = self.results.get(key)
+            s.set(cached=matches is not None)
+            if matches is not None:
+                return matches, True
+            kwargs = {"vector": list(vector), "top_k": top_k, "include_metadata": True}
+            if filter is not None:
+                kwargs["filter"] = filter
+            if namespace is not None:
+                kwargs["namespace"] = namespace
+            if first_stage_vector is not None:
+                kwargs["first_stage_vector"] = list(first_stage_vector)
+            matches = list(index.query(**kwargs)["matches"])
+        self.results.put(key, matches)
+        return matches, False
+
+    def clear(self):
+        self.embeddings.clear()
+        self.results.clear()
+
+    def stats(self):
+        return {
+            "embeddings": {
+                "entries": len(self.embeddings),
+                "hits": self.embeddings.hits,
+                "misses": self.embeddings.misses,
+            },
+            "results": {
+                "entries": len(self.results),
+                "hits": self.results.hits,
+                "misses": self.results.misses,
+            },
+        }
@@ -0,0 +1,142 @@
+# Persistent, content-addressed cache for Claude responses. A response is keyed by a hash of the whole request
+# (model ID, system prompt, messages including base64 image bytes, and max_tokens), so it is reused only when
+# exactly the same request would be sent again. Entries live in SQLite and are evicted least recently used
+# once the cache grows past its size budget.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import CLAUDE_CACHE_BYPASS, CLAUDE_CACHE_MAX_BYTES, CLAUDE_CACHE_PATH
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with size-based LRU eviction.
+
+    Args:
+        path (str or Path): Location of the SQLite database. Parent folders are created as needed.
+        max_bytes (int): Size budget for the stored responses. The least recently used entries are evicted past it.
+        bypass (bool): If True, lookups always miss so every request goes to Claude. Fresh responses are still stored.
+    """
+
+    def __init__(self, path, max_bytes=CLAUDE_CACHE_MAX_BYTES, bypass=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets the app and a running enrichment share the file
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(**request):
+        # canonical JSON, so the same request always hashes the same way regardless of dict ordering
+        payload = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if self.bypass:
+                self.misses += 1
+                return None
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return row[0]
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # walk from the least recently used entry until enough space is freed
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the process-wide cache at CLAUDE_CACHE_PATH, opening it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                CLAUDE_CACHE_PATH, bypass=CLAUDE_CACHE_BYPASS
+            )
+    return _default_cache
+
+
+def use_response_cache(cache):
+    """Replaces the process-wide cache, e.g. with a throwaway one for dry runs against fake clients."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
@@ -0,0 +1,281 @@
+# BM25 keyword index over the transcript and contextual description of every frame, queried next to the dense
+# index so exact terms (product names, API parameters, error codes) that embeddings blur together still match.
+# It is rebuilt from the local records on every upsert and stored as a compressed inverted index: a sorted term
+# array, and per term a run of (document, weight) postings where the weight is the term's full BM25 contribution
+# for that document. A query is then a binary search per term, a gather and one bincount over the postings.
+
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from config import BM25_B, BM25_K1, sparse_index_dir
+from tracing import span
+
+# words, numbers and identifiers, keeping compounds like max_tokens, claude-3.5 or ERR_CONN_RESET together
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[_.\-/:][a-z0-9]+)*")
+COMPOUND_SEPARATORS = re.compile(r"[_.\-/:]")
+
+
+def sparse_index_path(index_name, root=sparse_index_dir):
+    return os.path.join(root, f"{index_name}.npz")
+
+
+def tokenize(text):
+    """
+    Lowercased terms of `text`. A compound identifier yields itself and its parts, so `max_tokens` matches a query
+    for "max_tokens" best, and one for "max tokens" too.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = COMPOUND_SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def record_text(metadata):
+    return f"{metadata.get('transcript', '')} {metadata.get('contextual_frame_description', '')}"
+
+
+class SparseIndex:
+    """
+    BM25 inverted index over records of the vector index.
+
+    Use `SparseIndex.build` to index records, `save` / `load` to persist the index, and `query` to search it.
+    Matches have the same shape as a vector index's: "id", "score" (the BM25 score) and "metadata".
+
+    Args:
+        terms (np.ndarray): Sorted unique terms.
+        offsets (np.ndarray): Postings of term i are at offsets[i]:offsets[i + 1].
+        docs (np.ndarray): Document of each posting.
+        weights (np.ndarray): BM25 contribution of each posting.
+        ids (list): Record id of each document.
+        metadata (list): Record metadata of each document.
+    """
+
+    def __init__(self, terms, offsets, docs, weights, ids, metadata):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.ids = ids
+        self.metadata = metadata
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.array([], dtype=str),
+            np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.float32),
+            [],
+            [],
+        )
+
+    @classmethod
+    def build(cls, records, k1=BM25_K1, b=BM25_B):
+        """
+        Indexes records (dicts with an "id" and "metadata") by the transcript and description in their metadata.
+        """
+        ids = [r["id"] for r in records]
+        metadata = [r["metadata"] for r in records]
+        token_lists = [tokenize(record_text(m)) for m in metadata]
+        lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.float32)
+        if not lengths.sum():
+            index = cls.empty()
+            index.ids, index.metadata = ids, metadata
+            return index
+
+        # terms numbered in order of appearance, then renumbered in sorted order, which is much cheaper than
+        # sorting every token occurrence as a string
+        vocabulary = {}
+        first_seen = np.fromiter(
+            (vocabulary.setdefault(t, len(vocabulary)) for tokens in token_lists for t in tokens),
+            dtype=np.int64,
+            count=int(lengths.sum()),
+        )
+        terms = np.array(list(vocabulary), dtype=str)
+        order = np.argsort(terms)
+        terms = terms[order]
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        term_of_token = rank[first_seen]
+
+        # one (term, document) pair per token occurrence; counting the unique pairs gives the term frequencies,
+        # sorted by term and then document
+        doc_of_token = np.repeat(np.arange(len(ids), dtype=np.int64), lengths.astype(np.int64))
+        pairs, tf = np.unique(term_of_token * len(ids) + doc_of_token, return_counts=True)
+        term_of_posting, docs = np.divmod(pairs, len(ids))
+        df = np.bincount(term_of_posting, minlength=len(terms))
+
+        idf = np.log1p((len(ids) - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * lengths[docs] / lengths.mean())
+        weights = idf[term_of_posting] * tf * (k1 + 1) / (tf + norm)
+        offsets = np.concatenate(([0], np.cumsum(df)))
+        return cls(terms, offsets, docs.astype(np.int32), weights.astype(np.float32), ids, metadata)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by `save`, or returns an empty one if there is none yet."""
+        if not os.path.exists(path):
+            return cls.empty()
+        with np.load(path) as arrays:
+            records = json.loads(arrays["records"].tobytes().decode("utf-8"))
+            return cls(
+                arrays["terms"],
+                arrays["offsets"],
+                arrays["docs"],
+                arrays["weights"],
+                [r["id"] for r in records],
+                [r["metadata"] for r in records],
+            )
+
+    def save(self, path):
+        records = json.dumps([{"id": i, "metadata": m} for i, m in zip(self.ids, self.metadata)])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            terms=self.terms,
+            offsets=self.offsets,
+            docs=self.docs,
+            weights=self.weights,
+            records=np.frombuffer(records.encode("utf-8"), dtype=np.uint8),
+        )
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, text):
+        """BM25 score of every document for the query text."""
+        query_terms = np.unique(np.array(tokenize(text), dtype=str))
+        if not len(query_terms) or not len(self.terms):
+            return np.zeros(len(self.ids), dtype=np.float32)
+        found = np.minimum(np.searchsorted(self.terms, query_terms), len(self.terms) - 1)
+        found = found[self.terms[found] == query_terms]
+        postings = np.concatenate(
+            [np.arange(self.offsets[t], self.offsets[t + 1]) for t in found] or [np.zeros(0, dtype=np.int64)]
+        )
+        return np.bincount(
+            self.docs[postings], weights=self.weights[postings], minlength=len(self.ids)
+        ).astype(np.float32)
+
+    def query(self, text, top_k, include_metadata=True):
+        """
+        Returns the `top_k` records scoring highest for the query text, best first, in the format of a vector
+        index's query. Records that share no term with the query are never returned.
+        """
+        with span("query.sparse", top_k=top_k) as s:
+            scores = self.scores(text)
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            s.set(hits=len(hits))
+            matches = []
+            for doc in hits:
+                match = {"id": self.ids[doc], "score": float(scores[doc])}
+                if include_metadata:
+                    match["metadata"] = self.metadata[doc]
+                matches.append(match)
+        return {"matches": matches}
+
+
+class SparseIndexUpdates:
+    """
+    The records of a keyword index held in memory by video, so the pipeline can replace one video's records at a
+    time, rebuilding and saving the index every `interval_s` seconds at most instead of after every video.
+
+    BM25 weights depend on the whole corpus, so every save is a full rebuild; throttling saves bounds that work by
+    the run's length rather than its number of videos.
+
+    Args:
+        path (str): The keyword index to start from and save to.
+        interval_s (float): Least time between two saves.
+    """
+
+    def __init__(self, path, interval_s):
+        self.path = path
+        self.interval_s = interval_s
+        self.records = {}
+        previous = SparseIndex.load(path)
+        for record_id, metadata in zip(previous.ids, previous.metadata):
+            self.records.setdefault(metadata.get("video_id"), []).append({"id": record_id, "metadata": metadata})
+        self.changed = False
+        # the first change is saved at once, so the first video indexed can be found by keyword soon
+        self.saved_at = float("-inf")
+
+    def update(self, video, records):
+        """Replaces the records of a video; nothing is rebuilt until the next save."""
+        if self.records.get(video) != records:
+            self.records[video] = records
+            self.changed = True
+
+    def save_if_due(self):
+        """Rebuilds and saves the index if records changed since a save `interval_s` ago. Returns whether it did."""
+        if not self.changed or time.monotonic() - self.saved_at < self.interval_s:
+            return False
+        with span("sparse.build") as s:
+            sparse = SparseIndex.build([r for records in self.records.values() for r in records])
+            sparse.save(self.path)
+            s.set(records=len(sparse), terms=len(sparse.terms))
+        self.changed = False
+        self.saved_at = time.monotonic()
+        return True
+
+
+def _normalized(matches):
+    # scores relative to the best of one result list, so cosine similarities and BM25 scores can be added
+    if not matches:
+        return {}
+    scores = np.maximum(np.array([m["score"] for m in matches], dtype=np.float64), 0)
+    scaled = scores / (scores.max() or 1)
+    return {m["id"]: float(x) for m, x in zip(matches, scaled)}
+
+
+def fuse_matches(dense, sparse, top_k, sparse_weight):
+    """
+    Combines dense and sparse matches into one ranking.
+
+    Each list's scores are divided by its best score, and a record's fused score is
+    `(1 - sparse_weight) * dense + sparse_weight * sparse`, a record missing from a list scoring 0 there. The
+    returned matches hold the "id", fused "score", "metadata" and the original "dense_score" and "sparse_score".
+
+    Args:
+        dense (list): Matches of the vector index.
+        sparse (list): Matches of the sparse index.
+        top_k (int): Number of matches to return.
+        sparse_weight (float): Weight of the keyword scores, from 0 (dense only) to 1 (keywords only).
+
+    Returns:
+        list: The top_k fused matches, best first.
+    """
+    dense_scores, sparse_scores = _normalized(dense), _normalized(sparse)
+    by_id = {m["id"]: m for m in sparse}
+    by_id.update((m["id"], m) for m in dense)
+    raw = {
+        "dense_score": {m["id"]: m["score"] for m in dense},
+        "sparse_score": {m["id"]: m["score"] for m in sparse},
+    }
+
+    fused = []
+    for record_id, match in by_id.items():
+        score = (1 - sparse_weight) * dense_scores.get(record_id, 0.0) + sparse_weight * sparse_scores.get(
+            record_id, 0.0
+        )
+        fused.append(
+            {
+                "id": record_id,
+                "score": score,
+                "metadata": match["metadata"],
+                "dense_score": raw["dense_score"].get(record_id),
+                "sparse_score": raw["sparse_score"].get(record_id),
+            }
+        )
+    fused.sort(key=lambda m: m["score"], reverse=True)
+    return fused[:top_k]
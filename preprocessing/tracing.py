@@ -0,0 +1,216 @@
+# Lightweight tracing for the pipeline and the app. Work is wrapped in named spans that record their duration,
+# the span they ran under, and counters such as tokens, bytes or retries. Spans are aggregated in memory for a
+# per-stage summary table, optionally written to a JSON-lines trace file, and can be captured per request, e.g.
+# to show the latency breakdown of one query in the app.
+
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from config import traces_dir
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_captures = contextvars.ContextVar("captures", default=())
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """One timed piece of work. Attributes describe it; counters (tokens, bytes, retries, ...) are summed."""
+
+    def __init__(self, name, parent, attrs):
+        self.id = next(_span_ids)
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.counters = {}
+        self.start = time.time()
+        self.duration_s = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self):
+        record = {
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_s * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if self.counters:
+            record["counters"] = self.counters
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+class Tracer:
+    """
+    Collects spans, aggregates them per name and optionally appends each one to a JSON-lines file.
+
+    Args:
+        path (str or Path, optional): Trace file; None keeps spans in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, "a")
+        self._durations = defaultdict(list)
+        self._counters = defaultdict(lambda: defaultdict(float))
+        self._errors = defaultdict(int)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        parent = _current_span.get()
+        span = Span(name, parent.id if parent else None, attrs)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            span.duration_s = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(span)
+
+    def record(self, name, duration_s, counters=None, **attrs):
+        """Records work timed elsewhere, e.g. in a worker process, as a finished span."""
+        parent = _current_span.get()
+        span = Span(name, parent.id if parent else None, attrs)
+        span.start -= duration_s
+        span.duration_s = duration_s
+        span.add(**(counters or {}))
+        self._finish(span)
+
+    def count(self, name, **counters):
+        """Adds to counters of the current span if there is one, and to the totals of `name` in the summary."""
+        span = _current_span.get()
+        if span is not None:
+            span.add(**counters)
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[name][key] += value
+
+    def _finish(self, span):
+        for captured in _captures.get():
+            captured.append(span)
+        with self._lock:
+            self._durations[span.name].append(span.duration_s)
+            for key, value in span.counters.items():
+                self._counters[span.name][key] += value
+            if span.error:
+                self._errors[span.name] += 1
+            if self._file is not None:
+                self._file.write(json.dumps(span.to_dict(), default=str) + "\n")
+                self._file.flush()
+
+    def summary(self):
+        """Per-name totals: span count, total/mean/p50/p95 seconds, errors and summed counters."""
+        with self._lock:
+            rows = {}
+            for name in sorted(set(self._durations) | set(self._counters)):
+                durations = np.array(self._durations.get(name, []))
+                row = {"count": len(durations), "errors": self._errors.get(name, 0)}
+                if len(durations):
+                    row.update(
+                        total_s=float(durations.sum()),
+                        mean_s=float(durations.mean()),
+                        p50_s=float(np.percentile(durations, 50)),
+                        p95_s=float(np.percentile(durations, 95)),
+                    )
+                row.update({key: value for key, value in self._counters.get(name, {}).items()})
+                rows[name] = row
+            return rows
+
+    def format_summary(self):
+        lines = [
+            f"{'stage':<28}{'count':>8}{'total s':>11}{'mean ms':>11}{'p95 ms':>11}  counters"
+        ]
+        for name, row in self.summary().items():
+            counters = ", ".join(
+                f"{key}={value:g}"
+                for key, value in row.items()
+                if key not in ("count", "errors", "total_s", "mean_s", "p50_s", "p95_s")
+            )
+            if row["errors"]:
+                counters = f"errors={row['errors']}" + (", " + counters if counters else "")
+            lines.append(
+                f"{name:<28}{row['count']:>8}{row.get('total_s', 0):>11.2f}"
+                f"{row.get('mean_s', 0) * 1000:>11.1f}{row.get('p95_s', 0) * 1000:>11.1f}  {counters}"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@contextlib.contextmanager
+def capture():
+    """
+    Collects the spans that finish inside the block in this thread or context, e.g. everything done for one query.
+
+    Yields:
+        list: Filled with the finished spans, in the order they finish.
+    """
+    spans = []
+    token = _captures.set(_captures.get() + (spans,))
+    try:
+        yield spans
+    finally:
+        _captures.reset(token)
+
+
+_tracer = Tracer()
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    return _tracer
+
+
+def start_trace(run_name, root=traces_dir):
+    """Starts writing spans to `<root>/<run_name>_<timestamp>.jsonl` for the rest of the process."""
+    global _tracer
+    path = os.path.join(root, f"{run_name}_{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+    with _tracer_lock:
+        _tracer.close()
+        _tracer = Tracer(path)
+    return _tracer
+
+
+def finish_trace():
+    """Prints the summary table of the run and closes the trace file."""
+    tracer = get_tracer()
+    print(tracer.format_summary())
+    if tracer.path:
+        print(f"Trace written to {tracer.path}")
+    tracer.close()
+
+
+def span(name, **attrs):
+    """Shorthand for `get_tracer().span(...)`."""
+    return get_tracer().span(name, **attrs)
@@ -0,0 +1,144 @@
+# Whisper transcription service. The ASR pipeline is built once per process and reused for every video, long
+# audio is split into chunks that are transcribed in batches, and several videos can be transcribed at once
+# on a process pool, each worker holding its own copy of the model and an equal share of the CPU cores.
+
+import functools
+import multiprocessing
+import os
+import subprocess
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+from transformers import pipeline
+
+from config import (
+    TRANSCRIBE_WORKERS,
+    WHISPER_BATCH_SIZE,
+    WHISPER_CHUNK_LENGTH_S,
+    WHISPER_MODEL,
+)
+
+SAMPLING_RATE = 16000
+
+
+@functools.lru_cache(maxsize=None)
+def get_transcriber(model=WHISPER_MODEL):
+    """Builds the ASR pipeline on first use; later calls in the same process get the same instance."""
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    return pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        device=device,
+        chunk_length_s=WHISPER_CHUNK_LENGTH_S,
+        batch_size=WHISPER_BATCH_SIZE,
+    )
+
+
+def load_audio(path):
+    # audio extracted alongside the frames is already 16 kHz mono PCM, so it is read as is without ffmpeg
+    if str(path).endswith(".wav"):
+        with wave.open(str(path), "rb") as f:
+            if f.getframerate() != SAMPLING_RATE or f.getnchannels() != 1:
+                raise ValueError(f"{path} is not {SAMPLING_RATE} Hz mono audio")
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        return samples.astype(np.float32) / 32768.0
+
+    # otherwise decode to the 16 kHz mono float32 samples Whisper expects, the same way the pipeline would internally
+    out = subprocess.run(
+        [
+            "ffmpeg",
+            "-nostdin",
+            "-i",
+            str(path),
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            str(SAMPLING_RATE),
+            "-f",
+            "f32le",
+            "-",
+        ],
+        capture_output=True,
+        check=True,
+    ).stdout
+    return np.frombuffer(out, dtype=np.float32)
+
+
+def transcribe(path):
+    """
+    Transcribes a video or audio file with word-level timestamps.
+
+    Args:
+        path (str): Path to the media file, ideally the 16 kHz mono WAV written by extract_frames.
+
+    Returns:
+        tuple: The transcription (text and word chunks) and its timings: seconds spent decoding and
+            transcribing, audio duration, and the real-time factor (processing time / audio duration).
+    """
+    started = time.perf_counter()
+    audio = load_audio(path)
+    decoded = time.perf_counter()
+    transcription = get_transcriber()(
+        {"raw": audio, "sampling_rate": SAMPLING_RATE}, return_timestamps="word"
+    )
+    finished = time.perf_counter()
+
+    audio_seconds = len(audio) / SAMPLING_RATE
+    timings = {
+        "decode_s": decoded - started,
+        "transcribe_s": finished - decoded,
+        "audio_s": audio_seconds,
+        "rtf": (finished - started) / audio_seconds if audio_seconds else 0.0,
+    }
+    return transcription, timings
+
+
+def _init_worker(threads):
+    # split the cores between workers instead of letting every worker's torch use all of them
+    torch.set_num_threads(threads)
+    get_transcriber()
+
+
+def _transcribe_in_worker(path):
+    return path, *transcribe(path)
+
+
+def transcription_pool(workers=TRANSCRIBE_WORKERS):
+    """
+    A process pool of `workers` Whisper workers, each with its share of the CPU cores; submit `transcribe` to it.
+
+    Returns None on GPU, or with a single worker, where files are better transcribed one after another in this
+    process, since the model is already using the whole device.
+    """
+    if workers <= 1 or torch.cuda.is_available():
+        return None
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,),
+    )
+
+
+def transcribe_many(paths, workers=TRANSCRIBE_WORKERS):
+    """
+    Transcribes many files, fanning out over a process pool on CPU (see `transcription_pool`).
+
+    Yields:
+        tuple: (path, transcription, timings) for each file, in the order they finish.
+    """
+    pool = transcription_pool(workers)
+    if pool is None:
+        for path in paths:
+            yield path, *transcribe(path)
+        return
+
+    with pool as executor:
+        futures = [executor.submit(_transcribe_in_worker, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
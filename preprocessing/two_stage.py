@@ -0,0 +1,120 @@
+# Two-stage retrieval: a compact first-stage index (256-dimensional Titan embeddings, or int8 or binary quantized
+# 1024-dimensional ones) finds a wide set of candidates cheaply, and the candidates are then rescored with their
+# full 1024-dimensional float vectors, held in a local memory-mapped store, so the final ranking is (almost) that
+# of the full vectors at a fraction of the first stage's size and scan time. TwoStageIndex has the same interface
+# as the other vector stores, so the upsert script, the query cache and the app use it like any index.
+
+import numpy as np
+
+from config import RERANK_CANDIDATES
+from tracing import span
+from vector_store import VectorStore
+
+
+class TwoStageIndex(VectorStore):
+    """
+    A first-stage index, whose candidates are reranked with the full vectors of a local store.
+
+    Records may carry "first_stage_values", the vector the first stage indexes (e.g. a 256-dimensional
+    embedding of the same text); otherwise the first stage gets "values" and compacts it itself. The rerank
+    store keeps "values" alone, as metadata is returned by the first stage.
+
+    Args:
+        first_stage (VectorStore): Compact index holding the metadata, local or Pinecone.
+        rerank (LocalVectorStore): Store of the full vectors, by the same ids.
+        candidates (int): First-stage matches reranked per query.
+    """
+
+    def __init__(self, first_stage, rerank, candidates=RERANK_CANDIDATES):
+        self.first_stage = first_stage
+        self.rerank = rerank
+        self.candidates = candidates
+
+    def upsert(self, vectors, namespace=""):
+        self.first_stage.upsert(
+            vectors=[
+                {
+                    "id": v["id"],
+                    "values": v.get("first_stage_values", v["values"]),
+                    "metadata": v.get("metadata", {}),
+                }
+                for v in vectors
+            ],
+            namespace=namespace,
+        )
+        self.rerank.upsert(vectors=[{"id": v["id"], "values": v["values"]} for v in vectors], namespace=namespace)
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids, namespace=""):
+        self.first_stage.delete(ids=ids, namespace=namespace)
+        self.rerank.delete(ids=ids, namespace=namespace)
+
+    def query(
+        self,
+        vector,
+        top_k,
+        filter=None,
+        include_metadata=False,
+        namespace="",
+        first_stage_vector=None,
+        **kwargs,
+    ):
+        """
+        Queries the first stage with `first_stage_vector` (or `vector`, if the first stage indexes full-size
+        vectors), then ranks its best `candidates` matches by cosine similarity with `vector`.
+
+        Returns:
+            dict: {"matches": [...], "namespace": ...}; each match also has its "first_stage_score".
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        first_stage_vector = vector if first_stage_vector is None else first_stage_vector
+        with span("query.first_stage", candidates=self.candidates) as s:
+            kwargs = {"filter": filter} if filter else {}
+            candidates = list(
+                self.first_stage.query(
+                    vector=np.asarray(first_stage_vector, dtype=np.float32).tolist(),
+                    top_k=max(self.candidates, top_k),
+                    include_metadata=include_metadata,
+                    namespace=namespace,
+                    **kwargs,
+                )["matches"]
+            )
+            s.set(matches=len(candidates))
+        with span("query.rerank", candidates=len(candidates)):
+            found, full = self.rerank.get_vectors([m["id"] for m in candidates], namespace)
+            # a candidate without a full vector was written to the first stage only (an interrupted upsert)
+            # and is left out rather than ranked on a different scale
+            by_id = {m["id"]: m for m in candidates}
+            scores = full @ query
+            order = np.argsort(-scores, kind="stable")[:top_k]
+            matches = []
+            for row in order:
+                candidate = by_id[found[row]]
+                match = {
+                    "id": found[row],
+                    "score": float(scores[row]),
+                    "first_stage_score": float(candidate["score"]),
+                }
+                if include_metadata:
+                    match["metadata"] = candidate["metadata"]
+                matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def describe_index_stats(self):
+        return {
+            **self.first_stage.describe_index_stats(),
+            "rerank": self.rerank.describe_index_stats(),
+            "rerank_candidates": self.candidates,
+        }
+
+    def save(self):
+        """Writes the local stores to disk; a Pinecone first stage needs no saving."""
+        if hasattr(self.first_stage, "save"):
+            self.first_stage.save()
+        self.rerank.save()
+
+    def reload(self):
+        if hasattr(self.first_stage, "reload"):
+            self.first_stage.reload()
+        self.rerank.reload()
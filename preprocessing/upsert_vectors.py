@@ -1,25 +1,45 @@
-from pinecone import Pinecone, ServerlessSpec
+from pinecone import ServerlessSpec
 from dotenv import load_dotenv
-from config import index_name
+from config import (
+    index_name,
+    embeddings_dir,
+    sparse_index_dir,
+    traces_dir,
+    FIRST_STAGE_DIMENSION,
+    RETRIEVAL_MODE,
+    RETRIEVAL_MODES,
+    VECTOR_STORE,
+    EMBED_MAX_WORKERS,
+)
+from clients import (
+    get_bedrock_runtime,
+    get_pinecone_client,
+    get_vector_index,
+    vector_index_key,
+)
+from batch_upsert import delete_ids, upsert_batches
+from embeddings import EmbeddingStore, embed_texts
+from fakes import FakeBedrockRuntime, FakeIndex
+from frame_table import ENRICHED_COLUMNS, FrameTableWriter, iter_batches, iter_frames, read_column, schema
+from index_state import IndexState, make_vector_id, record_fingerprint, vector_id_prefix
+from manifest import Manifest
+from query_cache import mark_index_changed
+from sparse_index import SparseIndex, sparse_index_path
+from tracing import finish_trace, span, start_trace
+from two_stage import TwoStageIndex
+from vector_store import LocalVectorStore
+import argparse
+import functools
 import os
 import json
-import boto3
+import tempfile
 import base64
-import pandas as pd
 
 load_dotenv()
 
 # iterate over dataframe, and embed vectors using titan multimodal
 
 
-boto3_session = boto3.session.Session()
-region_name = boto3_session.region_name
-bedrock_client = boto3.client(
-    "bedrock-runtime",
-    region_name,
-)
-
-
 # Embedding code
 
 
@@ -44,7 +64,7 @@ def titan_multimodal_embedding(
     assert payload_body, "please provide either an image and/or a text description"
     print("\n".join(payload_body.keys()))
 
-    response = bedrock_client.invoke_model(
+    response = get_bedrock_runtime().invoke_model(
         body=json.dumps({**payload_body, **embedding_config}),
         modelId=model_id,
         accept="application/json",
@@ -56,21 +76,32 @@ def titan_multimodal_embedding(
 
 def titan_text_embedding(
     text: str,  # English only and max input tokens 128
-    dimension: int = 1024,  # 1,024 (default), 384, 256
+    dimension: int = 1024,  # 1,024 (default), 512, 256
     model_id: str = "amazon.titan-embed-text-v2:0",
+    client=None,
 ):
     payload_body = {
         "inputText": text,
+        "dimensions": dimension,
     }
 
-    response = bedrock_client.invoke_model(
-        body=json.dumps(payload_body),
-        modelId=model_id,
-        accept="application/json",
-        contentType="application/json",
-    )
-
-    response_body = json.loads(response.get("body").read())
+    body = json.dumps(payload_body)
+    with span("titan.embed", model=model_id) as s:
+        response = (client or get_bedrock_runtime()).invoke_model(
+            body=body,
+            modelId=model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        raw = response.get("body").read()
+        response_body = json.loads(raw)
+        # botocore retries throttled calls itself and reports how many it needed
+        s.add(
+            request_bytes=len(body),
+            response_bytes=len(raw),
+            input_tokens=response_body.get("inputTextTokenCount", 0),
+            retries=response.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+        )
 
     finish_reason = response_body.get("message")
 
@@ -83,55 +114,297 @@ def titan_text_embedding(
 # transform dataframe into metadata, ids, and values (where values are the vectors)
 
 
-# use upsert_as_dataframe or whatever the function is to upsert the vectors into the index
-from tqdm import tqdm
-
-if __name__ == "__main__":
-    # read in as json
-    file_path = "./data/finalized_data.json"
-    with open(file_path, "r") as f:
-        data = json.load(f)
-
-    values_to_embed = [item["contextual_frame_description"] for item in data]
-    ids = [item["frame_path"] for item in data]
-
-    embeddings = []
-
-    for v in tqdm(values_to_embed):
-        embedding = titan_text_embedding(text=v)
-        embeddings.append(embedding["embedding"])
-
-    final_vectors = []
-    ids = [x for x in range(0, len(values_to_embed))]
-
-    for v, e, id in tqdm(zip(data, embeddings, ids)):
-        final_vectors.append(
-            {
-                "id": str(id),
-                "values": e,
-                "metadata": {
-                    "transcript": v["words"],
-                    "filepath": v["frame_path"],
-                    "timestamp_start": v["timestamp"][0],
-                    "timestamp_end": v["timestamp"][1],
-                    "contextual_frame_description": v["contextual_frame_description"],
-                },
-            }
+def embed_videos(
+    videos,
+    manifest,
+    store,
+    max_workers=EMBED_MAX_WORKERS,
+    client=None,
+    output_dir=embeddings_dir,
+):
+    """
+    Embeds the contextual descriptions of each video's frames concurrently, and writes the video's enriched frames
+    again with their embeddings, as a frame table with a fixed-size float32 embedding column.
+
+    Videos are embedded and written one at a time, so only the embeddings of one video are held in memory however
+    large the corpus is. Descriptions already in `store` (from an earlier run or an unchanged frame) are not sent
+    to Titan again.
+    """
+    for video in videos:
+        table = manifest.stage(video, "enriched")["path"]
+        # only the column that is embedded is read
+        embeddings = embed_texts(
+            read_column(table, "contextual_frame_description"),
+            lambda text: titan_text_embedding(
+                text=text, dimension=store.dimension, model_id=store.model_id, client=client
+            )["embedding"],
+            store,
+            max_workers=max_workers,
+            desc=f"embedding {video}",
         )
 
-    # turn the list of dictionaries into a dataframe
-    df = pd.DataFrame(final_vectors)
-    print(df.head())
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-
-    # create index
-    if not pc.has_index(index_name):
-        pc.create_index(
-            name=index_name,
-            dimension=1024,
-            metric="cosine",
-            spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+        start = 0
+        embedded_path = os.path.join(output_dir, video + "_embedded.parquet")
+        with FrameTableWriter(embedded_path, schema(ENRICHED_COLUMNS, store.dimension)) as writer:
+            for batch in iter_batches(table, ENRICHED_COLUMNS):
+                writer.write_batch(batch, embeddings[start : start + batch.num_rows])
+                start += batch.num_rows
+        manifest.mark_done(video, "embedded", path=embedded_path)
+
+
+def needs_embedding(video, manifest):
+    # embeddings of videos embedded before the frame tables sit in .npy files; they are written again from the store
+    embedded = manifest.stage(video, "embedded")
+    return embedded is None or not embedded["path"].endswith(".parquet")
+
+
+# what a vector's metadata is made of; the transcript summary is not needed to build records
+RECORD_COLUMNS = [
+    "index",
+    "frame_path",
+    "timestamp_start",
+    "timestamp_end",
+    "words",
+    "contextual_frame_description",
+    "embedding",
+]
+
+
+def first_stage_embeddings(video, manifest, store, client=None):
+    """
+    Embeddings of a video's contextual descriptions at the first-stage dimension of two-stage retrieval, one row
+    per frame. Descriptions embedded by an earlier upsert are taken from `store`.
+    """
+    texts = read_column(manifest.stage(video, "embedded")["path"], "contextual_frame_description")
+    return embed_texts(
+        texts,
+        lambda text: titan_text_embedding(
+            text=text, dimension=store.dimension, model_id=store.model_id, client=client
+        )["embedding"],
+        store,
+        desc=f"first-stage embedding of {video}",
+    )
+
+
+def iter_video_records(video, manifest, first_stage=None):
+    """
+    Lazily yields the index records of a video, one at a time.
+
+    Frames are read from the video's frame table one row group at a time, and only the columns records are
+    made of, so only the records currently being batched are ever held in memory. With `first_stage`, a callable
+    returning the video's first-stage embeddings (see `first_stage_embeddings`), records also carry their
+    "first_stage_values" for a TwoStageIndex.
+    """
+    first_stage_values = first_stage(video) if first_stage is not None else None
+    frames = iter_frames(manifest.stage(video, "embedded")["path"], RECORD_COLUMNS)
+    for i, (v, embedding) in enumerate(frames):
+        record = {
+            # the id only depends on the video and the frame's start, so it survives reruns and reordering
+            "id": make_vector_id(video, v["timestamp"][0]),
+            "values": embedding.tolist(),
+            "metadata": {
+                "video_id": video,
+                "transcript": v["words"],
+                "filepath": v["frame_path"],
+                "timestamp_start": v["timestamp"][0],
+                "timestamp_end": v["timestamp"][1],
+                "contextual_frame_description": v["contextual_frame_description"],
+            },
+        }
+        if first_stage_values is not None:
+            record["first_stage_values"] = first_stage_values[i].tolist()
+        yield record
+
+
+def upsert_videos(
+    videos,
+    manifest,
+    index,
+    state,
+    delta=True,
+    sparse_path=None,
+    first_stage=None,
+    subset=False,
+    sparse_updates=None,
+):
+    """
+    Brings the index in line with the local records of `videos`, which should be every embedded video.
+
+    In delta mode only records whose fingerprint differs from the last upsert are sent; otherwise every record
+    is rewritten. Either way, vectors that were upserted before but no longer exist locally are deleted; with
+    `subset`, `videos` may be only some of the embedded videos (e.g. the one the pipeline just finished), and
+    only vectors of those videos are deleted. Fully upserted videos are marked in the manifest. With
+    `sparse_path`, the keyword index of the records is rebuilt there from all of them, whether sent or not. With
+    `sparse_updates` (a SparseIndexUpdates), the records of each fully upserted video are handed to it instead.
+    `first_stage` is passed on to `iter_video_records`.
+
+    Returns:
+        tuple: The number of vectors sent and of stale vectors deleted.
+    """
+    local_ids = set()
+    sent = {}
+    # everything the keyword index needs, gathered during the same pass over the records
+    sparse_records = []
+
+    def records_to_send():
+        for video in videos:
+            for record in iter_video_records(video, manifest, first_stage):
+                fingerprint = record_fingerprint(record)
+                local_ids.add(record["id"])
+                sparse_records.append((video, {"id": record["id"], "metadata": record["metadata"]}))
+                if delta and state.is_current(record["id"], fingerprint):
+                    continue
+                sent[record["id"]] = (video, fingerprint)
+                yield video, record
+
+    _, failed = upsert_batches(index, records_to_send())
+    state.update(
+        {
+            record_id: fingerprint
+            for record_id, (video, fingerprint) in sent.items()
+            if video not in failed
+        }
+    )
+
+    stale = [record_id for record_id in state.fingerprints if record_id not in local_ids]
+    if subset:
+        prefixes = tuple(vector_id_prefix(video) for video in videos)
+        stale = [record_id for record_id in stale if record_id.startswith(prefixes)]
+    if stale:
+        delete_ids(index, stale)
+        state.remove(stale)
+    state.save()
+    if sparse_path is not None:
+        with span("sparse.build") as s:
+            sparse = SparseIndex.build([r for video, r in sparse_records if video not in failed])
+            sparse.save(sparse_path)
+            s.set(records=len(sparse), terms=len(sparse.terms))
+    print(
+        f"Sent {len(sent)} of {len(local_ids)} vectors and deleted {len(stale)} stale ones"
+    )
+
+    for video in videos:
+        if video not in failed:
+            manifest.mark_done(video, "upserted", index_name=index_name)
+            if sparse_updates is not None:
+                # a failed video keeps its records from before, like its vectors in the index
+                sparse_updates.update(video, [r for v, r in sparse_records if v == video])
+    if failed:
+        raise RuntimeError(
+            f"Some batches could not be upserted for {sorted(failed)}; rerun to retry them"
         )
+    return len(sent), len(stale)
+
+
+def open_index(backend=VECTOR_STORE, mode=RETRIEVAL_MODE):
+    """The index to upsert into; a Pinecone index (or the 256-dimensional first stage) is created if missing."""
+    if backend == "pinecone":
+        pc = get_pinecone_client()
+        # the first stage of the 256-dimensional mode is an index of its own
+        name, dimension = index_name, 1024
+        if mode == "titan256":
+            name, dimension = f"{index_name}-{FIRST_STAGE_DIMENSION}", FIRST_STAGE_DIMENSION
+        if not pc.has_index(name):
+            pc.create_index(
+                name=name,
+                dimension=dimension,
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+            )
+    return get_vector_index(index_name, backend, mode)
+
+
+def first_stage_for(mode, manifest, client=None, **store_kwargs):
+    """The `first_stage` argument of `upsert_videos` in a retrieval mode; None unless the mode is "titan256"."""
+    if mode != "titan256":
+        return None
+    store = EmbeddingStore("amazon.titan-embed-text-v2:0", FIRST_STAGE_DIMENSION, **store_kwargs)
+    return functools.partial(first_stage_embeddings, manifest=manifest, store=store, client=client)
+
 
-    index = pc.Index(index_name)
-    index.upsert_from_dataframe(df)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="dry run with a fake Titan client and an in-process fake index; nothing in data/ is modified",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="rewrite every vector instead of only the ones that changed since the last upsert",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("pinecone", "local"),
+        default=VECTOR_STORE,
+        help="upsert into Pinecone, or into the local on-disk index under data/local_index",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=RETRIEVAL_MODES,
+        default=RETRIEVAL_MODE,
+        help="index full 1024-dimensional vectors, or a compact first stage (256-dimensional, int8 or binary) "
+        "reranked with full vectors kept in data/local_index; int8 and binary need --backend local",
+    )
+    args = parser.parse_args()
+    if args.mode in ("int8", "binary") and args.backend == "pinecone" and not args.fake:
+        parser.error(f"--mode {args.mode} needs --backend local")
+
+    manifest = Manifest(read_only=args.fake)
+
+    if args.fake:
+        client = FakeBedrockRuntime(latency=0.05)
+        index = FakeIndex(latency=0.05)
+        output_dir = tempfile.mkdtemp(prefix="upsert-dry-run-")
+        store = EmbeddingStore("amazon.titan-embed-text-v2:0", 1024, root=output_dir)
+        if args.mode != "full":
+            index = TwoStageIndex(index, LocalVectorStore(os.path.join(output_dir, "rerank"), 1024))
+    elif args.backend == "local":
+        client = None
+        output_dir = embeddings_dir
+        store = EmbeddingStore("amazon.titan-embed-text-v2:0", 1024)
+        index = open_index("local", args.mode)
+    else:
+        client = None
+        output_dir = embeddings_dir
+        store = EmbeddingStore("amazon.titan-embed-text-v2:0", 1024)
+        index = open_index("pinecone", args.mode)
+
+    # a dry run keeps its trace with its other outputs, out of data/
+    start_trace("upsert", root=output_dir if args.fake else traces_dir)
+
+    first_stage = first_stage_for(
+        args.mode, manifest, client, **({"root": output_dir} if args.fake else {})
+    )
+
+    videos = manifest.videos_at("enriched")
+    embed_videos(
+        [video for video in videos if needs_embedding(video, manifest)],
+        manifest,
+        store,
+        client=client,
+        output_dir=output_dir,
+    )
+
+    index_key = vector_index_key(index_name, args.backend, args.mode)
+    state = IndexState(index_key, read_only=args.fake)
+    try:
+        upsert_videos(
+            videos,
+            manifest,
+            index,
+            state,
+            delta=not args.full,
+            sparse_path=sparse_index_path(index_key, root=output_dir if args.fake else sparse_index_dir),
+            first_stage=first_stage,
+        )
+    finally:
+        if not args.fake:
+            # the local index (or the local rerank store of a two-stage index) only reaches disk here,
+            # matching the state that upsert_videos saved
+            if args.backend == "local" or args.mode != "full":
+                index.save()
+            # even a partly failed upsert may have changed the index, so cached query results are dropped
+            mark_index_changed(index_key)
+        finish_trace()
@@ -0,0 +1,414 @@
+# Vector stores behind the index interface the pipeline uses: `upsert(vectors=...)`, `query(vector=..., top_k=...,
+# filter=..., include_metadata=...)`, `delete(ids=...)` and `describe_index_stats()`. A Pinecone index already has
+# this interface; LocalVectorStore implements it on disk, so retrieval works offline, in CI, and as a baseline for
+# Pinecone's latency. Vectors are held as a memory-mapped float32 matrix of unit rows and searched with one
+# matrix-vector product per block of rows, optionally narrowed down by an inverted-file (IVF) index. The matrix
+# can also be quantized, to int8 or to one bit per dimension, for a compact first stage whose candidates are
+# reranked with the full vectors (see two_stage.py).
+
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from config import IVF_NPROBE, LOCAL_INDEX_ANN
+
+# rows scored per matrix-vector product, so a search over a memory-mapped matrix streams it in bounded chunks
+QUERY_BLOCK_ROWS = 65536
+
+# quantized rows are converted to float32 (int8) or compared bit by bit (binary) this many rows at a time; blocks
+# that stay in the CPU cache are about three times faster than the float32 block size
+QUANTIZED_BLOCK_ROWS = 1024
+
+# bits set in each 16-bit value, for Hamming distances between binary-quantized vectors (numpy 1.26 has no
+# popcount); binary rows are padded to whole 16-bit words
+POPCOUNT = np.array([bin(word).count("1") for word in range(1 << 16)], dtype=np.uint8)
+
+
+class VectorStore(ABC):
+    """
+    The index interface of the pipeline, matching the parts of Pinecone's Index it uses.
+
+    Records are dicts with an "id", "values" and optional "metadata". Query results are dicts with "matches",
+    each holding "id", "score" and, if requested, "metadata", best first.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors, namespace=""):
+        ...
+
+    @abstractmethod
+    def query(self, vector, top_k, filter=None, include_metadata=False, namespace=""):
+        ...
+
+    @abstractmethod
+    def delete(self, ids, namespace=""):
+        ...
+
+    @abstractmethod
+    def describe_index_stats(self):
+        ...
+
+
+def _compare(column, op, value):
+    if op == "$eq":
+        return column == value
+    if op == "$ne":
+        return column != value
+    if op in ("$in", "$nin"):
+        mask = np.zeros(len(column), dtype=bool)
+        for v in value:
+            mask |= column == v
+        return mask if op == "$in" else ~mask
+    # range operators only match numbers
+    numbers = np.array(
+        [v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in column],
+        dtype=np.float64,
+    )
+    with np.errstate(invalid="ignore"):
+        if op == "$gt":
+            return numbers > value
+        if op == "$gte":
+            return numbers >= value
+        if op == "$lt":
+            return numbers < value
+        if op == "$lte":
+            return numbers <= value
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Cosine-similarity vector index persisted in a folder.
+
+    The folder holds `vectors.npy` (unit-length float32 rows), `records.json` (id, namespace and metadata per row)
+    and, when an IVF index was built, `ivf.npz`. Opening memory-maps the vectors, so startup cost does not grow
+    with the matrix. Changes are kept in memory until `save()`; updated or deleted rows are masked out and
+    dropped when saving.
+
+    Metadata filters follow Pinecone's syntax: `{"field": value}`, `{"field": {"$eq"|"$ne"|"$in"|"$nin"|"$gt"|
+    "$gte"|"$lt"|"$lte": value}}`, combined with `{"$and": [...]}` and `{"$or": [...]}`.
+
+    With `quantization`, rows are stored as int8 (each unit-vector component times 127), scored against the
+    float query, or as one sign bit per dimension, scored by the fraction of matching bits (1 - 2 * Hamming
+    distance / dimension). Scores then only approximate cosine similarity, but the matrix is 4 or 32 times
+    smaller.
+
+    Args:
+        path (str or Path): Folder of the index.
+        dimension (int): Vector dimension.
+        ann (str, optional): "ivf" to build an inverted-file index on save, or None to always search exactly.
+        nprobe (int): Clusters searched per query with the IVF index.
+        quantization (str, optional): "int8" or "binary" to store quantized rows, or None for float32.
+    """
+
+    def __init__(self, path, dimension, ann=LOCAL_INDEX_ANN, nprobe=IVF_NPROBE, quantization=None):
+        if ann not in (None, "ivf"):
+            raise ValueError(f"Unsupported approximate index: {ann}")
+        if quantization not in (None, "int8", "binary"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.path = str(path)
+        self.dimension = dimension
+        self.ann = ann
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self._dtype = {None: np.float32, "int8": np.int8, "binary": np.uint8}[quantization]
+        self._width = (dimension + 15) // 16 * 2 if quantization == "binary" else dimension
+        self._block_rows = QUERY_BLOCK_ROWS if quantization is None else QUANTIZED_BLOCK_ROWS
+        self._lock = threading.RLock()
+
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        if os.path.exists(vectors_path):
+            self._base = np.load(vectors_path, mmap_mode="r")
+            with open(os.path.join(self.path, "records.json"), "r") as f:
+                records = json.load(f)
+        else:
+            self._base = np.zeros((0, self._width), dtype=self._dtype)
+            records = []
+        if self._base.shape[1] != self._width or self._base.dtype != self._dtype:
+            raise ValueError(
+                f"{self.path} holds {self._base.dtype} rows of width {self._base.shape[1]}, not the "
+                f"{np.dtype(self._dtype)} rows of width {self._width} of {quantization or 'float'} "
+                f"{dimension}-dimensional vectors"
+            )
+
+        self._ids = [r["id"] for r in records]
+        self._namespaces = [r.get("namespace", "") for r in records]
+        self._metadata = [r.get("metadata", {}) for r in records]
+        self._rows = {(ns, i): row for row, (ns, i) in enumerate(zip(self._namespaces, self._ids))}
+        self._alive = np.ones(len(records), dtype=bool)
+        self._pending = []
+        self._matrix_cache = None
+        self._columns = {}
+
+        self._centroids = self._lists = self._list_offsets = None
+        ivf_path = os.path.join(self.path, "ivf.npz")
+        if ann == "ivf" and os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            self._centroids = ivf["centroids"]
+            self._lists = ivf["lists"]
+            self._list_offsets = ivf["offsets"]
+        # rows from here on are not in the IVF lists yet and are always searched exhaustively
+        self._indexed_rows = len(self._lists) if self._lists is not None else 0
+
+    def reload(self):
+        """Drops unsaved changes and reads the index back from disk, e.g. after another process saved it."""
+        with self._lock:
+            self.__init__(self.path, self.dimension, self.ann, self.nprobe, self.quantization)
+
+    def upsert(self, vectors, namespace=""):
+        values = np.asarray([v["values"] for v in vectors], dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values = self._encode(values / np.where(norms == 0, 1, norms))
+        with self._lock:
+            first = len(self._ids)
+            self._alive = np.concatenate([self._alive, np.ones(len(vectors), dtype=bool)])
+            for offset, v in enumerate(vectors):
+                # an existing record with the same id is replaced by the new row
+                old_row = self._rows.get((namespace, v["id"]))
+                if old_row is not None:
+                    self._alive[old_row] = False
+                self._ids.append(v["id"])
+                self._namespaces.append(namespace)
+                self._metadata.append(v.get("metadata", {}))
+                self._rows[(namespace, v["id"])] = first + offset
+            self._pending.append(values)
+            self._matrix_cache = None
+            self._columns.clear()
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids, namespace=""):
+        with self._lock:
+            for record_id in ids:
+                row = self._rows.pop((namespace, record_id), None)
+                if row is not None:
+                    self._alive[row] = False
+
+    def _encode(self, rows):
+        # unit float32 rows to the stored representation
+        if self.quantization == "int8":
+            return np.round(rows * 127).astype(np.int8)
+        if self.quantization == "binary":
+            bits = np.zeros((len(rows), self._width * 8), dtype=bool)
+            bits[:, : self.dimension] = rows > 0
+            return np.packbits(bits, axis=1)
+        return rows
+
+    def _decode(self, rows):
+        # stored rows back to (approximately) unit float32 rows
+        rows = np.asarray(rows)
+        if self.quantization == "int8":
+            return rows.astype(np.float32) / 127
+        if self.quantization == "binary":
+            signs = np.unpackbits(rows, axis=1, count=self.dimension).astype(np.float32) * 2 - 1
+            return signs / np.sqrt(self.dimension)
+        return rows
+
+    def _score_rows(self, rows, query, query_bits):
+        rows = np.asarray(rows)
+        if self.quantization == "binary":
+            distance = POPCOUNT[np.bitwise_xor(rows, query_bits).view(np.uint16)].sum(axis=1, dtype=np.int32)
+            return (1 - 2 * distance / self.dimension).astype(np.float32)
+        if self.quantization == "int8":
+            return rows.astype(np.float32) @ query / 127
+        return rows @ query
+
+    def get_vectors(self, ids, namespace=""):
+        """
+        Looks up stored vectors by id, e.g. to rerank candidates of another index.
+
+        Returns:
+            tuple: The ids that were found, and their (decoded) unit vectors as a float32 matrix.
+        """
+        with self._lock:
+            found = [(self._rows[(namespace, i)], i) for i in ids if (namespace, i) in self._rows]
+            if not found:
+                return [], np.zeros((0, self.dimension), dtype=np.float32)
+            rows = np.array([row for row, _ in found])
+            base, pending = self._matrix()
+            order = np.argsort(rows)
+            sorted_rows = rows[order]
+            split = np.searchsorted(sorted_rows, len(base))
+            parts = [np.asarray(base[sorted_rows[:split]])]
+            if pending is not None:
+                parts.append(pending[sorted_rows[split:] - len(base)])
+            vectors = np.empty((len(rows), self._width), dtype=self._dtype)
+            vectors[order] = np.concatenate(parts)
+            return [i for _, i in found], self._decode(vectors)
+
+    def _matrix(self):
+        # the saved rows stay memory-mapped; only rows added since the last save are copied into one array
+        if self._matrix_cache is None:
+            if self._pending:
+                self._pending = [np.concatenate(self._pending)]
+            self._matrix_cache = (self._base, self._pending[0] if self._pending else None)
+        return self._matrix_cache
+
+    def _column(self, field, values=None):
+        # metadata fields as object arrays, built on first use so filters compare whole columns at once
+        key = ("metadata", field) if values is None else field
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self._ids), dtype=object)
+            column[:] = [m.get(field) for m in self._metadata] if values is None else values
+            self._columns[key] = column
+        return column
+
+    def _filter_mask(self, filter):
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, condition in filter.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self._filter_mask(sub)
+            elif key == "$or":
+                any_mask = np.zeros(len(self._ids), dtype=bool)
+                for sub in condition:
+                    any_mask |= self._filter_mask(sub)
+                mask &= any_mask
+            elif isinstance(condition, dict):
+                for op, value in condition.items():
+                    mask &= _compare(self._column(key), op, value)
+            else:
+                mask &= _compare(self._column(key), "$eq", condition)
+        return mask
+
+    def _candidate_rows(self, query):
+        # with an IVF index, the rows of the nprobe nearest clusters plus every row added since it was built
+        if self._centroids is None:
+            return None
+        probe = np.argsort(self._centroids @ query)[::-1][: self.nprobe]
+        lists = [self._lists[self._list_offsets[c] : self._list_offsets[c + 1]] for c in probe]
+        return np.concatenate(lists + [np.arange(self._indexed_rows, len(self._ids))])
+
+    def _scores(self, query, rows=None):
+        base, pending = self._matrix()
+        query_bits = self._encode(query[None])[0] if self.quantization == "binary" else None
+        if rows is not None:
+            rows = np.sort(rows)
+            split = np.searchsorted(rows, len(base))
+            parts = [self._score_rows(base[rows[:split]], query, query_bits)]
+            if pending is not None:
+                parts.append(self._score_rows(pending[rows[split:] - len(base)], query, query_bits))
+            return rows, np.concatenate(parts)
+        parts = [
+            self._score_rows(base[start : start + self._block_rows], query, query_bits)
+            for start in range(0, len(base), self._block_rows)
+        ]
+        if pending is not None:
+            parts.append(self._score_rows(pending, query, query_bits))
+        scores = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        return np.arange(len(scores)), scores
+
+    def query(self, vector, top_k, filter=None, include_metadata=False, namespace="", include_values=False):
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        with self._lock:
+            rows, scores = self._scores(query, self._candidate_rows(query))
+            keep = self._alive[rows]
+            namespaces = self._column("namespace", self._namespaces)
+            if namespace or (namespaces != "").any():
+                keep &= namespaces[rows] == namespace
+            if filter:
+                keep &= self._filter_mask(filter)[rows]
+            rows, scores = rows[keep], scores[keep]
+            if len(rows) > top_k:
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+                rows, scores = rows[best], scores[best]
+            order = np.argsort(-scores, kind="stable")
+            matches = []
+            for row, score in zip(rows[order], scores[order]):
+                match = {"id": self._ids[row], "score": float(score)}
+                if include_metadata:
+                    match["metadata"] = self._metadata[row]
+                matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {
+                "dimension": self.dimension,
+                "total_vector_count": int(self._alive.sum()),
+                "ann": self.ann,
+                "quantization": self.quantization,
+            }
+
+    def save(self):
+        """Writes live rows to disk, dropping updated and deleted ones, and rebuilds the IVF index if enabled."""
+        with self._lock:
+            base, pending = self._matrix()
+            live = np.flatnonzero(self._alive)
+            os.makedirs(self.path, exist_ok=True)
+
+            vectors_path = os.path.join(self.path, "vectors.npy")
+            tmp_path = os.path.join(self.path, "vectors.tmp.npy")
+            out = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=self._dtype, shape=(len(live), self._width)
+            )
+            split = np.searchsorted(live, len(base))
+            for start in range(0, split, QUERY_BLOCK_ROWS):
+                end = min(start + QUERY_BLOCK_ROWS, split)
+                out[start:end] = base[live[start:end]]
+            if pending is not None:
+                out[split:] = pending[live[split:] - len(base)]
+            out.flush()
+            del out
+
+            records = [
+                {"id": self._ids[row], "namespace": self._namespaces[row], "metadata": self._metadata[row]}
+                for row in live
+            ]
+            records_path = os.path.join(self.path, "records.json")
+            with open(records_path + ".tmp", "w") as f:
+                json.dump(records, f)
+
+            # drop the old memory map before replacing the file it maps
+            self._base = self._matrix_cache = None
+            os.replace(tmp_path, vectors_path)
+            os.replace(records_path + ".tmp", records_path)
+
+            self._base = np.load(vectors_path, mmap_mode="r")
+            self._ids = [r["id"] for r in records]
+            self._namespaces = [r["namespace"] for r in records]
+            self._metadata = [r["metadata"] for r in records]
+            self._rows = {(ns, i): row for row, (ns, i) in enumerate(zip(self._namespaces, self._ids))}
+            self._alive = np.ones(len(records), dtype=bool)
+            self._pending = []
+            self._columns.clear()
+
+            ivf_path = os.path.join(self.path, "ivf.npz")
+            if self.ann == "ivf" and len(records):
+                self._build_ivf()
+                np.savez(ivf_path, centroids=self._centroids, lists=self._lists, offsets=self._list_offsets)
+            else:
+                # nothing left to index; the old lists would point at rows that are gone
+                self._centroids = self._lists = self._list_offsets = None
+                if os.path.exists(ivf_path):
+                    os.remove(ivf_path)
+            self._indexed_rows = len(records) if self._centroids is not None else 0
+
+    def _build_ivf(self, iterations=10, sample_size=50_000, seed=0):
+        # spherical k-means on a sample of rows, then every row is filed under its nearest centroid
+        n = len(self._base)
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = self._decode(self._base[np.sort(rng.choice(n, min(n, sample_size), replace=False))])
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # a cluster that lost all its points keeps its previous centroid
+            centroids = np.where(norms > 0, sums / np.where(norms == 0, 1, norms), centroids)
+
+        assignments = np.concatenate(
+            [
+                np.argmax(self._decode(self._base[start : start + self._block_rows]) @ centroids.T, axis=1)
+                for start in range(0, n, self._block_rows)
+            ]
+        )
+        self._centroids = centroids.astype(np.float32)
+        self._lists = np.argsort(assignments, kind="stable").astype(np.int64)
+        self._list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
@@ -0,0 +1,73 @@
+# Assignment of transcript words to the frame windows they were spoken in. Frame windows are sorted and do not
+# overlap, so each word is placed with a binary search over the window bounds (NumPy's searchsorted over all
+# words at once), which keeps the cost at O((frames + words) log frames) instead of scanning every word for
+# every frame.
+
+import numpy as np
+
+from config import WORD_BOUNDARY
+
+
+def word_bounds(chunks):
+    """Start and end times of every word chunk; Whisper leaves the end of the last word empty at times."""
+    starts = np.array([c["timestamp"][0] for c in chunks], dtype=np.float64)
+    ends = np.array(
+        [c["timestamp"][0] if c["timestamp"][1] is None else c["timestamp"][1] for c in chunks],
+        dtype=np.float64,
+    )
+    return starts, np.maximum(ends, starts)
+
+
+def assign_words_to_frames(transcription, frames, boundary=WORD_BOUNDARY):
+    """
+    Gives each frame the words spoken during its timestamp window.
+
+    Args:
+        transcription (dict): Whisper output, whose "chunks" are words with (start, end) timestamps.
+        frames (list): Frames in time order, each with a (start, end) "timestamp" window.
+        boundary (str): "midpoint" or "duplicate", see WORD_BOUNDARY.
+
+    Returns:
+        list: One entry per frame with its path, its words joined in spoken order, and its timestamp.
+    """
+    if boundary not in ("midpoint", "duplicate"):
+        raise ValueError(f"Unknown word boundary policy: {boundary}")
+
+    if not frames:
+        return []
+    chunks = transcription["chunks"]
+    frame_starts = np.array([f["timestamp"][0] for f in frames], dtype=np.float64)
+    frame_ends = np.array([f["timestamp"][1] for f in frames], dtype=np.float64)
+    word_starts, word_ends = word_bounds(chunks)
+    last_frame = len(frames) - 1
+
+    if boundary == "midpoint":
+        midpoints = (word_starts + word_ends) / 2
+        first = np.searchsorted(frame_starts, midpoints, side="right") - 1
+        window_ends = frame_ends[np.maximum(first, 0)]
+        # the last window also takes a word whose middle is exactly at the end of the video
+        inside = (first >= 0) & (
+            (midpoints < window_ends) | ((first == last_frame) & (midpoints <= window_ends))
+        )
+        last = first
+    else:
+        # windows that overlap the word: from the first one ending after it starts to the last one starting
+        # before it ends; a word with no duration still belongs to the window it falls in
+        # (the last window also takes a word starting exactly at the end of the video)
+        first = np.searchsorted(frame_ends[:-1], word_starts, side="right")
+        last = np.maximum(np.searchsorted(frame_starts, word_ends, side="left") - 1, first)
+        inside = (frame_starts[first] <= word_ends) & (word_starts <= frame_ends[first])
+
+    words_per_frame = [[] for _ in frames]
+    for i in np.flatnonzero(inside):
+        for frame_index in range(first[i], last[i] + 1):
+            words_per_frame[frame_index].append(chunks[i]["text"])
+
+    return [
+        {
+            "frame_path": f["frame_path"],
+            "words": "".join(words),
+            "timestamp": f["timestamp"],
+        }
+        for f, words in zip(frames, words_per_frame)
+    ]
@@ -0,0 +1,40 @@
+# The pipeline modules import each other by their bare names, as the scripts in preprocessing/ are run directly,
+# so the tests put that folder on the path the same way.
+
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "preprocessing"))
+
+from prompt_images import PromptImageCache, use_prompt_image_cache  # noqa: E402
+from response_cache import ResponseCache, use_response_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path):
+    # Claude responses and prompt images go to throwaway caches, never to data/cache
+    use_response_cache(ResponseCache(tmp_path / "claude_responses.sqlite"))
+    use_prompt_image_cache(PromptImageCache(tmp_path / "prompt_images"))
+    yield
+    use_response_cache(None)
+    use_prompt_image_cache(None)
+
+
+@pytest.fixture
+def make_frame(tmp_path):
+    """Writes a small PNG and returns its path; `pixels` is a callable (x, y) -> RGB or one RGB tuple."""
+
+    def make(name, pixels=(0, 0, 0), size=(64, 48)):
+        image = Image.new("RGB", size)
+        if callable(pixels):
+            image.putdata([pixels(x, y) for y in range(size[1]) for x in range(size[0])])
+        else:
+            image.paste(pixels, (0, 0, *size))
+        path = tmp_path / f"{name}.png"
+        image.save(path)
+        return str(path)
+
+    return make
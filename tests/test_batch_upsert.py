@@ -0,0 +1,83 @@
+import re
+from collections import Counter
+
+import pytest
+
+import batch_upsert
+from batch_upsert import delete_ids, upsert_batches
+from fakes import FakeIndex, FakeThrottlingError
+
+
+class FlakyIndex(FakeIndex):
+    """A FakeIndex whose upserts of batches starting with one of `failing` ids fail the given number of times."""
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = dict(failing)
+        self.attempts = Counter()
+
+    def upsert(self, vectors, namespace=None):
+        first = vectors[0]["id"]
+        with self._lock:
+            self.attempts[first] += 1
+            fail = self.attempts[first] <= self.failing.get(first, 0)
+        if fail:
+            raise FakeThrottlingError("Fake upsert failure")
+        return super().upsert(vectors, namespace)
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    # the upper bound of every backoff drawn; nothing actually sleeps
+    drawn = []
+    monkeypatch.setattr(batch_upsert.random, "uniform", lambda low, high: drawn.append(high) or 0.0)
+    monkeypatch.setattr(batch_upsert.time, "sleep", lambda seconds: None)
+    return drawn
+
+
+def tagged(tag, n):
+    return [(tag, {"id": f"{tag}-{i}", "values": [float(i)], "metadata": {}}) for i in range(n)]
+
+
+def test_every_record_is_upserted_in_batches_of_one_tag():
+    index = FakeIndex()
+    upserted, failed = upsert_batches(index, tagged("a", 25) + tagged("b", 5), batch_size=10, max_workers=3)
+
+    assert (upserted, failed) == ({"a", "b"}, set())
+    assert len(index.vectors) == 30
+    # a: 10 + 10 + 5, b: 5; a batch never mixes tags
+    assert index.upsert_calls == 4
+
+
+def test_only_the_failed_batch_is_retried_with_backoff(backoffs):
+    index = FlakyIndex({"a-10": 2})
+    upserted, failed = upsert_batches(index, tagged("a", 30), batch_size=10, max_workers=2, max_retries=3)
+
+    assert (upserted, failed) == ({"a"}, set())
+    assert len(index.vectors) == 30
+    assert index.attempts == {"a-0": 1, "a-10": 3, "a-20": 1}
+    # full jitter under an exponentially growing bound
+    assert backoffs == [1, 2]
+
+
+def test_a_batch_failing_for_good_fails_its_tag_only(backoffs):
+    index = FlakyIndex({"b-0": 10})
+    upserted, failed = upsert_batches(index, tagged("a", 5) + tagged("b", 5), batch_size=10, max_retries=2)
+
+    assert (upserted, failed) == ({"a"}, {"b"})
+    assert index.attempts["b-0"] == 3
+    assert sorted(index.vectors) == [f"a-{i}" for i in range(5)]
+
+
+def test_the_upsert_rate_is_reported(capsys):
+    upsert_batches(FakeIndex(), tagged("a", 12), batch_size=5)
+
+    assert re.search(r"Upserted 12 vectors in [\d.]+s \(\d+ vectors/s\)", capsys.readouterr().out)
+
+
+def test_delete_ids_deletes_in_batches():
+    index = FakeIndex()
+    index.upsert(vectors=[record for _, record in tagged("a", 5)])
+    delete_ids(index, ["a-0", "a-1", "a-2", "missing"], batch_size=2)
+
+    assert sorted(index.vectors) == ["a-3", "a-4"]
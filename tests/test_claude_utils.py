@@ -0,0 +1,43 @@
+from claude_utils import create_message, stream_message
+from fakes import FakeBedrockClient
+from response_cache import get_response_cache
+
+REQUEST = {"model": "m", "max_tokens": 100, "messages": [{"role": "user", "content": "What is on the slide?"}]}
+
+
+def test_a_fresh_stream_yields_the_response_in_pieces_and_caches_it():
+    client = FakeBedrockClient(latency=0, jitter=0)
+    timings = {}
+
+    pieces = list(stream_message(client, timings=timings, **REQUEST))
+
+    assert len(pieces) > 1
+    assert "".join(pieces) == create_message(FakeBedrockClient(latency=0, jitter=0), **REQUEST)
+    assert timings["cached"] is False
+    # the fake client sends a word every 10 ms
+    assert 0.005 <= timings["ttft_s"] < timings["total_s"]
+    assert get_response_cache().stats()["entries"] == 1
+
+
+def test_a_cached_stream_yields_the_whole_response_at_once():
+    client = FakeBedrockClient(latency=0, jitter=0)
+    text = "".join(stream_message(client, **REQUEST))
+    timings = {}
+
+    assert list(stream_message(client, timings=timings, **REQUEST)) == [text]
+    assert timings["cached"] is True
+    assert timings["ttft_s"] <= timings["total_s"] < 0.005
+    assert client.calls == 1
+
+
+def test_an_abandoned_stream_is_not_cached():
+    client = FakeBedrockClient(latency=0, jitter=0)
+    stream = stream_message(client, **REQUEST)
+    next(stream)
+    stream.close()
+
+    timings = {}
+    list(stream_message(client, timings=timings, **REQUEST))
+
+    assert timings["cached"] is False
+    assert client.calls == 2
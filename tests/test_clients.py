@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+import clients
+
+
+class StubPinecone:
+    def __init__(self):
+        self.indexes = []
+
+    def Index(self, name, pool_threads=None):
+        self.indexes.append(name)
+        return f"index {name}"
+
+
+@pytest.fixture
+def stub_pinecone(monkeypatch):
+    pinecone = StubPinecone()
+    monkeypatch.setattr(clients, "make_pinecone_client", lambda: pinecone)
+    clients.reset_clients()
+    yield pinecone
+    clients.reset_clients()
+
+
+def in_thread(fn, timeout=5.0):
+    # a deadlock would hang the test run, so the call runs in a thread that is given up on
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the call did not return"
+    return result[0]
+
+
+def test_a_pinecone_index_is_built_on_a_cold_registry(stub_pinecone):
+    index = in_thread(lambda: clients.get_vector_index("test-vqa", "pinecone", "full"))
+
+    assert index == "index test-vqa"
+    assert clients.get_pinecone_client() is stub_pinecone
+
+
+def test_clients_and_indexes_are_built_once_and_shared(stub_pinecone):
+    indexes = in_thread(lambda: [clients.get_pinecone_index("test-vqa") for _ in range(3)])
+
+    assert indexes == ["index test-vqa"] * 3
+    assert stub_pinecone.indexes == ["test-vqa"]
+
+
+def test_reset_clients_builds_fresh_ones(stub_pinecone):
+    clients.get_pinecone_index("test-vqa")
+    clients.reset_clients()
+    clients.get_pinecone_index("test-vqa")
+
+    assert stub_pinecone.indexes == ["test-vqa", "test-vqa"]
@@ -0,0 +1,100 @@
+from context_expansion import VideoFrameIndex, expand_context, merge_matches, within_budget
+from sparse_index import SparseIndex, fuse_matches
+
+
+def frame(video, i, seconds=45.0, words=None):
+    return {
+        "id": f"{video}-{i}",
+        "metadata": {
+            "video_id": video,
+            "filepath": f"data/frames/{video}/frame_{i + 1:04d}.png",
+            "timestamp_start": i * seconds,
+            "timestamp_end": (i + 1) * seconds,
+            "transcript": words if words is not None else f"words {i}",
+            "contextual_frame_description": f"description {i}",
+        },
+    }
+
+
+def match(video, i, score):
+    return dict(frame(video, i), score=score)
+
+
+def test_adjacent_matches_of_a_video_merge_into_one_segment():
+    segments = merge_matches([match("a", 3, 0.7), match("a", 2, 0.9), match("b", 2, 0.8)], max_gap=0)
+
+    assert [(s["id"], s["score"]) for s in segments] == [("a-2", 0.9), ("b-2", 0.8)]
+    merged = segments[0]
+    assert merged["hit_ids"] == ["a-2", "a-3"]
+    assert merged["metadata"]["timestamp_start"] == 90.0
+    assert merged["metadata"]["timestamp_end"] == 180.0
+    assert merged["metadata"]["transcript"] == "words 2 words 3"
+    assert merged["metadata"]["contextual_frame_description"] == "description 2\ndescription 3"
+    # the best hit's frame stands for the segment
+    assert merged["metadata"]["filepath"].endswith("frame_0003.png")
+
+
+def test_matches_further_apart_than_the_gap_stay_apart():
+    segments = merge_matches([match("a", 0, 0.9), match("a", 4, 0.8)], max_gap=60)
+    assert [s["hit_ids"] for s in segments] == [["a-0"], ["a-4"]]
+
+
+def test_neighbours_widen_matches_and_join_nearby_ones():
+    frame_index = VideoFrameIndex([frame("a", i) for i in range(10)])
+
+    segments = merge_matches([match("a", 2, 0.9), match("a", 4, 0.8)], frame_index, neighbours=1, max_gap=0)
+
+    assert len(segments) == 1
+    assert segments[0]["frame_ids"] == [f"a-{i}" for i in range(1, 6)]
+    assert segments[0]["hit_ids"] == ["a-2", "a-4"]
+    # neighbours add their transcript but not their description
+    assert segments[0]["metadata"]["transcript"] == "words 1 words 2 words 3 words 4 words 5"
+    assert segments[0]["metadata"]["contextual_frame_description"] == "description 2\ndescription 4"
+
+
+def test_a_match_unknown_to_the_frame_index_stands_alone():
+    frame_index = VideoFrameIndex([frame("a", i) for i in range(3)])
+    segments = merge_matches([match("new", 0, 0.5)], frame_index, neighbours=2)
+    assert segments[0]["frame_ids"] == ["new-0"]
+
+
+def test_frame_index_neighbours_stop_at_the_ends_of_a_video():
+    frame_index = VideoFrameIndex([frame("a", i) for i in reversed(range(5))])
+    assert [f["id"] for f in frame_index.neighbours("a-0", 2)] == ["a-0", "a-1", "a-2"]
+    assert [f["id"] for f in frame_index.neighbours("a-4", 1)] == ["a-3", "a-4"]
+    assert frame_index.neighbours("missing", 1) == []
+
+
+def test_within_budget_keeps_the_best_segments_that_fit():
+    segments = merge_matches(
+        [
+            dict(frame("a", 0, words="x" * 400), score=0.9),
+            dict(frame("b", 0, words="x" * 4000), score=0.8),
+            dict(frame("c", 0, words="x" * 400), score=0.7),
+            dict(frame("d", 0, words="x" * 400), score=0.6),
+        ]
+    )
+
+    # the second segment alone is over the text budget and is skipped; the image budget stops at two
+    kept = within_budget(segments, max_images=2, max_text_tokens=300)
+    assert [s["id"] for s in kept] == ["a-0", "c-0"]
+
+
+def test_fused_matches_keep_the_fields_the_app_shows():
+    frames = [frame("a", i) for i in range(6)]
+    dense = [dict(frames[2], score=0.9), dict(frames[3], score=0.6)]
+    sparse = SparseIndex.build(frames).query("words 3", top_k=2)["matches"]
+
+    fused = fuse_matches(dense, sparse, top_k=4, sparse_weight=0.3)
+    segments = expand_context(fused, VideoFrameIndex(frames))
+
+    for r in segments:
+        # what app.py renders for every segment
+        assert isinstance(r["score"], float) and r["hit_ids"]
+        assert "dense_score" in r and "sparse_score" in r
+        for field in ("filepath", "transcript", "contextual_frame_description", "timestamp_start", "timestamp_end"):
+            assert field in r["metadata"]
+    # the segment shows the scores of its best hit
+    assert {key: segments[0][key] for key in ("id", "dense_score", "sparse_score")} == {
+        key: fused[0][key] for key in ("id", "dense_score", "sparse_score")
+    }
@@ -0,0 +1,225 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import enrichment
+from enrichment import EnrichmentEngine, TokenBucket, call_with_backoff, chunk_frames, group_summaries
+from fakes import FakeBedrockClient, FakeThrottlingError
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    # every backoff draws a zero delay, so retries happen at once
+    monkeypatch.setattr(enrichment.random, "uniform", lambda low, high: 0.0)
+
+
+def test_token_bucket_allows_a_burst_then_paces_to_its_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    bucket.acquire()
+    bucket.acquire()
+    burst = time.monotonic() - started
+    bucket.acquire()
+    bucket.acquire()
+    paced = time.monotonic() - started
+
+    assert burst < 0.02
+    # two more tokens at 20 per second take about 0.1 s
+    assert 0.08 <= paced < 0.5
+
+
+def test_token_bucket_serves_requests_larger_than_its_capacity():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    started = time.monotonic()
+    bucket.acquire(50)
+    assert time.monotonic() - started < 0.05
+
+
+def test_call_with_backoff_retries_throttling_errors(no_backoff):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeThrottlingError("slow down")
+        return "done"
+
+    assert call_with_backoff(flaky, max_retries=5) == ("done", 2)
+
+
+def test_call_with_backoff_retries_bedrock_client_errors(no_backoff):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, "InvokeModel")
+        return "done"
+
+    assert call_with_backoff(flaky) == ("done", 1)
+
+
+def test_call_with_backoff_gives_up_after_max_retries(no_backoff):
+    attempts = []
+
+    def throttled():
+        attempts.append(1)
+        raise FakeThrottlingError("slow down")
+
+    with pytest.raises(FakeThrottlingError):
+        call_with_backoff(throttled, max_retries=2)
+    assert len(attempts) == 3
+
+
+def test_call_with_backoff_does_not_retry_other_errors(no_backoff):
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        call_with_backoff(broken)
+    assert len(attempts) == 1
+
+
+def frames_with_words(token_counts):
+    # 4 characters make a token, and every frame has words of its own
+    return [{"words": f"{i:03d} " * tokens} for i, tokens in enumerate(token_counts)]
+
+
+def test_chunk_frames_covers_every_frame_in_order_within_the_budget():
+    frames = frames_with_words([300] * 40)
+    sections = chunk_frames(frames, max_tokens=1000)
+
+    assert sections[0][0] == 0 and sections[-1][1] == len(frames)
+    assert all(end == start for (_, end), (start, _) in zip(sections, sections[1:]))
+    for start, end in sections:
+        tokens = sum(enrichment._tokens(f["words"]) for f in frames[start:end])
+        assert tokens <= 1000 or end - start == 1
+
+
+def test_chunk_frames_puts_a_long_frame_in_a_section_of_its_own():
+    frames = frames_with_words([100, 3000, 100])
+    assert (1, 2) in chunk_frames(frames, max_tokens=1000)
+
+
+def test_chunk_frames_realigns_soon_after_an_edit():
+    frames = frames_with_words([300] * 60)
+    edited = frames[:10] + [{"words": "an inserted frame " * 200}] + frames[10:]
+    before = chunk_frames(frames, max_tokens=1000)
+    after = chunk_frames(edited, max_tokens=1000)
+
+    # a few frames past the inserted one, the sections are cut at the same frames again, so their cached
+    # summaries are reused
+    shifted = [(start - 1, end - 1) for start, end in after if start > 11]
+    assert before[-len(shifted) :] == shifted
+    assert shifted[0][0] < 20
+
+
+def test_chunk_frames_of_no_frames_is_one_empty_section():
+    assert chunk_frames([]) == [(0, 0)]
+
+
+def test_group_summaries_shrinks_every_level():
+    summaries = ["s" * 400] * 7
+    groups = group_summaries(summaries, max_tokens=250)
+
+    assert sum(groups, []) == summaries
+    # only the odd one out at the end is left on its own
+    assert [len(group) for group in groups] == [2, 2, 2, 1]
+
+
+class CombineCountingClient:
+    """A FakeBedrockClient with answers of about 500 tokens, which counts the summaries being combined at once."""
+
+    def __init__(self):
+        self._client = FakeBedrockClient(latency=0.05, jitter=0)
+        self.messages = self
+        self.combined = self.combining = self.most_combining = 0
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        combine = "summaries of consecutive parts" in str(kwargs["messages"])
+        with self._lock:
+            self.combined += combine
+            self.combining += combine
+            self.most_combining = max(self.most_combining, self.combining)
+        try:
+            message = self._client.messages.create(**kwargs)
+        finally:
+            with self._lock:
+                self.combining -= combine
+        message.content[0].text = " ".join([message.content[0].text] * 60)
+        return message
+
+
+def test_summarize_and_enrich_combines_the_groups_of_each_level_at_once(make_frame):
+    frames = [
+        {"frame_path": make_frame(f"frame_{i}"), "words": f"words of frame {i} " * 150, "timestamp": (i, i + 1.0)}
+        for i in range(8)
+    ]
+    client = CombineCountingClient()
+    engine = EnrichmentEngine(client=client, max_in_flight=8, requests_per_second=1000, tokens_per_minute=1e9)
+
+    summary, sections, _ = engine.summarize_and_enrich(frames, skip=set(range(8)), max_chunk_tokens=1000)
+
+    # eight section summaries of ~500 tokens are combined in pairs: four at once, then two, then one
+    assert len(sections) == 8
+    assert client.combined == 7
+    assert client.most_combining == 4
+    assert summary.startswith("Fake response")
+    # a single worker gets through the levels too
+    serial = EnrichmentEngine(client=client, max_in_flight=1, requests_per_second=1000, tokens_per_minute=1e9)
+    assert serial.summarize_and_enrich(frames, skip=set(range(8)), max_chunk_tokens=1000)[0] == summary
+
+
+def test_summarize_and_enrich_describes_every_frame_in_order(make_frame):
+    frames = [
+        {
+            "frame_path": make_frame(f"frame_{i}", (i * 20, 0, 0)),
+            "words": f"words of frame {i} " * 150,
+            "timestamp": (i * 45.0, i * 45.0 + 45.0),
+        }
+        for i in range(8)
+    ]
+    engine = EnrichmentEngine(
+        client=FakeBedrockClient(latency=0, jitter=0), requests_per_second=1000, tokens_per_minute=1e9
+    )
+    results = []
+
+    summary, sections, descriptions = engine.summarize_and_enrich(
+        frames, skip={2}, on_result=lambda *result: results.append(result), max_chunk_tokens=1000
+    )
+
+    assert len(sections) > 1
+    assert summary.startswith("Fake response")
+    assert descriptions[2] is None
+    assert all(d.startswith("Fake response") for i, d in enumerate(descriptions) if i != 2)
+    assert sorted(index for index, _, _ in results) == [0, 1, 3, 4, 5, 6, 7]
+    section_summaries = {start: s for start, _, s in sections}
+    for index, description, section_summary in results:
+        assert description == descriptions[index]
+        start = max(s for s in section_summaries if s <= index)
+        assert section_summary == section_summaries[start]
+    assert engine.frames_done == 7
+
+
+def test_summarize_and_enrich_retries_throttled_requests(make_frame, no_backoff):
+    frames = [
+        {"frame_path": make_frame(f"frame_{i}"), "words": f"frame {i}", "timestamp": (i * 45.0, i * 45.0 + 45.0)}
+        for i in range(5)
+    ]
+    engine = EnrichmentEngine(
+        client=FakeBedrockClient(latency=0, jitter=0, throttle_rate=0.3, seed=1),
+        requests_per_second=1000,
+        tokens_per_minute=1e9,
+        max_retries=20,
+    )
+
+    _, _, descriptions = engine.summarize_and_enrich(frames)
+
+    assert all(descriptions)
+    assert engine.retries > 0
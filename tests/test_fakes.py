@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+
+from fakes import FakeBedrockClient, FakeBedrockRuntime, FakeIndex, FakeThrottlingError, fake_embedding
+from enrichment import is_throttling_error
+
+MESSAGES = [{"role": "user", "content": "Describe the slide."}]
+
+
+def test_fake_client_answers_the_same_request_the_same_way():
+    client = FakeBedrockClient(latency=0, jitter=0)
+    first = client.messages.create(model="m", max_tokens=100, messages=MESSAGES)
+    again = client.messages.create(model="m", max_tokens=100, messages=MESSAGES)
+    other = client.messages.create(model="m", max_tokens=100, messages=MESSAGES, system="Be brief.")
+
+    assert first.content[0].text == again.content[0].text
+    assert first.content[0].text != other.content[0].text
+    assert first.usage.output_tokens == 64
+    assert client.calls == 3
+
+
+def test_fake_stream_yields_the_text_of_create():
+    client = FakeBedrockClient(latency=0, jitter=0)
+    text = client.messages.create(model="m", max_tokens=100, messages=MESSAGES).content[0].text
+    with client.messages.stream(model="m", max_tokens=100, messages=MESSAGES) as stream:
+        pieces = list(stream.text_stream)
+
+    assert len(pieces) > 1
+    assert "".join(pieces) == text
+
+
+def test_fake_client_throttles_like_bedrock():
+    client = FakeBedrockClient(latency=0, jitter=0, throttle_rate=1.0)
+    with pytest.raises(FakeThrottlingError) as raised:
+        client.messages.create(model="m", max_tokens=100, messages=MESSAGES)
+
+    assert is_throttling_error(raised.value)
+    assert client.throttled == 1
+
+
+def test_fake_embeddings_are_deterministic_unit_vectors():
+    runtime = FakeBedrockRuntime(latency=0, jitter=0)
+    response = runtime.invoke_model(body='{"inputText": "a slide about caching", "dimensions": 256}', modelId="t")
+    embedding = np.array(json.loads(response["body"].read())["embedding"])
+
+    assert embedding.shape == (256,)
+    assert np.linalg.norm(embedding) == pytest.approx(1.0)
+    assert embedding.tolist() == fake_embedding("a slide about caching", 256)
+    assert fake_embedding("another slide", 256) != embedding.tolist()
+
+
+def test_fake_index_upserts_replaces_and_deletes():
+    index = FakeIndex()
+    index.upsert(vectors=[{"id": "a", "values": [1.0]}, {"id": "b", "values": [2.0]}])
+    index.upsert(vectors=[{"id": "a", "values": [3.0]}])
+    index.delete(ids=["b", "missing"])
+
+    assert index.describe_index_stats() == {"total_vector_count": 1}
+    assert index.vectors["a"]["values"] == [3.0]
+    assert index.upsert_calls == 2
+
+
+def test_fake_index_failure_stores_nothing():
+    index = FakeIndex(failure_rate=1.0)
+    with pytest.raises(FakeThrottlingError):
+        index.upsert(vectors=[{"id": "a", "values": [1.0]}])
+    assert index.vectors == {}
@@ -0,0 +1,65 @@
+import numpy as np
+
+from frame_dedup import difference_hashes, load_thumbnails, merge_duplicate_frames, run_starts
+
+
+def hashes_from_bits(*set_bits, width=64):
+    hashes = np.zeros((len(set_bits), width), dtype=bool)
+    for row, bits in enumerate(set_bits):
+        hashes[row, list(bits)] = True
+    return hashes
+
+
+def test_run_starts_splits_where_a_frame_stops_matching():
+    hashes = hashes_from_bits((), (1,), (), range(20), range(21), ())
+    assert run_starts(hashes, max_distance=2).tolist() == [0, 3, 5]
+
+
+def test_run_starts_compares_with_the_first_frame_of_the_run():
+    # every frame is one bit away from the one before, as in a slow pan, but drifts ever further from the first
+    hashes = hashes_from_bits(*[range(i) for i in range(10)])
+    assert run_starts(hashes, max_distance=3).tolist() == [0, 4, 8]
+
+
+def test_run_starts_of_no_frames():
+    assert run_starts(np.zeros((0, 64), dtype=bool)).tolist() == []
+
+
+def gradient(direction):
+    # a horizontal brightness ramp, rising or falling, so its difference hash is all ones or all zeros
+    return lambda x, y: (x * 4,) * 3 if direction > 0 else ((63 - x) * 4,) * 3
+
+
+def test_difference_hashes_of_identical_and_opposite_pictures(make_frame):
+    paths = [make_frame("a", gradient(1)), make_frame("b", gradient(1)), make_frame("c", gradient(-1))]
+    hashes = difference_hashes(load_thumbnails(paths, hash_size=8))
+
+    assert hashes.shape == (3, 64)
+    assert (hashes[0] == hashes[1]).all()
+    assert hashes[0].all() and not hashes[2].any()
+
+
+def test_merge_duplicate_frames_collapses_runs(make_frame):
+    rising, falling = make_frame("rising", gradient(1)), make_frame("falling", gradient(-1))
+    frames = [
+        {"frame_path": rising, "words": " a", "timestamp": (0.0, 10.0)},
+        {"frame_path": rising, "words": " b", "timestamp": (10.0, 20.0)},
+        {"frame_path": falling, "words": " c", "timestamp": (20.0, 30.0)},
+    ]
+
+    merged = merge_duplicate_frames(frames, hash_size=8, max_distance=4)
+
+    assert merged == [
+        {"frame_path": rising, "words": " a b", "timestamp": (0.0, 20.0), "merged_frames": 2},
+        {"frame_path": falling, "words": " c", "timestamp": (20.0, 30.0), "merged_frames": 1},
+    ]
+
+
+def test_merging_can_be_disabled(make_frame):
+    path = make_frame("same")
+    frames = [{"frame_path": path, "words": f" {i}", "timestamp": (i, i + 1.0)} for i in range(3)]
+
+    merged = merge_duplicate_frames(frames, max_distance=-1)
+
+    assert [f["merged_frames"] for f in merged] == [1, 1, 1]
+    assert [f["words"] for f in merged] == [" 0", " 1", " 2"]
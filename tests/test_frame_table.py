@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from frame_table import (
+    ENRICHED_COLUMNS,
+    FRAMES_AND_WORDS_COLUMNS,
+    FrameTableWriter,
+    count_frames,
+    iter_batches,
+    iter_frames,
+    read_column,
+    read_frames,
+    schema,
+    write_frames,
+)
+
+
+def enriched_frames(video, n):
+    return [
+        {
+            "video_id": video,
+            "index": i,
+            "frame_path": f"data/frames/{video}/frame_{i + 1:04d}.png",
+            "timestamp": (i * 45.0, i * 45.0 + 45.125),
+            "words": f"words of frame {i}",
+            "transcript_summary": f"summary of {video}",
+            "contextual_frame_description": f"description of frame {i}",
+        }
+        for i in range(n)
+    ]
+
+
+def test_frames_round_trip_with_their_timestamps(tmp_path):
+    frames = [dict(f, merged_frames=1) for f in enriched_frames("talk", 5)]
+    path = tmp_path / "talk.parquet"
+
+    write_frames(path, frames, FRAMES_AND_WORDS_COLUMNS)
+
+    expected = [
+        {key: f[key] for key in ("video_id", "index", "frame_path", "words", "merged_frames", "timestamp")}
+        for f in frames
+    ]
+    assert read_frames(path) == expected
+    assert count_frames(path) == 5
+
+
+def test_embeddings_round_trip_as_float32_rows(tmp_path):
+    frames = enriched_frames("talk", 7)
+    embeddings = np.random.default_rng(0).standard_normal((7, 16)).astype(np.float32)
+    path = tmp_path / "talk_embedded.parquet"
+
+    with FrameTableWriter(path, schema(ENRICHED_COLUMNS, 16), row_group_rows=3) as writer:
+        writer.write(frames, embeddings)
+
+    read = list(iter_frames(path, ["index", "embedding"]))
+    assert [frame for frame, _ in read] == [{"index": i} for i in range(7)]
+    assert np.array_equal(np.stack([embedding for _, embedding in read]), embeddings)
+    # written in row groups of 3, and streamed one row group at a time
+    assert [batch.num_rows for batch in iter_batches(path)] == [3, 3, 1]
+
+
+def test_columns_are_read_across_tables_in_order(tmp_path):
+    paths = []
+    for video in ("a", "b"):
+        paths.append(str(tmp_path / f"{video}.parquet"))
+        write_frames(paths[-1], enriched_frames(video, 2), ENRICHED_COLUMNS)
+
+    assert read_column(paths, "video_id") == ["a", "a", "b", "b"]
+    assert count_frames(paths) == 4
+
+
+def test_a_batch_read_from_one_table_is_written_to_another_with_embeddings(tmp_path):
+    source = tmp_path / "enriched.parquet"
+    write_frames(source, enriched_frames("talk", 4), ENRICHED_COLUMNS)
+    embeddings = np.arange(8, dtype=np.float32).reshape(4, 2)
+    target = tmp_path / "embedded.parquet"
+
+    with FrameTableWriter(target, schema(ENRICHED_COLUMNS, 2)) as writer:
+        for batch in iter_batches(source, ENRICHED_COLUMNS):
+            writer.write_batch(batch, embeddings)
+
+    assert read_frames(target, ENRICHED_COLUMNS) == read_frames(source)
+    assert np.array_equal(np.stack([e for _, e in iter_frames(target, ["index", "embedding"])]), embeddings)
+
+
+def test_a_failed_write_leaves_no_table_behind(tmp_path):
+    path = tmp_path / "tables" / "talk.parquet"
+    with pytest.raises(RuntimeError):
+        with FrameTableWriter(path, schema(ENRICHED_COLUMNS)) as writer:
+            writer.write(enriched_frames("talk", 2))
+            raise RuntimeError("interrupted")
+
+    assert list(path.parent.iterdir()) == []
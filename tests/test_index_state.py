@@ -0,0 +1,34 @@
+from index_state import IndexState, make_vector_id, record_fingerprint, vector_id_prefix
+
+
+def test_vector_ids_depend_only_on_the_video_and_the_start_time():
+    assert make_vector_id("talk", 45.0) == make_vector_id("talk", 45.0004)
+    assert make_vector_id("talk", 45.0) != make_vector_id("talk", 90.0)
+    assert make_vector_id("talk", 45.0).startswith(vector_id_prefix("talk"))
+    assert not make_vector_id("demo", 45.0).startswith(vector_id_prefix("talk"))
+
+
+def test_vector_ids_are_ascii_and_keep_similar_names_apart():
+    first, second = make_vector_id("Démo: 1/2", 0), make_vector_id("Démo 1 2", 0)
+
+    assert first.isascii() and second.isascii()
+    assert first != second
+
+
+def test_fingerprints_change_with_the_values_or_the_metadata():
+    record = {"id": "a", "values": [0.5, 0.25], "metadata": {"transcript": "hello", "n": 1}}
+
+    assert record_fingerprint(record) == record_fingerprint(dict(record, metadata={"n": 1, "transcript": "hello"}))
+    assert record_fingerprint(record) != record_fingerprint(dict(record, values=[0.5, 0.26]))
+    assert record_fingerprint(record) != record_fingerprint(dict(record, metadata={"transcript": "hello!", "n": 1}))
+
+
+def test_state_is_saved_per_index(tmp_path):
+    state = IndexState("test", root=tmp_path)
+    state.update({"a": "1", "b": "2"})
+    state.remove(["b"])
+    state.save()
+
+    assert IndexState("test", root=tmp_path).fingerprints == {"a": "1"}
+    assert IndexState("other", root=tmp_path).fingerprints == {}
+    assert IndexState("test", root=tmp_path).is_current("a", "1")
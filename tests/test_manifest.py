@@ -0,0 +1,104 @@
+import json
+import os
+
+from enrich_and_create_vectors import enrich_video
+from enrichment import EnrichmentEngine
+from fakes import FakeBedrockClient
+from frame_table import FRAMES_AND_WORDS_COLUMNS, read_frames, write_frames
+from manifest import STAGES, Manifest
+
+
+def write_video(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_redoing_a_stage_resets_the_stages_after_it(tmp_path):
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.sync_video("talk", write_video(tmp_path / "talk.mp4", b"video"))
+    for stage in STAGES:
+        manifest.mark_done("talk", stage, path=f"{stage}.out")
+
+    manifest.mark_done("talk", "frames_extracted", path="again.out")
+
+    kept = [stage for stage in STAGES if manifest.is_done("talk", stage)]
+    assert kept == ["decoded", "transcribed", "frames_extracted"]
+    assert manifest.stage("talk", "frames_extracted") == {"path": "again.out"}
+    # and every change is on disk already
+    assert Manifest(tmp_path / "manifest.json").videos == manifest.videos
+
+
+def test_a_changed_video_loses_its_stages_and_an_unchanged_one_keeps_them(tmp_path):
+    manifest = Manifest(tmp_path / "manifest.json")
+    video = write_video(tmp_path / "talk.mp4", b"video")
+    assert manifest.sync_video("talk", video)
+    manifest.mark_done("talk", "decoded")
+
+    # same content with a new modification time: the hash is checked again, and still matches
+    os.utime(video, (1, 1))
+    assert not manifest.sync_video("talk", video)
+    assert manifest.is_done("talk", "decoded")
+
+    write_video(tmp_path / "talk.mp4", b"edited video")
+    assert manifest.sync_video("talk", video)
+    assert not manifest.is_done("talk", "decoded")
+
+
+def test_missing_videos_are_dropped_and_read_only_manifests_stay_off_disk(tmp_path):
+    path = tmp_path / "manifest.json"
+    manifest = Manifest(path, read_only=True)
+    manifest.sync_video("talk", write_video(tmp_path / "talk.mp4", b"talk"))
+    manifest.sync_video("demo", write_video(tmp_path / "demo.mp4", b"demo"))
+
+    assert manifest.remove_missing(["demo"]) == ["talk"]
+    assert manifest.videos_at("decoded") == []
+    assert list(manifest.videos) == ["demo"]
+    assert not path.exists()
+
+
+def test_enrichment_resumes_from_a_partial_journal(tmp_path, make_frame):
+    frames = [
+        {
+            "video_id": "talk",
+            "index": i,
+            "frame_path": make_frame(f"frame_{i}", (i * 40, 0, 0)),
+            "timestamp": (i * 45.0, i * 45.0 + 45.0),
+            "words": f"words of frame {i}",
+            "merged_frames": 1,
+        }
+        for i in range(5)
+    ]
+    frames_path = str(tmp_path / "talk_frames_and_words.parquet")
+    write_frames(frames_path, frames, FRAMES_AND_WORDS_COLUMNS)
+    manifest = Manifest(tmp_path / "manifest.json", read_only=True)
+    manifest.videos["talk"] = {
+        "stages": {"frames_extracted": {"frames_and_words": frames_path, "frames_hash": "0123456789abcdef"}}
+    }
+    output_dir = tmp_path / "enriched"
+    output_dir.mkdir()
+    # frames 0 and 3 finished before the interruption, which tore the line of the next one
+    done = {
+        i: {
+            "index": i,
+            "frame_path": frames[i]["frame_path"],
+            "words": frames[i]["words"],
+            "timestamp": frames[i]["timestamp"],
+            "section_summary": "earlier summary",
+            "contextual_frame_description": f"earlier description {i}",
+        }
+        for i in (0, 3)
+    }
+    journal = output_dir / "talk_0123456789ab_enriched.jsonl"
+    journal.write_text("".join(json.dumps(record) + "\n" for record in done.values()) + '{"index": 1, "fra')
+    client = FakeBedrockClient(latency=0, jitter=0)
+    engine = EnrichmentEngine(client=client, requests_per_second=1000, tokens_per_minute=1e9)
+
+    enrich_video("talk", manifest, engine, output_dir=str(output_dir))
+
+    # one summary and the three frames that were not done
+    assert client.calls == 4
+    enriched = read_frames(manifest.stage("talk", "enriched")["path"])
+    descriptions = [f["contextual_frame_description"] for f in enriched]
+    assert descriptions[0] == "earlier description 0" and descriptions[3] == "earlier description 3"
+    assert all(d.startswith("Fake response") for i, d in enumerate(descriptions) if i not in (0, 3))
+    assert sorted(json.loads(line)["index"] for line in journal.read_text().splitlines()) == [0, 1, 2, 3, 4]
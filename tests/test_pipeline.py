@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+# the orchestrator imports every stage, Whisper's included
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from pipeline import run_pipeline  # noqa: E402
+
+
+def test_every_video_goes_through_every_stage():
+    seen = {"a": [], "b": []}
+    lock = threading.Lock()
+
+    def record(stage):
+        def fn(video):
+            with lock:
+                seen[stage].append(video)
+
+        return fn
+
+    stages, failed = run_pipeline(range(10), [("a", record("a"), 3), ("b", record("b"), 1)])
+
+    assert failed == {}
+    assert sorted(seen["a"]) == sorted(seen["b"]) == list(range(10))
+    assert [stage.done for stage in stages] == [10, 10]
+
+
+def test_a_failed_video_is_dropped_and_the_others_go_on():
+    def decode(video):
+        if video == 3:
+            raise RuntimeError("corrupt file")
+
+    indexed = []
+    stages, failed = run_pipeline(range(6), [("decode", decode, 2), ("index", indexed.append, 1)])
+
+    assert failed == {3: "decode"}
+    assert sorted(indexed) == [0, 1, 2, 4, 5]
+
+
+def test_a_slow_stage_holds_back_the_stages_before_it():
+    started = []
+    finished = []
+
+    def fast(video):
+        started.append(video)
+
+    def slow(video):
+        time.sleep(0.02)
+        finished.append(video)
+
+    def check_backlog(video):
+        # videos the fast stage let through, but the slow one has not finished
+        backlog.append(len(started) - len(finished))
+        fast(video)
+
+    backlog = []
+    run_pipeline(range(20), [("fast", check_backlog, 1), ("slow", slow, 1)], queue_size=2)
+
+    # at most queue_size videos waiting, one in the slow stage and the one being handed over
+    assert max(backlog) <= 4
+    assert finished == list(range(20))
+
+
+def test_stages_overlap_in_time():
+    def work(video):
+        time.sleep(0.05)
+
+    started = time.perf_counter()
+    stages, _ = run_pipeline(range(6), [("one", work, 1), ("two", work, 1), ("three", work, 1)])
+    elapsed = time.perf_counter() - started
+
+    # one after another the stages would take 0.9 s; pipelined, about the slowest stage plus the fill
+    assert elapsed < 0.6
+    assert all(stage.busy_s >= 0.3 for stage in stages)
@@ -0,0 +1,161 @@
+import json
+import shutil
+import subprocess
+import wave
+
+import pytest
+
+# preprocess_videos imports the transcription stage, Whisper's dependencies included
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import preprocess_videos  # noqa: E402
+from manifest import Manifest  # noqa: E402
+from preprocess_videos import (  # noqa: E402
+    decode_video,
+    extract_frames,
+    frame_windows,
+    needs_decode,
+    parse_duration,
+    save_transcription,
+)
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs the ffmpeg binary")
+
+# what ffmpeg prints about its input and progress, trimmed
+INPUT_LOG = """\
+Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'talk.mp4':
+  Duration: 01:02:03.50, start: 0.000000, bitrate: 251 kb/s
+  Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p, 1280x720, 25 fps
+frame=   83 fps=0.0 q=-0.0 size=N/A time=00:10:00.00 bitrate=N/A speed= 1200x
+"""
+
+# showinfo's lines for the frames a scene-sampling pass kept, trimmed
+SHOWINFO_LOG = """\
+  Duration: 00:00:24.00, start: 0.000000, bitrate: 40 kb/s
+[Parsed_showinfo_1 @ 0x5581] n:   0 pts:      0 pts_time:0       duration:   3072 fmt:yuv420p
+[Parsed_showinfo_1 @ 0x5581] n:   1 pts:  92160 pts_time:6       duration:   3072 fmt:yuv420p
+[Parsed_showinfo_1 @ 0x5581] n:   2 pts: 215040 pts_time:14.2    duration:   3072 fmt:yuv420p
+"""
+
+
+def make_video(path, filters, seconds):
+    """Renders a small test video from lavfi `filters`, with a tone as its audio track."""
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", filters, "-f", "lavfi", "-i", f"sine=d={seconds}"]
+        + ["-t", str(seconds), "-pix_fmt", "yuv420p", "-y", str(path)],
+        check=True,
+    )
+    return str(path)
+
+
+def test_the_duration_comes_from_the_input_description():
+    assert parse_duration(INPUT_LOG) == 3723.5
+
+
+def test_the_duration_falls_back_to_the_last_progress_time():
+    log = "frame=1 time=00:00:04.00 bitrate=N/A\nframe=2 time=00:01:30.25 bitrate=N/A\n"
+
+    assert parse_duration(log) == 90.25
+    with pytest.raises(ValueError):
+        parse_duration("Input #0, mov, from 'talk.mp4':\n")
+
+
+def test_interval_windows_follow_the_interval_and_the_last_ends_with_the_video():
+    frames = frame_windows(["f1.png", "f2.png", "f3.png"], "  Duration: 00:01:40.00, start: 0.0\n", "interval", 45)
+
+    assert [f["timestamp"] for f in frames] == [(0, 45), (45, 90), (90, 100.0)]
+    assert [f["frame_path"] for f in frames] == ["f1.png", "f2.png", "f3.png"]
+
+
+@needs_ffmpeg
+def test_one_pass_extracts_the_frames_the_audio_and_the_duration(tmp_path):
+    video = make_video(tmp_path / "talk.mp4", "testsrc=size=64x48:rate=5", seconds=10)
+    audio = tmp_path / "talk.wav"
+
+    frames = extract_frames(str(tmp_path), video, 4, audio_output_path=str(audio))
+
+    assert [f["timestamp"] for f in frames] == [(0, 4), (4, 8), (8, 10.0)]
+    with wave.open(str(audio), "rb") as f:
+        assert (f.getframerate(), f.getnchannels()) == (16000, 1)
+        assert f.getnframes() == pytest.approx(10 * 16000, rel=0.01)
+
+
+def test_scene_windows_run_from_each_kept_frame_to_the_next():
+    frames = frame_windows(["f1.png", "f2.png", "f3.png"], SHOWINFO_LOG, "scene", 45)
+
+    assert [f["timestamp"] for f in frames] == [(0.0, 6.0), (6.0, 14.2), (14.2, 24.0)]
+
+
+def test_scene_windows_need_a_time_for_every_frame():
+    with pytest.raises(RuntimeError):
+        frame_windows(["f1.png", "f2.png"], SHOWINFO_LOG, "scene", 45)
+
+
+@needs_ffmpeg
+def test_scene_sampling_keeps_frames_between_the_min_and_max_interval(tmp_path):
+    # red for 2s, blue for 4s, then green for 18s
+    colors = ";".join(
+        f"color=c={color}:s=64x48:r=5:d={seconds}[{label}]"
+        for label, color, seconds in (("a", "red", 2), ("b", "blue", 4), ("c", "green", 18))
+    )
+    video = make_video(tmp_path / "slides.mp4", f"{colors};[a][b][c]concat=n=3[out0]", seconds=24)
+
+    frames = extract_frames(str(tmp_path), video, 45, sampling="scene", min_interval=5, max_interval=8)
+
+    # the change to blue comes too soon after the first frame, the change to green is kept, and the
+    # unchanging green is sampled again every max_interval seconds
+    assert [f["timestamp"] for f in frames] == [(0.0, 6.0), (6.0, 14.0), (14.0, 22.0), (22.0, 24.0)]
+
+
+@pytest.fixture
+def decode(tmp_path, monkeypatch):
+    """decode_video over a stand-in for ffmpeg that writes the given audio; returns the manifest and a runner."""
+    for folder in ("frames_dir", "audio_dir", "transcriptions_dir"):
+        (tmp_path / folder).mkdir()
+        monkeypatch.setattr(preprocess_videos, folder, str(tmp_path / folder))
+    audio = {}
+
+    def extract(frames_output_path, video_path, interval, audio_output_path=None, sampling="interval"):
+        (tmp_path / "frames_dir" / "talk").mkdir(exist_ok=True)
+        with open(audio_output_path, "wb") as f:
+            f.write(audio["bytes"])
+        return [{"frame_path": "frame_0001.png", "timestamp": (0, 10.0)}]
+
+    monkeypatch.setattr(preprocess_videos, "extract_frames", extract)
+    video = tmp_path / "talk.mp4"
+    video.write_bytes(b"video")
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.sync_video("talk", str(video))
+
+    def run(audio_bytes, sampling="interval"):
+        audio["bytes"] = audio_bytes
+        decode_video(str(video), manifest, sampling)
+
+    return manifest, run
+
+
+def test_a_re_decode_keeps_the_transcription_of_the_same_audio(decode):
+    manifest, run = decode
+    run(b"audio")
+    save_transcription("talk", {"text": "hello", "chunks": []}, manifest)
+    words = manifest.stage("talk", "transcribed")["words"]
+
+    # only the frame sampling changed
+    assert needs_decode("talk", manifest, "scene")
+    run(b"audio", sampling="scene")
+
+    assert not needs_decode("talk", manifest, "scene")
+    assert manifest.stage("talk", "transcribed")["words"] == words
+    assert json.load(open(words))["text"] == "hello"
+
+
+def test_a_re_decode_with_different_audio_drops_the_transcription(decode):
+    manifest, run = decode
+    run(b"audio")
+    save_transcription("talk", {"text": "hello", "chunks": []}, manifest)
+
+    run(b"re-recorded audio", sampling="scene")
+
+    assert manifest.is_done("talk", "decoded")
+    assert not manifest.is_done("talk", "transcribed")
@@ -0,0 +1,76 @@
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from prompt_images import PromptImageCache
+from query_cache import QueryCache, mark_index_changed
+
+
+class StubIndex:
+    def query(self, vector, top_k, include_metadata=True, **kwargs):
+        return {"matches": []}
+
+
+def decode(payload):
+    return Image.open(io.BytesIO(base64.b64decode(payload)))
+
+
+def test_the_longest_edge_is_downscaled_and_the_aspect_ratio_kept(tmp_path, make_frame):
+    cache = PromptImageCache(tmp_path / "variants", max_edge=32)
+
+    large = decode(cache.get(make_frame("large", (200, 0, 0), size=(128, 64)))[1])
+    small = decode(cache.get(make_frame("small", (200, 0, 0), size=(16, 8)))[1])
+
+    assert large.size == (32, 16)
+    # smaller images are not upscaled
+    assert small.size == (16, 8)
+
+
+@pytest.mark.parametrize("image_format", ["jpeg", "png", "webp"])
+def test_variants_are_encoded_in_the_configured_format(tmp_path, make_frame, image_format):
+    cache = PromptImageCache(tmp_path / "variants", max_edge=32, image_format=image_format)
+
+    block = cache.image_block(make_frame("slide", (0, 120, 240)))
+
+    assert block["source"]["media_type"] == f"image/{image_format}"
+    assert decode(block["source"]["data"]).format == image_format.upper()
+
+
+def test_an_unknown_format_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        PromptImageCache(tmp_path, image_format="gif")
+
+
+def test_a_warm_lookup_comes_from_memory(tmp_path, make_frame):
+    cache = PromptImageCache(tmp_path / "variants", max_edge=32)
+    frame = make_frame("slide", (0, 120, 240))
+    payload = cache.get(frame)
+    os.remove(cache.variant_path(frame))
+
+    assert cache.get(frame) == payload
+    assert not os.path.exists(cache.variant_path(frame))
+    # the variant on disk is reused by a cold cache
+    assert PromptImageCache(tmp_path / "variants", max_edge=32).get(frame) == payload
+    assert os.path.exists(cache.variant_path(frame))
+
+
+def test_the_payloads_in_memory_are_dropped_when_the_index_changes(tmp_path, make_frame):
+    cache = PromptImageCache(tmp_path / "variants", max_edge=32)
+    frame = make_frame("slide", (0, 120, 240))
+    before = cache.get(frame)[1]
+    # what the app wires up: a re-upsert may come with re-extracted frames
+    queries = QueryCache("test", root=tmp_path, on_change=cache.clear_memory)
+    make_frame("slide", (240, 120, 0))
+    # a stale payload is served until the index says otherwise
+    assert cache.get(frame)[1] == before
+
+    mark_index_changed("test", root=tmp_path)
+    # the next query notices the change
+    queries.query(StubIndex(), [1.0, 0.0], top_k=1)
+
+    after = cache.get(frame)[1]
+    assert after != before
+    assert decode(after).getpixel((0, 0))[0] > decode(after).getpixel((0, 0))[2]
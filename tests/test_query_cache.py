@@ -0,0 +1,89 @@
+import pytest
+
+import query_cache
+from query_cache import QueryCache, TTLCache, mark_index_changed, normalize_query
+
+
+class StubIndex:
+    def __init__(self):
+        self.queries = 0
+
+    def query(self, vector, top_k, include_metadata=True, **kwargs):
+        self.queries += 1
+        return {"matches": [{"id": f"v{i}", "score": 1.0 - i / 10} for i in range(top_k)]}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(max_entries=10, ttl=60)
+    cache.put("a", 1)
+    clock[0] += 60
+    assert cache.get("a") == 1
+    clock[0] += 1
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_the_least_recently_used_entry_goes_first(clock):
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert [key for key in "abc" if cache.get(key) is not None] == ["a", "c"]
+
+
+def test_queries_differing_only_in_whitespace_share_an_embedding(tmp_path):
+    cache = QueryCache("test", root=tmp_path)
+    embedded = []
+
+    def embed(text):
+        embedded.append(text)
+        return [1.0, 0.0]
+
+    assert cache.embed("  what is  max_tokens?\n", embed) == ([1.0, 0.0], False)
+    assert cache.embed("what is max_tokens?", embed) == ([1.0, 0.0], True)
+    # another model's embedding of the same text is kept apart
+    assert cache.embed("what is max_tokens?", embed, variant="titan256") == ([1.0, 0.0], False)
+    assert embedded == ["what is max_tokens?"] * 2
+    assert normalize_query("a \t b\n") == "a b"
+
+
+def test_results_are_keyed_by_vector_top_k_and_filter(tmp_path):
+    cache = QueryCache("test", root=tmp_path)
+    index = StubIndex()
+
+    first, cached = cache.query(index, [1.0, 0.0], top_k=3)
+    assert not cached
+    assert cache.query(index, [1.0, 0.0], top_k=3) == (first, True)
+    cache.query(index, [1.0, 0.0], top_k=4)
+    cache.query(index, [1.0, 0.0], top_k=3, filter={"video_id": "talk"})
+
+    assert index.queries == 3
+
+
+def test_an_index_change_drops_the_matches_but_keeps_the_embeddings(tmp_path):
+    changes = []
+    cache = QueryCache("test", root=tmp_path, on_change=lambda: changes.append(1))
+    index = StubIndex()
+    cache.embed("query", lambda text: [1.0, 0.0])
+    cache.query(index, [1.0, 0.0], top_k=3)
+
+    mark_index_changed("test", root=tmp_path)
+
+    assert cache.query(index, [1.0, 0.0], top_k=3)[1] is False
+    assert cache.embed("query", lambda text: [0.0, 1.0]) == ([1.0, 0.0], True)
+    assert index.queries == 2
+    assert changes == [1]
+    # another index's change leaves the cache alone
+    mark_index_changed("other", root=tmp_path)
+    assert cache.query(index, [1.0, 0.0], top_k=3)[1] is True
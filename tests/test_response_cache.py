@@ -0,0 +1,120 @@
+import base64
+import importlib
+
+import pytest
+
+import config
+import response_cache
+from claude_utils import create_message
+from fakes import FakeBedrockClient
+from response_cache import ResponseCache, get_response_cache, use_response_cache
+
+
+def request(image_bytes, text="What is on the slide?"):
+    return {
+        "model": "m",
+        "max_tokens": 100,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": "image/png",
+                            "data": base64.b64encode(image_bytes).decode("utf-8"),
+                        },
+                    },
+                    {"type": "text", "text": text},
+                ],
+            }
+        ],
+    }
+
+
+def test_identical_requests_hit_and_a_changed_image_byte_misses():
+    client = FakeBedrockClient(latency=0, jitter=0)
+    image = bytes(range(256))
+
+    first = create_message(client, **request(image))
+    again = create_message(client, **request(image))
+    changed = create_message(client, **request(image[:100] + b"\xff" + image[101:]))
+
+    assert first == again
+    assert changed != first
+    assert client.calls == 2
+    assert get_response_cache().stats()["hits"] == 1
+
+
+def test_keys_ignore_dict_order_but_not_content():
+    assert ResponseCache.make_key(model="m", max_tokens=1) == ResponseCache.make_key(max_tokens=1, model="m")
+    assert ResponseCache.make_key(model="m", max_tokens=1) != ResponseCache.make_key(model="m", max_tokens=2)
+
+
+def test_hit_and_miss_counters(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    assert cache.get("a") is None
+    cache.put("a", "answer")
+    assert cache.get("a") == "answer"
+    assert cache.get("a") == "answer"
+
+    assert cache.stats() == {"hits": 2, "misses": 1, "entries": 1, "bytes": len("answer")}
+
+
+def test_least_recently_used_entries_are_evicted_past_the_size_limit(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=25)
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        cache.put(key, key * 10)
+    # 30 bytes are over the budget of 25, so the oldest entry went
+    assert cache.get("a") is None
+    now[0] += 1
+    cache.get("b")
+    now[0] += 1
+    cache.put("d", "d" * 10)
+
+    # b was read after c was written, so c is now the least recently used
+    assert [key for key in "abcd" if cache.get(key) is not None] == ["b", "d"]
+    assert cache.stats()["bytes"] == 20
+
+
+def test_bypass_misses_every_lookup_but_still_stores(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = ResponseCache(path, bypass=True)
+    cache.put("a", "answer")
+
+    assert cache.get("a") is None
+    assert ResponseCache(path).get("a") == "answer"
+
+
+def test_no_cache_makes_every_request_go_to_claude(tmp_path):
+    client = FakeBedrockClient(latency=0, jitter=0)
+    use_response_cache(ResponseCache(tmp_path / "cache.sqlite"))
+    create_message(client, **request(b"image"))
+    # what enrich_and_create_vectors.py --no-cache does to the process-wide cache
+    get_response_cache().bypass = True
+    create_message(client, **request(b"image"))
+
+    assert client.calls == 2
+
+
+@pytest.fixture
+def reloaded_config(monkeypatch):
+    # config reads the environment when imported
+    yield lambda: importlib.reload(config)
+    monkeypatch.undo()
+    importlib.reload(config)
+
+
+def test_the_bypass_environment_variable_bypasses_the_process_wide_cache(tmp_path, monkeypatch, reloaded_config):
+    monkeypatch.setenv("CLAUDE_CACHE_BYPASS", "1")
+    assert reloaded_config().CLAUDE_CACHE_BYPASS
+
+    monkeypatch.setattr(response_cache, "CLAUDE_CACHE_BYPASS", True)
+    monkeypatch.setattr(response_cache, "CLAUDE_CACHE_PATH", tmp_path / "cache.sqlite")
+    use_response_cache(None)
+
+    assert get_response_cache().bypass
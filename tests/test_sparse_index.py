@@ -0,0 +1,126 @@
+import pytest
+
+import sparse_index
+from sparse_index import SparseIndex, SparseIndexUpdates, fuse_matches, tokenize
+
+
+def record(record_id, transcript, description=""):
+    return {
+        "id": record_id,
+        "metadata": {"transcript": transcript, "contextual_frame_description": description},
+    }
+
+
+RECORDS = [
+    record("a", "Set max_tokens to 512 for short answers.", "A slide about request parameters."),
+    record("b", "The retry loop backs off exponentially.", "Code of a retry loop."),
+    record("c", "We saw ERR_CONN_RESET during the demo.", "A terminal showing a connection error."),
+    record("d", "Thanks for joining, see you next week.", "The closing slide."),
+]
+
+
+def test_tokenize_keeps_compounds_and_their_parts():
+    assert tokenize("Set max_tokens, use claude-3.5!") == (
+        ["set", "max_tokens", "max", "tokens", "use", "claude-3.5", "claude", "3", "5"]
+    )
+
+
+def test_query_ranks_exact_terms_first_and_skips_unrelated_records():
+    index = SparseIndex.build(RECORDS)
+
+    matches = index.query("what does err_conn_reset mean", top_k=3)["matches"]
+
+    assert [m["id"] for m in matches] == ["c"]
+    assert matches[0]["metadata"] == RECORDS[2]["metadata"]
+    assert matches[0]["score"] > 0
+
+
+def test_query_matches_the_parts_of_a_compound():
+    index = SparseIndex.build(RECORDS)
+    assert [m["id"] for m in index.query("max tokens", top_k=4)["matches"]] == ["a"]
+
+
+def test_query_returns_the_best_top_k():
+    index = SparseIndex.build(RECORDS)
+    matches = index.query("retry slide loop", top_k=2, include_metadata=False)["matches"]
+
+    assert [m["id"] for m in matches] == ["b", matches[1]["id"]]
+    assert matches[0]["score"] >= matches[1]["score"]
+    assert "metadata" not in matches[0]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = SparseIndex.build(RECORDS)
+    path = str(tmp_path / "sparse" / "index.npz")
+    index.save(path)
+
+    loaded = SparseIndex.load(path)
+
+    assert len(loaded) == len(RECORDS)
+    assert loaded.query("connection error", top_k=2) == index.query("connection error", top_k=2)
+
+
+def test_missing_and_empty_indexes_match_nothing(tmp_path):
+    assert len(SparseIndex.load(str(tmp_path / "missing.npz"))) == 0
+    assert SparseIndex.build([record("a", "")]).query("anything", top_k=5)["matches"] == []
+
+
+def test_fuse_matches_weights_normalized_scores():
+    metadata = {"transcript": ""}
+    dense = [{"id": "a", "score": 0.8, "metadata": metadata}, {"id": "b", "score": 0.4, "metadata": metadata}]
+    sparse = [{"id": "b", "score": 12.0, "metadata": metadata}, {"id": "c", "score": 6.0, "metadata": metadata}]
+
+    fused = fuse_matches(dense, sparse, top_k=3, sparse_weight=0.5)
+
+    assert [m["id"] for m in fused] == ["b", "a", "c"]
+    assert [m["score"] for m in fused] == pytest.approx([0.75, 0.5, 0.25])
+    assert fused[0]["dense_score"] == 0.4 and fused[0]["sparse_score"] == 12.0
+    assert fused[1]["sparse_score"] is None
+    assert fused[2]["dense_score"] is None
+
+
+def test_fuse_matches_at_the_extremes_is_one_list_alone():
+    metadata = {"transcript": ""}
+    dense = [{"id": "a", "score": 0.9, "metadata": metadata}, {"id": "b", "score": 0.1, "metadata": metadata}]
+    sparse = [{"id": "b", "score": 3.0, "metadata": metadata}]
+
+    assert [m["id"] for m in fuse_matches(dense, sparse, top_k=1, sparse_weight=0.0)] == ["a"]
+    assert [m["id"] for m in fuse_matches(dense, sparse, top_k=1, sparse_weight=1.0)] == ["b"]
+
+
+def video_record(video, i, transcript):
+    return {"id": f"{video}-{i}", "metadata": {"video_id": video, "transcript": transcript}}
+
+
+def test_updates_replace_one_video_and_save_at_most_every_interval(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(sparse_index.time, "monotonic", lambda: now[0])
+    path = str(tmp_path / "index.npz")
+    SparseIndex.build([video_record("talk", 0, "set max_tokens"), video_record("demo", 0, "a retry loop")]).save(path)
+    updates = SparseIndexUpdates(path, interval_s=60)
+
+    assert not updates.save_if_due()
+    updates.update("talk", [video_record("talk", 0, "welcome everyone")])
+    # the first change is saved at once
+    assert updates.save_if_due()
+    updates.update("new", [video_record("new", 0, "ERR_CONN_RESET again")])
+    now[0] += 30
+    assert not updates.save_if_due()
+    assert SparseIndex.load(path).query("err_conn_reset", top_k=1)["matches"] == []
+    now[0] += 30
+    assert updates.save_if_due()
+
+    saved = SparseIndex.load(path)
+    assert sorted(saved.ids) == ["demo-0", "new-0", "talk-0"]
+    assert saved.query("max_tokens", top_k=3)["matches"] == []
+    assert sorted(m["id"] for m in saved.query("err_conn_reset welcome", top_k=3)["matches"]) == ["new-0", "talk-0"]
+
+
+def test_updates_with_the_same_records_change_nothing(tmp_path):
+    path = str(tmp_path / "index.npz")
+    SparseIndex.build([video_record("talk", 0, "set max_tokens")]).save(path)
+    updates = SparseIndexUpdates(path, interval_s=0)
+
+    updates.update("talk", [video_record("talk", 0, "set max_tokens")])
+
+    assert not updates.save_if_due()
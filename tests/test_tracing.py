@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import tracing
+from claude_utils import stream_message
+from fakes import FakeBedrockClient
+from tracing import Tracer, capture, span, start_trace
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    # a tracer of this test alone, as the spans helpers use the process-wide one
+    tracer = Tracer()
+    monkeypatch.setattr(tracing, "_tracer", tracer)
+    return tracer
+
+
+def test_spans_nest_under_the_span_they_ran_in(tracer):
+    with capture() as spans:
+        with span("outer") as outer:
+            with span("inner"):
+                pass
+            tracer.record("worker", 0.5, counters={"tokens": 3})
+        with span("after"):
+            pass
+
+    by_name = {s.name: s for s in spans}
+    assert [s.name for s in spans] == ["inner", "worker", "outer", "after"]
+    assert by_name["inner"].parent == by_name["worker"].parent == outer.id
+    assert by_name["outer"].parent is None and by_name["after"].parent is None
+    assert by_name["worker"].duration_s == 0.5
+
+
+def test_summary_aggregates_spans_counters_and_errors(tracer):
+    for tokens in (10, 20):
+        with span("claude") as s:
+            s.add(input_tokens=tokens)
+    with pytest.raises(ValueError):
+        with span("claude"):
+            raise ValueError("bad request")
+    with span("upsert"):
+        tracer.count("upsert.batch", retries=2)
+
+    summary = tracer.summary()
+
+    assert summary["claude"]["count"] == 3
+    assert summary["claude"]["errors"] == 1
+    assert summary["claude"]["input_tokens"] == 30
+    assert summary["upsert"]["retries"] == 2 and summary["upsert.batch"]["retries"] == 2
+    assert summary["claude"]["p50_s"] <= summary["claude"]["p95_s"]
+    assert "claude" in tracer.format_summary()
+
+
+def test_spans_are_written_to_the_trace_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "_tracer", Tracer())
+    tracer = start_trace("test", root=tmp_path)
+    with span("outer", video="talk"):
+        with span("inner") as s:
+            s.add(bytes=5)
+    tracer.close()
+
+    records = [json.loads(line) for line in open(tracer.path)]
+    assert [r["name"] for r in records] == ["inner", "outer"]
+    assert records[0]["parent"] == records[1]["id"]
+    assert records[0]["counters"] == {"bytes": 5} and records[1]["attrs"] == {"video": "talk"}
+
+
+def test_a_stream_is_traced_once_done_and_spans_between_its_chunks_stay_the_callers(tracer):
+    client = FakeBedrockClient(latency=0, jitter=0)
+    request = {"model": "m", "max_tokens": 100, "messages": [{"role": "user", "content": "hello"}]}
+
+    with capture() as spans:
+        with span("answer") as answer:
+            for _ in stream_message(client, **request):
+                with span("render"):
+                    pass
+
+    streamed = [s for s in spans if s.name == "claude.stream"]
+    assert len(streamed) == 1
+    assert streamed[0].parent == answer.id
+    assert streamed[0].attrs["cached"] is False and streamed[0].attrs["ttft_ms"] > 0
+    assert all(s.parent == answer.id for s in spans if s.name == "render")
+
+
+def test_an_abandoned_stream_leaves_no_span_open(tracer):
+    client = FakeBedrockClient(latency=0, jitter=0)
+    request = {"model": "m", "max_tokens": 100, "messages": [{"role": "user", "content": "hello"}]}
+
+    with capture() as spans:
+        stream = stream_message(client, **request)
+        next(stream)
+        stream.close()
+        with span("next query"):
+            pass
+
+    assert [s.name for s in spans] == ["next query"]
+    assert spans[0].parent is None
+    assert "claude.stream" not in tracer.summary()
@@ -0,0 +1,61 @@
+import wave
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import transcription  # noqa: E402
+from transcription import SAMPLING_RATE, get_transcriber, load_audio, transcribe, transcribe_many  # noqa: E402
+
+
+def write_wav(path, seconds=1.0, rate=SAMPLING_RATE, channels=1):
+    samples = (np.sin(np.linspace(0, 100, int(seconds * rate) * channels)) * 16000).astype(np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def fake_whisper(monkeypatch):
+    # counts the pipelines built and answers with the number of samples each call was given
+    built = []
+
+    def pipeline(task, **kwargs):
+        built.append(kwargs["model"])
+        return lambda inputs, return_timestamps: {"text": str(len(inputs["raw"])), "chunks": []}
+
+    monkeypatch.setattr(transcription, "pipeline", pipeline)
+    get_transcriber.cache_clear()
+    yield built
+    get_transcriber.cache_clear()
+
+
+def test_extracted_audio_is_read_without_ffmpeg(tmp_path):
+    audio = load_audio(write_wav(tmp_path / "talk.wav", seconds=0.5))
+
+    assert audio.dtype == np.float32 and len(audio) == SAMPLING_RATE // 2
+    assert np.abs(audio).max() <= 1.0
+    with pytest.raises(ValueError):
+        load_audio(write_wav(tmp_path / "stereo.wav", channels=2))
+
+
+def test_the_model_is_loaded_once_for_every_file(tmp_path, fake_whisper):
+    paths = [write_wav(tmp_path / f"talk_{i}.wav", seconds=i + 1) for i in range(3)]
+
+    results = list(transcribe_many(paths, workers=1))
+
+    assert len(fake_whisper) == 1
+    assert [path for path, _, _ in results] == paths
+    assert [result["text"] for _, result, _ in results] == [str(SAMPLING_RATE * (i + 1)) for i in range(3)]
+
+
+def test_timings_report_the_audio_length_and_real_time_factor(tmp_path, fake_whisper):
+    _, timings = transcribe(write_wav(tmp_path / "talk.wav", seconds=2))
+
+    assert timings["audio_s"] == 2
+    assert timings["rtf"] == pytest.approx((timings["decode_s"] + timings["transcribe_s"]) / 2)
@@ -0,0 +1,172 @@
+import numpy as np
+import pytest
+
+import batch_upsert
+import upsert_vectors
+from embeddings import EmbeddingStore
+from fakes import FakeBedrockRuntime, FakeIndex, FakeThrottlingError, fake_embedding
+from frame_table import ENRICHED_COLUMNS, FrameTableWriter, iter_frames, schema, write_frames
+from index_state import IndexState, make_vector_id, vector_id_prefix
+from manifest import Manifest
+from sparse_index import SparseIndexUpdates
+from upsert_vectors import embed_videos, upsert_videos
+
+
+def embed_video(tmp_path, manifest, video, words):
+    frames = [
+        {
+            "video_id": video,
+            "index": i,
+            "frame_path": f"data/frames/{video}/frame_{i + 1:04d}.png",
+            "timestamp": (i * 45.0, i * 45.0 + 45.0),
+            "words": text,
+            "transcript_summary": f"summary of {video}",
+            "contextual_frame_description": f"description of frame {i}",
+        }
+        for i, text in enumerate(words)
+    ]
+    path = str(tmp_path / f"{video}_embedded.parquet")
+    with FrameTableWriter(path, schema(ENRICHED_COLUMNS, 4)) as writer:
+        writer.write(frames, np.ones((len(frames), 4), dtype=np.float32))
+    manifest.videos[video] = {"stages": {"embedded": {"path": path}}}
+
+
+def test_an_upserted_video_hands_its_records_to_the_keyword_index_updates(tmp_path):
+    manifest = Manifest(tmp_path / "manifest.json", read_only=True)
+    state = IndexState("test", root=tmp_path, read_only=True)
+    updates = SparseIndexUpdates(str(tmp_path / "sparse.npz"), interval_s=0)
+    embed_video(tmp_path, manifest, "talk", ["welcome everyone", "set max_tokens"])
+
+    upsert_videos(["talk"], manifest, FakeIndex(), state, subset=True, sparse_updates=updates)
+
+    assert [r["metadata"]["transcript"] for r in updates.records["talk"]] == ["welcome everyone", "set max_tokens"]
+    assert updates.changed
+
+
+def enrich_video(tmp_path, manifest, video, n):
+    frames = [
+        {
+            "video_id": video,
+            "index": i,
+            "frame_path": f"data/frames/{video}/frame_{i + 1:04d}.png",
+            "timestamp": (i * 45.0, i * 45.0 + 45.0),
+            "words": f"words {i}",
+            "transcript_summary": f"summary of {video}",
+            "contextual_frame_description": f"{video} frame {i}",
+        }
+        for i in range(n)
+    ]
+    path = str(tmp_path / f"{video}_enriched.parquet")
+    write_frames(path, frames, ENRICHED_COLUMNS)
+    manifest.videos[video] = {"stages": {"enriched": {"path": path}}}
+
+
+def test_videos_are_embedded_and_written_one_at_a_time(tmp_path, monkeypatch):
+    manifest = Manifest(tmp_path / "manifest.json", read_only=True)
+    enrich_video(tmp_path, manifest, "talk", 5)
+    enrich_video(tmp_path, manifest, "demo", 3)
+    embedded_at_once = []
+
+    def embed_texts(texts, *args, **kwargs):
+        embedded_at_once.append(len(texts))
+        return real_embed_texts(texts, *args, **kwargs)
+
+    real_embed_texts = upsert_vectors.embed_texts
+    monkeypatch.setattr(upsert_vectors, "embed_texts", embed_texts)
+    store = EmbeddingStore("titan", 8, root=tmp_path / "embeddings")
+
+    embed_videos(["talk", "demo"], manifest, store, client=FakeBedrockRuntime(latency=0, jitter=0), output_dir=tmp_path)
+
+    # only one video's descriptions, and so its embeddings, are in memory at a time
+    assert embedded_at_once == [5, 3]
+    for video, n in (("talk", 5), ("demo", 3)):
+        rows = list(iter_frames(manifest.stage(video, "embedded")["path"], ["index", "embedding"]))
+        assert [frame["index"] for frame, _ in rows] == list(range(n))
+        expected = [fake_embedding(f"{video} frame {i}", 8) for i in range(n)]
+        assert np.stack([embedding for _, embedding in rows]) == pytest.approx(np.array(expected), abs=1e-6)
+
+
+class FailingIndex(FakeIndex):
+    # every upsert of one video's vectors fails
+    def __init__(self, video):
+        super().__init__()
+        self.prefix = vector_id_prefix(video)
+
+    def upsert(self, vectors, namespace=None):
+        if vectors[0]["id"].startswith(self.prefix):
+            raise FakeThrottlingError("Fake upsert failure")
+        return super().upsert(vectors, namespace)
+
+
+def test_a_video_whose_upsert_fails_is_left_unmarked(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_upsert.time, "sleep", lambda seconds: None)
+    manifest = Manifest(tmp_path / "manifest.json", read_only=True)
+    state = IndexState("test", root=tmp_path, read_only=True)
+    embed_video(tmp_path, manifest, "talk", ["welcome everyone"])
+    embed_video(tmp_path, manifest, "demo", ["ERR_CONN_RESET again"])
+
+    with pytest.raises(RuntimeError, match="demo"):
+        upsert_videos(["talk", "demo"], manifest, FailingIndex("demo"), state)
+
+    assert manifest.is_done("talk", "upserted")
+    assert not manifest.is_done("demo", "upserted")
+    # and it is sent again next time
+    assert all(not i.startswith(vector_id_prefix("demo")) for i in state.fingerprints)
+
+
+class CountingIndex(FakeIndex):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def upsert(self, vectors, namespace=None):
+        self.sent.extend(v["id"] for v in vectors)
+        return super().upsert(vectors, namespace)
+
+
+@pytest.fixture
+def upsert(tmp_path):
+    manifest = Manifest(tmp_path / "manifest.json", read_only=True)
+    state = IndexState("test", root=tmp_path, read_only=True)
+    index = CountingIndex()
+
+    def run(words_by_video, delta=True):
+        for video, words in words_by_video.items():
+            embed_video(tmp_path, manifest, video, words)
+        index.sent = []
+        upsert_videos(list(words_by_video), manifest, index, state, delta=delta)
+        return sorted(index.sent)
+
+    run.index = index
+    return run
+
+
+def test_ids_survive_reordering_and_added_videos(upsert):
+    upsert({"talk": ["welcome", "set max_tokens"]})
+    ids = sorted(upsert.index.vectors)
+
+    assert upsert({"demo": ["a retry loop"], "talk": ["welcome", "set max_tokens"]}) == [
+        make_vector_id("demo", 0.0)
+    ]
+    assert set(ids) < set(upsert.index.vectors)
+
+
+def test_only_changed_records_are_sent_again(upsert):
+    upsert({"talk": ["welcome", "set max_tokens", "thanks"]})
+
+    assert upsert({"talk": ["welcome", "set max_tokens to 512", "thanks"]}) == [make_vector_id("talk", 45.0)]
+
+
+def test_records_gone_locally_are_deleted(upsert):
+    upsert({"talk": ["welcome", "set max_tokens", "thanks"]})
+
+    assert upsert({"talk": ["welcome"]}) == []
+    assert sorted(upsert.index.vectors) == [make_vector_id("talk", 0.0)]
+
+
+def test_a_full_upsert_rewrites_everything(upsert):
+    upsert({"talk": ["welcome", "set max_tokens"]})
+
+    assert upsert({"talk": ["welcome", "set max_tokens"]}) == []
+    assert upsert({"talk": ["welcome", "set max_tokens"]}, delta=False) == sorted(upsert.index.vectors)
+    assert len(upsert.index.vectors) == 2
@@ -0,0 +1,173 @@
+import numpy as np
+import pytest
+
+from two_stage import TwoStageIndex
+from vector_store import LocalVectorStore, VectorStore
+
+
+def records(n, dimension=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, dimension)).astype(np.float32)
+    return [
+        {"id": f"v{i}", "values": vectors[i].tolist(), "metadata": {"n": i, "video_id": f"video{i % 3}"}}
+        for i in range(n)
+    ]
+
+
+def ids(result):
+    return [m["id"] for m in result["matches"]]
+
+
+def exact_top(vectors, query, k):
+    matrix = np.array([v["values"] for v in vectors])
+    scores = matrix @ query / np.linalg.norm(matrix, axis=1) / np.linalg.norm(query)
+    return [vectors[i]["id"] for i in np.argsort(-scores)[:k]]
+
+
+def test_vector_store_is_an_interface():
+    with pytest.raises(TypeError):
+        VectorStore()
+
+
+def test_query_ranks_by_cosine_similarity(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann=None)
+    vectors = records(100)
+    store.upsert(vectors)
+
+    result = store.query(vectors[7]["values"], top_k=5, include_metadata=True)
+
+    assert ids(result) == exact_top(vectors, np.array(vectors[7]["values"]), 5)
+    assert result["matches"][0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert result["matches"][0]["metadata"]["n"] == 7
+
+
+def test_upsert_replaces_and_delete_removes(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann=None)
+    vectors = records(10)
+    store.upsert(vectors)
+    store.upsert([{"id": "v1", "values": vectors[2]["values"], "metadata": {"n": 100}}])
+    store.delete(ids=["v2"])
+
+    result = store.query(vectors[2]["values"], top_k=10, include_metadata=True)
+
+    assert result["matches"][0]["id"] == "v1" and result["matches"][0]["metadata"] == {"n": 100}
+    assert "v2" not in ids(result)
+    assert store.describe_index_stats()["total_vector_count"] == 9
+
+
+def test_metadata_filters(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann=None)
+    vectors = records(30)
+    store.upsert(vectors)
+    query = vectors[0]["values"]
+
+    def found(filter):
+        return sorted(int(i[1:]) for i in ids(store.query(query, top_k=30, filter=filter)))
+
+    assert found({"video_id": "video1"}) == list(range(1, 30, 3))
+    assert found({"n": {"$in": [3, 4, 99]}}) == [3, 4]
+    assert found({"n": {"$gte": 25}}) == [25, 26, 27, 28, 29]
+    assert found({"$and": [{"n": {"$lt": 10}}, {"video_id": {"$ne": "video0"}}]}) == [1, 2, 4, 5, 7, 8]
+    assert found({"$or": [{"n": 0}, {"n": {"$gt": 28}}]}) == [0, 29]
+    with pytest.raises(ValueError):
+        found({"n": {"$regex": "1"}})
+
+
+def test_namespaces_are_kept_apart(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann=None)
+    vectors = records(4)
+    store.upsert(vectors[:2], namespace="one")
+    store.upsert(vectors[2:], namespace="two")
+
+    assert sorted(ids(store.query(vectors[0]["values"], top_k=4, namespace="one"))) == ["v0", "v1"]
+    assert ids(store.query(vectors[0]["values"], top_k=4)) == []
+
+
+def test_save_and_reopen(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann=None)
+    vectors = records(20)
+    store.upsert(vectors)
+    store.delete(ids=["v3"])
+    store.save()
+    store.upsert([{"id": "unsaved", "values": vectors[0]["values"]}])
+
+    reopened = LocalVectorStore(tmp_path, 32, ann=None)
+
+    assert reopened.describe_index_stats()["total_vector_count"] == 19
+    assert ids(reopened.query(vectors[5]["values"], top_k=3)) == ids(store.query(vectors[5]["values"], top_k=3))
+    store.reload()
+    assert "unsaved" not in ids(store.query(vectors[0]["values"], top_k=20))
+
+
+def test_ivf_finds_the_nearest_vectors(tmp_path):
+    vectors = records(2000)
+    store = LocalVectorStore(tmp_path, 32, ann="ivf", nprobe=8)
+    store.upsert(vectors)
+    store.save()
+    # rows added after the IVF lists were built are searched too
+    store.upsert([{"id": "late", "values": vectors[0]["values"]}])
+
+    found = [set(ids(store.query(vectors[i]["values"], top_k=10))) for i in range(20)]
+    exact = [set(exact_top(vectors, np.array(vectors[i]["values"]), 10)) for i in range(20)]
+    recall = np.mean([len(f & e) / 10 for f, e in zip(found, exact)])
+    assert recall >= 0.6
+    assert "late" in ids(store.query(vectors[0]["values"], top_k=2))
+
+
+def test_ivf_state_is_dropped_when_everything_is_deleted(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann="ivf")
+    vectors = records(50)
+    store.upsert(vectors)
+    store.save()
+    store.delete(ids=[v["id"] for v in vectors])
+    store.save()
+    store.upsert(vectors[:1])
+
+    assert not (tmp_path / "ivf.npz").exists()
+    assert ids(store.query(vectors[0]["values"], top_k=5)) == ["v0"]
+
+
+@pytest.mark.parametrize("quantization, bytes_per_vector", [("int8", 32), ("binary", 4)])
+def test_quantized_stores_are_smaller_and_rank_close_to_exact(tmp_path, quantization, bytes_per_vector):
+    vectors = records(300)
+    store = LocalVectorStore(tmp_path, 32, ann=None, quantization=quantization)
+    store.upsert(vectors)
+    store.save()
+
+    assert np.load(tmp_path / "vectors.npy").nbytes == 300 * bytes_per_vector
+    query = vectors[11]["values"]
+    assert ids(store.query(query, top_k=1)) == ["v11"]
+    assert len(set(ids(store.query(query, top_k=30))) & set(exact_top(vectors, np.array(query), 10))) >= 7
+    with pytest.raises(ValueError):
+        LocalVectorStore(tmp_path, 32, ann=None)
+
+
+def test_get_vectors_returns_unit_rows_of_the_ids_found(tmp_path):
+    store = LocalVectorStore(tmp_path, 32, ann=None)
+    vectors = records(5)
+    store.upsert(vectors[:3])
+    store.save()
+    store.upsert(vectors[3:])
+
+    found, matrix = store.get_vectors(["v4", "missing", "v0"])
+
+    assert found == ["v4", "v0"]
+    expected = np.array([vectors[4]["values"], vectors[0]["values"]])
+    assert matrix == pytest.approx(expected / np.linalg.norm(expected, axis=1, keepdims=True), abs=1e-6)
+
+
+def test_two_stage_index_reranks_candidates_with_the_full_vectors(tmp_path):
+    vectors = records(400, dimension=64)
+    first_stage = LocalVectorStore(tmp_path / "first", 64, ann=None, quantization="binary")
+    index = TwoStageIndex(first_stage, LocalVectorStore(tmp_path / "rerank", 64, ann=None), candidates=50)
+    index.upsert(vectors)
+
+    query = np.array(vectors[42]["values"]) + np.random.default_rng(1).normal(0, 0.1, 64)
+    result = index.query(query.tolist(), top_k=5, include_metadata=True, filter={"n": {"$ne": 7}})
+
+    assert ids(result)[0] == "v42"
+    assert result["matches"][0]["metadata"]["n"] == 42
+    assert "first_stage_score" in result["matches"][0]
+    scores = [m["score"] for m in result["matches"]]
+    assert scores == sorted(scores, reverse=True)
+    index.delete(ids=["v42"])
+    assert "v42" not in ids(index.query(query.tolist(), top_k=5))
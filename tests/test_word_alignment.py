@@ -0,0 +1,61 @@
+import pytest
+
+from word_alignment import assign_words_to_frames
+
+FRAMES = [
+    {"frame_path": "frame_0001.png", "timestamp": (0.0, 10.0)},
+    {"frame_path": "frame_0002.png", "timestamp": (10.0, 20.0)},
+    {"frame_path": "frame_0003.png", "timestamp": (20.0, 30.0)},
+]
+
+
+def transcription(*words):
+    return {"chunks": [{"text": text, "timestamp": (start, end)} for text, start, end in words]}
+
+
+def words_of(frames):
+    return [f["words"] for f in frames]
+
+
+def test_words_go_to_the_window_they_are_spoken_in():
+    spoken = transcription((" one", 1.0, 2.0), (" two", 12.0, 13.0), (" three", 14.0, 15.0), (" four", 25.0, 26.0))
+    frames = assign_words_to_frames(spoken, FRAMES)
+
+    assert words_of(frames) == [" one", " two three", " four"]
+    assert [f["timestamp"] for f in frames] == [f["timestamp"] for f in FRAMES]
+    assert [f["frame_path"] for f in frames] == [f["frame_path"] for f in FRAMES]
+
+
+def test_a_straddling_word_goes_to_the_window_of_its_midpoint():
+    spoken = transcription((" early", 9.0, 10.6), (" late", 9.8, 12.0))
+    assert words_of(assign_words_to_frames(spoken, FRAMES, "midpoint")) == [" early", " late", ""]
+
+
+def test_a_straddling_word_is_duplicated_into_every_window_it_overlaps():
+    spoken = transcription((" long", 8.0, 22.0), (" short", 15.0, 16.0))
+    assert words_of(assign_words_to_frames(spoken, FRAMES, "duplicate")) == [" long", " long short", " long"]
+
+
+def test_words_outside_every_window_are_dropped():
+    frames = [{"frame_path": "frame_0001.png", "timestamp": (5.0, 10.0)}]
+    spoken = transcription((" before", 1.0, 2.0), (" during", 6.0, 7.0), (" after", 11.0, 12.0))
+
+    for boundary in ("midpoint", "duplicate"):
+        assert words_of(assign_words_to_frames(spoken, frames, boundary)) == [" during"]
+
+
+def test_the_last_window_keeps_a_word_ending_the_video():
+    spoken = transcription((" end", 30.0, 30.0))
+    for boundary in ("midpoint", "duplicate"):
+        assert words_of(assign_words_to_frames(spoken, FRAMES, boundary))[-1] == " end"
+
+
+def test_a_word_without_an_end_time_counts_as_an_instant():
+    spoken = transcription((" last", 21.0, None))
+    assert words_of(assign_words_to_frames(spoken, FRAMES)) == ["", "", " last"]
+
+
+def test_no_frames_and_unknown_policies():
+    assert assign_words_to_frames(transcription((" word", 1.0, 2.0)), []) == []
+    with pytest.raises(ValueError):
+        assign_words_to_frames(transcription(), FRAMES, "strict")